@@ -0,0 +1,163 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Backlog drain benchmark: time taken by MQTTService to publish
+a backlog of queued messages, for several QoS and window sizes.
+The broker is either:
+- simulated: a protocol whose QoS 0 publications complete at once and 
+  whose QoS 1 publications are acknowledged in the next reactor iteration.
+- memory: the in-process FakeBroker through in-memory transports.
+- tcp: the in-process FakeBroker on a localhost TCP port.
+
+    PYTHONPATH=. python benchmarks/bench_drain.py [--backlog 10000] [--window 1 3 16] 
+        [--transport simulated|memory|tcp] [--latency 0]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import argparse
+import configparser
+import time
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.internet import reactor, defer, task
+
+#--------------
+# local imports
+# -------------
+
+from tessw.config      import loadBrokerSection
+from tessw.mqttqueue   import Message
+from tessw.mqttservice import MQTTService
+from tessw.fakebroker  import FakeBroker, MemoryEndpoint
+
+# ----------------
+# Module constants
+# ----------------
+
+CONFIG = '''
+[mqtt]
+broker       = tcp:localhost:1883
+username     =
+password     =
+keepalive    = 60
+topic        = STARS4ALL
+log_level    = warn
+log_messages = warn
+'''
+
+PAYLOAD = '{"tbox": 21.37, "tsky": -8.15, "freq": 1234.56, "seq": 123456, "mag": 19.77, "rev": 2, "name": "stars1"}'
+
+# -------
+# Classes
+# -------
+
+class SimulatedProtocol(object):
+    '''Just the publish() method of an MQTT client protocol'''
+
+    def __init__(self):
+        self.published = 0
+        self.done = None
+
+    def publish(self, topic, message, qos=0):
+        self.published += 1
+        if qos == 0:
+            deferred = defer.succeed(None)
+        else:
+            deferred = task.deferLater(reactor, 0, lambda: None)
+        if self.published == self.expected:
+            deferred.addCallback(lambda _: reactor.callLater(0, self.done.callback, time.perf_counter()))
+        return deferred
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def cmdline():
+    parser = argparse.ArgumentParser(description="MQTT backlog drain benchmark")
+    parser.add_argument('--backlog', type=int, default=10000, help='queued messages')
+    parser.add_argument('--window',  type=int, nargs='+', default=[1, 3, 16], help='messages in flight')
+    parser.add_argument('--transport', choices=('simulated', 'memory', 'tcp'), default='simulated', help='broker')
+    parser.add_argument('--latency', type=float, default=0, help='FakeBroker reply latency, in seconds')
+    return parser.parse_args()
+
+
+def service(window, size, broker="tcp:localhost:1883"):
+    parser = configparser.RawConfigParser()
+    parser.read_string(CONFIG)
+    options = loadBrokerSection(parser, "mqtt")
+    options['broker']     = broker
+    options['window']     = window
+    options['queue_size'] = size
+    options['queue_bytes'] = size * (len(PAYLOAD) + 64)
+    return MQTTService(options)
+
+
+@defer.inlineCallbacks
+def measure(window, qos, backlog):
+    '''Returns the drain time in seconds'''
+    mqttService = service(window, backlog)
+    protocol = SimulatedProtocol()
+    protocol.expected = backlog
+    protocol.done     = defer.Deferred()
+    for i in range(backlog):
+        mqttService.queue.put(Message("STARS4ALL/stars1/reading", PAYLOAD, qos=qos))
+    mqttService.protocol = protocol
+    start = time.perf_counter()
+    mqttService.task = mqttService.publish()
+    end = yield protocol.done
+    mqttService._stopPublishing()
+    return end - start
+
+
+@defer.inlineCallbacks
+def measureBroker(window, qos, backlog, transport, latency):
+    '''Returns the drain time in seconds, including the connection to the FakeBroker'''
+    broker = FakeBroker(latency=latency)
+    if transport == 'tcp':
+        port = yield broker.listen("tcp:0:interface=127.0.0.1")
+        mqttService = service(window, backlog, "tcp:127.0.0.1:{0}".format(port.getHost().port))
+    else:
+        mqttService = service(window, backlog)
+        mqttService.endpoint.endpoints = [MemoryEndpoint(broker)]
+    for i in range(backlog):
+        mqttService.queue.put(Message("STARS4ALL/stars1/reading", PAYLOAD, qos=qos))
+    start = time.perf_counter()
+    mqttService.startService()
+    yield broker.waitFor(backlog)
+    end = time.perf_counter()
+    yield mqttService.stopService()
+    yield broker.stop()
+    return end - start
+
+
+@defer.inlineCallbacks
+def main():
+    options = cmdline()
+    print("{0:>4} {1:>7} {2:>9} {3:>12} {4:>10}".format("qos", "window", "backlog", "seconds", "msg/s"))
+    try:
+        for qos in (0, 1):
+            for window in options.window:
+                if options.transport == 'simulated':
+                    elapsed = yield measure(window, qos, options.backlog)
+                else:
+                    elapsed = yield measureBroker(window, qos, options.backlog, options.transport, options.latency)
+                print("{0:>4} {1:>7} {2:>9} {3:>12.3f} {4:>10.0f}".format(qos, window, options.backlog, elapsed, options.backlog/elapsed))
+    finally:
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,101 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Micro-benchmark of payload encodings: encode time and bytes per reading,
+for single readings and for batches.
+
+    PYTHONPATH=. python benchmarks/bench_encoding.py [--batch 1 10 60] [--number 20000]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import argparse
+import timeit
+
+#--------------
+# local imports
+# -------------
+
+from tessw.encoding import Encoder, available
+from tessw.batcher  import encodeBatch
+
+# ----------------
+# Module constants
+# ----------------
+
+# A curated reading, as published by an old firmware TESS-W
+READING = {
+    'tbox' : 21.37,
+    'tsky' : -8.15,
+    'freq' : 1234.56,
+    'seq'  : 123456,
+    'mag'  : 19.77,
+    'rev'  : 2,
+    'name' : 'stars1',
+    'alt'  : 0.0,
+    'azi'  : 0.0,
+    'wdBm' : 0,
+}
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def cmdline():
+    parser = argparse.ArgumentParser(description="Payload encoding micro-benchmark")
+    parser.add_argument('--batch',  type=int, nargs='+', default=[1, 10, 60], help='readings per message')
+    parser.add_argument('--number', type=int, default=20000, help='messages encoded per measurement')
+    return parser.parse_args()
+
+
+def readings(n):
+    return [dict(READING, seq=READING['seq']+i, mag=READING['mag']+i/100) for i in range(n)]
+
+
+def measure(encoder, n, number):
+    '''Returns (microseconds per reading, bytes per reading)'''
+    if n == 1:
+        obj = readings(1)[0]
+        encode = lambda: encoder.encode(obj)
+    else:
+        batch = readings(n)
+        encode = lambda: encoder.encode(encodeBatch(batch), separators=(',',':'))
+    size = len(encode())
+    elapsed = min(timeit.repeat(encode, number=number, repeat=3))
+    return 1e6*elapsed/(number*n), size/n
+
+
+def measureTemplate(encoder, number):
+    '''Same as measure() for single readings encoded by a per-photometer template'''
+    obj = readings(1)[0]
+    encode = encoder.template()
+    size = len(encode(obj))
+    elapsed = min(timeit.repeat(lambda: encode(obj), number=number, repeat=3))
+    return 1e6*elapsed/number, size
+
+
+def main():
+    options = cmdline()
+    print("{0:<14} {1:>6} {2:>12} {3:>14}".format("encoding", "batch", "us/reading", "bytes/reading"))
+    for n in options.batch:
+        for encoding in available():
+            for compress in ((False,) if n == 1 else (False, True)):
+                encoder = Encoder(encoding, compress)
+                usecs, nbytes = measure(encoder, n, max(1, options.number//n))
+                label = encoding + ("-zlib" if compress else "")
+                print("{0:<14} {1:>6} {2:>12.2f} {3:>14.1f}".format(label, n, usecs, nbytes))
+        if n == 1:
+            usecs, nbytes = measureTemplate(Encoder(), options.number)
+            print("{0:<14} {1:>6} {2:>12.2f} {3:>14.1f}".format("json-template", n, usecs, nbytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,11 @@ DEPENDENCIES = [
                   'twisted-mqtt'
                 ]
 
+EXTRAS       = {
+                  'msgpack' : ['msgpack'],
+                  'cbor'    : ['cbor2'],
+                }
+
 CLASSIFIERS  = [
     'Environment :: Console',
     'Intended Audience :: Science/Research',
@@ -38,6 +43,7 @@ DATA_FILES  = [
 
 SCRIPTS = [
     'files/usr/local/bin/tessw',
+    'files/usr/local/bin/tessw-top',
 ]
                                 
 setup(name                  = PKG_NAME,
@@ -54,6 +60,7 @@ setup(name                  = PKG_NAME,
           classifiers      = CLASSIFIERS,
           packages         = PACKAGES,
           install_requires = DEPENDENCIES,
+          extras_require   = EXTRAS,
           data_files       = DATA_FILES,
           scripts          = SCRIPTS,
           python_requires  ='>=3.5'
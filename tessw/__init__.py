@@ -41,6 +41,11 @@ VERSION_STRING = "{0} on Twisted {1}, Python {2}.{3}".format(__version__, __twis
 PHOTOMETER_SERVICE = 'Photometer Service'
 MQTT_SERVICE       = 'MQTT Service'
 SUPVR_SERVICE      = 'Supervisor Service'
+ARCHIVE_SERVICE    = 'Archive Service'
+METRICS_SERVICE    = 'Metrics Service'
+MONITOR_SERVICE    = 'Reactor Monitor Service'
+MEMORY_SERVICE     = 'Memory Profiler Service'
+CONTROL_SERVICE    = 'Control Service'
 
 TSTAMP_FORMAT      = "%Y-%m-%dT%H:%M:%SZ"
 
@@ -52,6 +57,7 @@ TESSW = "TESS-W"
 if os.name == "posix":
     CONFIG_FILE = os.path.join("/", "etc", "tessw", "config.ini")
     PORT_PREFIX = "/dev/ttyUSB"
+    CONTROL_SOCKET = os.path.join("/", "run", "tessw", "tessw.sock")   # systemd RuntimeDirectory=tessw
 else:
     print("ERROR: unsupported OS {name}".format(name = os.name))
     sys.exit(1)
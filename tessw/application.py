@@ -22,12 +22,19 @@ from twisted.application.service import IServiceCollection
 # local imports
 # -------------
 
-from tessw                    import MQTT_SERVICE, SUPVR_SERVICE, PHOTOMETER_SERVICE
-from tessw.logger             import startLogging
+from tessw                    import MQTT_SERVICE, SUPVR_SERVICE, PHOTOMETER_SERVICE, ARCHIVE_SERVICE, METRICS_SERVICE, MONITOR_SERVICE, MEMORY_SERVICE, CONTROL_SERVICE
+from tessw.logger             import startLogging, setLogLimits, setFlightRecorder, flightRecorder
 from tessw.config             import read_options
 from tessw.supervisor         import SupervisorService
 from tessw.photometer         import PhotometerService
 from tessw.mqttservice        import MQTTService
+from tessw.fanout             import FanOutService
+from tessw.archive            import ArchiveService
+from tessw.metrics            import MetricsService
+from tessw.profiler           import Profiler
+from tessw.monitor            import ReactorMonitor
+from tessw.memory             import MemoryProfiler
+from tessw.control            import ControlService
 from tessw.service.reloadable import Application
 
 
@@ -36,7 +43,10 @@ from tessw.service.reloadable import Application
 # ====
 
 options, cmdline_opts = read_options()
-startLogging(console=cmdline_opts.console, filepath=cmdline_opts.log_file)
+startLogging(console=cmdline_opts.console, filepath=cmdline_opts.log_file, 
+    fmt=cmdline_opts.log_format, maxSize=cmdline_opts.log_max_size)
+setLogLimits(options['global']['log_window'], options['global']['log_rate'], options['global']['log_burst'])
+setFlightRecorder(options['global']['recorder_size'], options['global']['recorder_dir'])
 
 # ------------------------------------------------
 # Assemble application from its service components
@@ -44,15 +54,49 @@ startLogging(console=cmdline_opts.console, filepath=cmdline_opts.log_file)
 
 application = Application("tessw")
 serviceCollection = IServiceCollection(application)
+serviceCollection.reader   = read_options
+serviceCollection.profiler = Profiler(options['global']['profile_duration'],
+    options['global']['profile_dir'], options['global']['profile_top'])
+serviceCollection.recorder = flightRecorder
 
 supvrService = SupervisorService(options['global'])
 supvrService.setName(SUPVR_SERVICE)
 supvrService.setServiceParent(serviceCollection)
 
-mqttService = MQTTService(options['mqtt'])
+# A single broker or the same messages to several brokers
+brokers = options['global']['brokers']
+if len(brokers) == 1:
+    mqttService = MQTTService(options[brokers[0]], brokers[0])
+else:
+    mqttService = FanOutService(options, brokers)
 mqttService.setName(MQTT_SERVICE)
 mqttService.setServiceParent(serviceCollection)
 
+if options['archive']['directory']:
+    archiveService = ArchiveService(options['archive'])
+    archiveService.setName(ARCHIVE_SERVICE)
+    archiveService.setServiceParent(serviceCollection)
+
+if options['global']['metrics']:
+    metricsService = MetricsService(options['global']['metrics'])
+    metricsService.setName(METRICS_SERVICE)
+    metricsService.setServiceParent(serviceCollection)
+
+if options['global']['lag_interval'] > 0:
+    monitorService = ReactorMonitor(options['global'])
+    monitorService.setName(MONITOR_SERVICE)
+    monitorService.setServiceParent(serviceCollection)
+
+# Always there, so that memory tracing can also be started on demand
+memoryService = MemoryProfiler(options['global'])
+memoryService.setName(MEMORY_SERVICE)
+memoryService.setServiceParent(serviceCollection)
+
+if options['global']['control']:
+    controlService = ControlService(options)
+    controlService.setName(CONTROL_SERVICE)
+    controlService.setServiceParent(serviceCollection)
+
 # All Photometers under the Supewrvisor Service
 N = options['global']['nphotom']
 for i in range(1, N+1):
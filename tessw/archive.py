@@ -0,0 +1,214 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import os.path
+import json
+import struct
+import bisect
+import datetime
+import calendar
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger           import Logger
+from twisted.internet         import task, defer
+from twisted.internet.threads import deferToThread
+
+#--------------
+# local imports
+# -------------
+
+from tessw                    import ARCHIVE_SERVICE, TSTAMP_FORMAT
+from tessw.logger             import setLogLevel
+from tessw.service.reloadable import Service
+
+# ----------------
+# Module constants
+# ----------------
+
+# Daily archive files: <prefix>-YYYY-MM-DD.jsonl with one compact JSON reading
+# per line and its <prefix>-YYYY-MM-DD.idx index, made of INDEX_RECORD records
+# (UTC timestamp, byte offset in the .jsonl file) for the earliest reading
+# of each batch written.
+PREFIX       = "readings"
+INDEX_RECORD = struct.Struct('!dQ')
+
+# Service Logging namespace
+NAMESPACE = 'archv'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def archivePaths(directory, day):
+    '''(data file, index file) paths for a given date'''
+    base = os.path.join(directory, "{0}-{1}".format(PREFIX, day.strftime("%Y-%m-%d")))
+    return base + ".jsonl", base + ".idx"
+
+
+def readIndex(path):
+    '''List of (timestamp, offset) index records'''
+    try:
+        with open(path, 'rb') as fd:
+            data = fd.read()
+    except IOError:
+        return []
+    n = len(data) // INDEX_RECORD.size    # ignore a partially written last record
+    return [INDEX_RECORD.unpack_from(data, i*INDEX_RECORD.size) for i in range(n)]
+
+
+def readRange(directory, start, end):
+    '''
+    Generator of archived readings whose tstamp is within [start, end]
+    (UTC datetimes). Uses the index to seek into each daily file
+    instead of scanning it from the beginning, and to stop at the
+    first batch starting after end. Lines are not sorted by tstamp
+    within a batch, as several photometers are interleaved.
+    '''
+    t0  = calendar.timegm(start.timetuple())
+    t1  = calendar.timegm(end.timetuple())
+    day = start.date()
+    while day <= end.date():
+        data, index = archivePaths(directory, day)
+        day += datetime.timedelta(days=1)
+        if not os.path.exists(data):
+            continue
+        records = readIndex(index)
+        i = bisect.bisect_right([record[0] for record in records], t0)
+        offset = records[i-1][1] if i > 0 else 0
+        limit  = next((record[1] for record in records[i:] if record[0] > t1), None)
+        with open(data, 'rb') as fd:
+            fd.seek(offset)
+            for line in fd:
+                if limit is not None and offset >= limit:
+                    break
+                offset += len(line)
+                try:
+                    reading = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue    # partially written last line
+                tstamp = datetime.datetime.strptime(reading['tstamp'], TSTAMP_FORMAT)
+                if start <= tstamp <= end:
+                    yield reading
+
+# -------
+# Classes
+# -------
+
+class ArchiveService(Service):
+    '''
+    Local archive of every curated reading, in daily files.
+    Readings are buffered in memory and written in batches every flush
+    interval seconds, in a thread, so that disk I/O never blocks the reactor.
+    Files are only appended to, so that a crash loses at most the last batch.
+    '''
+
+    def __init__(self, options, **kargs):
+        self.options  = options
+        self.buffer   = []      # (UTC datetime, reading) not yet written
+        self.written  = 0
+        self._writing = None    # Deferred of the batch being written
+        self._task    = task.LoopingCall(self.flush)
+        setLogLevel(namespace=NAMESPACE, levelStr=options['log_level'])
+
+    # -----------
+    # Service API
+    # -----------
+
+    def startService(self):
+        log.info("starting {name} on {dir}", name=ARCHIVE_SERVICE, dir=self.options['directory'])
+        if not os.path.isdir(self.options['directory']):
+            os.makedirs(self.options['directory'])
+        self._task.start(self.options['flush'], now=False)
+        super().startService()
+
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        if self._task.running:
+            self._task.stop()
+        if self._writing is not None:
+            yield self._writing
+        yield self.flush()
+        log.info("{n} readings archived", n=self.written)
+        yield super().stopService()
+
+
+    def reloadService(self, options):
+        options = options['archive']
+        setLogLevel(namespace=NAMESPACE, levelStr=options['log_level'])
+        self.options['log_level'] = options['log_level']
+
+    # -----------
+    # Archive API
+    # -----------
+
+    def addReading(self, reading, tstamp):
+        '''Archive a curated reading, taken at tstamp (UTC datetime)'''
+        self.buffer.append((tstamp, reading))
+
+
+    def flush(self):
+        '''Write the buffered readings in a thread, one batch at a time'''
+        if self._writing is not None or not self.buffer:
+            return defer.succeed(None)
+        batch, self.buffer = self.buffer, []
+        self._writing = deferToThread(self._write, batch)
+        self._writing.addCallbacks(self._written, self._notWritten, errbackArgs=(batch,))
+        return self._writing
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _written(self, n):
+        self._writing = None
+        self.written += n
+
+
+    def _notWritten(self, failure, batch):
+        self._writing = None
+        self.buffer = batch + self.buffer    # Try again in the next flush
+        log.failure("Error writing {n} readings to the archive: {excp!s}", failure=failure, n=len(batch), excp=failure.value)
+
+
+    def _write(self, batch):
+        '''Runs in a thread. Appends a batch of readings to their daily files'''
+        days = {}
+        for tstamp, reading in batch:
+            line = dict(reading)
+            line['tstamp'] = tstamp.strftime(TSTAMP_FORMAT)
+            days.setdefault(tstamp.date(), []).append((tstamp, json.dumps(line, separators=(',',':')) + '\n'))
+        for day, lines in days.items():
+            data, index = archivePaths(self.options['directory'], day)
+            with open(data, 'ab') as fd:
+                offset = fd.tell()
+                fd.write(''.join(line for tstamp, line in lines).encode('utf-8'))
+            with open(index, 'ab') as fd:
+                first = min(tstamp for tstamp, line in lines)
+                fd.write(INDEX_RECORD.pack(calendar.timegm(first.timetuple()), offset))
+        return len(batch)
+
+
+__all__ = [
+    "ArchiveService",
+    "readRange",
+]
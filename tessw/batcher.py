@@ -0,0 +1,113 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.internet import reactor
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Batching modes
+PER_PHOTOMETER = 'photometer'
+PER_GATEWAY    = 'gateway'
+
+MODES = (PER_PHOTOMETER, PER_GATEWAY)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def encodeBatch(readings):
+    '''
+    Compact array encoding of a list of readings.
+    Keys are listed once in order of appearance and each reading
+    becomes a row of values, with None for missing keys.
+    '''
+    keys  = []
+    index = {}
+    for reading in readings:
+        for key in reading:
+            if key not in index:
+                index[key] = len(keys)
+                keys.append(key)
+    rows = [[reading.get(key) for key in keys] for reading in readings]
+    return {'keys': keys, 'rows': rows}
+
+# -------
+# Classes
+# -------
+
+class ReadingBatcher(object):
+    '''
+    Coalesces readings into batches of up to size readings or
+    window seconds since the first reading of the batch, whatever
+    comes first. Batches are kept per photometer name or per gateway
+    and handed to emit(key, readings, traces), where key is the photometer
+    name or None and traces are the latency traces of the readings, if any.
+    '''
+
+    # So that we can patch it in tests with Clock.callLater ...
+    callLater = reactor.callLater
+
+    def __init__(self, size, window, mode, emit):
+        self.size     = size
+        self.window   = window
+        self.mode     = mode
+        self.emit     = emit
+        self._batches = {}  # key -> list of readings
+        self._traces  = {}  # key -> list of traces of those readings
+        self._timers  = {}  # key -> DelayedCall closing the batch
+
+    def add(self, reading, trace=None):
+        key = reading['name'] if self.mode == PER_PHOTOMETER else None
+        batch = self._batches.setdefault(key, [])
+        batch.append(reading)
+        if trace is not None:
+            self._traces.setdefault(key, []).append(trace)
+        if len(batch) >= self.size:
+            self.flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = self.callLater(self.window, self.flush, key)
+
+    def flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+        batch  = self._batches.pop(key, None)
+        traces = self._traces.pop(key, None)
+        if batch:
+            self.emit(key, batch, traces)
+
+    def flushAll(self):
+        for key in list(self._batches):
+            self.flush(key)
+
+
+__all__ = [
+    "encodeBatch",
+    "ReadingBatcher",
+    "MODES",
+    "PER_PHOTOMETER",
+    "PER_GATEWAY",
+]
@@ -15,6 +15,7 @@ import os
 import os.path
 import argparse
 import errno
+import tempfile
 import configparser as ConfigParser
 
 
@@ -29,7 +30,11 @@ import configparser as ConfigParser
 
 import tessw.utils
 
-from tessw import CONFIG_FILE, VERSION_STRING, TESSW
+from tessw           import CONFIG_FILE, CONTROL_SOCKET, VERSION_STRING, TESSW
+from tessw.mqttqueue import POLICIES, DROP_OLDEST
+from tessw.batcher   import MODES, PER_PHOTOMETER
+from tessw.encoding  import ENCODINGS, JSON
+from tessw.failover  import splitEndpoints
 
 # ----------------
 # Module constants
@@ -62,6 +67,8 @@ def cmdline():
     parser.add_argument('-k' , '--console', action='store_true', help='log to console')
     parser.add_argument('--config',   type=str, default=CONFIG_FILE, action='store', metavar='<config file>', help='detailed configuration file')
     parser.add_argument('--log-file', type=str, default=None,    action='store', metavar='<log file>', help='log file path')
+    parser.add_argument('--log-format', type=str, default='text', choices=('text', 'json'), help='log file format')
+    parser.add_argument('--log-max-size', type=int, default=0, metavar='<bytes>', help='rotate the log file when exceeding this size (0 = never)')
     return parser.parse_args()
 
 
@@ -80,6 +87,60 @@ def loadCmdLine(cmdline_options):
     return options
 
 
+def loadBrokerSection(parser, section, defaults=None):
+    '''
+    Load an MQTT broker section.
+    Options missing in a secondary broker section are taken from defaults (the [mqtt] section)
+    Returns a dictionary
+    '''
+
+    def fallback(key, *value):
+        if defaults is not None:
+            return {'fallback': defaults[key]}
+        return {'fallback': value[0]} if value else {}
+
+    options = {}
+    options['broker']        = parser.get(section,"broker")
+    if not splitEndpoints(options['broker']):
+        raise Exception("broker must list at least one endpoint in section " + section)
+    options['probe_interval'] = parser.getint(section,"probe_interval", **fallback('probe_interval', 30))
+    options['username']      = parser.get(section,"username", **fallback('username'))
+    options['password']      = parser.get(section,"password", **fallback('password'))
+    options['keepalive']     = parser.getint(section,"keepalive", **fallback('keepalive'))
+    options['client_id']     = parser.get(section,"client_id", **fallback('client_id', ""))
+    options['clean_session'] = parser.getboolean(section,"clean_session", **fallback('clean_session', True))
+    options['topic']         = parser.get(section,"topic", **fallback('topic'))
+    options['log_level']     = parser.get(section,"log_level", **fallback('log_level'))
+    options['log_messages']  = parser.get(section,"log_messages", **fallback('log_messages'))
+    options['queue_size']    = parser.getint(section,"queue_size", **fallback('queue_size', 1000))
+    options['queue_bytes']   = parser.getint(section,"queue_bytes", **fallback('queue_bytes', 1048576))
+    options['queue_policy']  = parser.get(section,"queue_policy", **fallback('queue_policy', DROP_OLDEST))
+    if options['queue_policy'] not in POLICIES:
+        raise Exception("queue_policy must be one of " + ", ".join(POLICIES))
+    # Outbox files cannot be shared between brokers
+    options['outbox']        = parser.get(section,"outbox", fallback="")
+    options['outbox_size']   = parser.getint(section,"outbox_size", **fallback('outbox_size', 1000000))
+    options['outbox_commit'] = parser.getfloat(section,"outbox_commit", **fallback('outbox_commit', 1.0))
+    options['batch_size']    = parser.getint(section,"batch_size", **fallback('batch_size', 0))
+    options['batch_window']  = parser.getint(section,"batch_window", **fallback('batch_window', 1000))
+    options['batch_mode']    = parser.get(section,"batch_mode", **fallback('batch_mode', PER_PHOTOMETER))
+    if options['batch_mode'] not in MODES:
+        raise Exception("batch_mode must be one of " + ", ".join(MODES))
+    options['encoding']      = parser.get(section,"encoding", **fallback('encoding', JSON))
+    options['compress']      = parser.getboolean(section,"compress", **fallback('compress', False))
+    if options['encoding'] not in ENCODINGS:
+        raise Exception("encoding must be one of " + ", ".join(ENCODINGS))
+    options['register_qos']  = parser.getint(section,"register_qos", **fallback('register_qos', 0))
+    options['reading_qos']   = parser.getint(section,"reading_qos", **fallback('reading_qos', 0))
+    options['window']        = parser.getint(section,"window", **fallback('window', 3))
+    if not (0 < options['window'] <= 16):
+        raise Exception("window must be within [1, 16] messages")
+    for key in ('register_qos', 'reading_qos'):
+        if options[key] not in (0, 1, 2):
+            raise Exception(key + " must be 0, 1 or 2")
+    return options
+
+
 def loadCfgFile(path):
     '''
     Load options from configuration file whose path is given
@@ -99,7 +160,26 @@ def loadCfgFile(path):
     N = options['global']['nphotom'] = parser.getint("global","nphotom")
     options['global']['T']           = parser.getint("global","T")
     options['global']['ncycles']     = parser.getint("global","ncycles")
+    options['global']['align']       = parser.getboolean("global","align", fallback=False)
+    options['global']['jitter']      = parser.getfloat("global","jitter", fallback=0.0)
     options['global']['log_level']   = parser.get("global","log_level")
+    options['global']['log_window']  = parser.getint("global","log_window", fallback=60)
+    options['global']['log_rate']    = parser.getfloat("global","log_rate", fallback=0)
+    options['global']['log_burst']   = parser.getint("global","log_burst", fallback=100)
+    options['global']['recorder_size'] = parser.getint("global","recorder_size", fallback=2000)
+    options['global']['recorder_dir']  = parser.get("global","recorder_dir", fallback=tempfile.gettempdir())
+    options['global']['metrics']     = parser.get("global","metrics", fallback="")
+    options['global']['control']     = parser.get("global","control", fallback=CONTROL_SOCKET)
+    options['global']['profile_duration'] = parser.getint("global","profile_duration", fallback=30)
+    options['global']['profile_dir']      = parser.get("global","profile_dir", fallback=tempfile.gettempdir())
+    options['global']['profile_top']      = parser.getint("global","profile_top", fallback=25)
+    options['global']['lag_interval']     = parser.getfloat("global","lag_interval", fallback=1.0)
+    options['global']['lag_threshold']    = parser.getfloat("global","lag_threshold", fallback=0.5)
+    options['global']['trace_sample']     = parser.getint("global","trace_sample", fallback=0)
+    options['global']['memory_interval']  = parser.getint("global","memory_interval", fallback=0)
+    options['global']['memory_top']       = parser.getint("global","memory_top", fallback=10)
+    if not (0 <= options['global']['jitter'] < options['global']['T']):
+        raise Exception("jitter must be within [0, T) seconds")
 
     for i in range(1,N+1):
         section = 'phot'+ str(i)
@@ -114,14 +194,27 @@ def loadCfgFile(path):
         options[section]['log_level']    = parser.get(section,"log_level")
         options[section]['log_messages'] = parser.get(section,"log_messages")
     
-    options['mqtt'] = {}
-    options['mqtt']['broker']        = parser.get("mqtt","broker")
-    options['mqtt']['username']      = parser.get("mqtt","username")
-    options['mqtt']['password']      = parser.get("mqtt","password")
-    options['mqtt']['keepalive']     = parser.getint("mqtt","keepalive")
-    options['mqtt']['topic']         = parser.get("mqtt","topic")
-    options['mqtt']['log_level']     = parser.get("mqtt","log_level")
-    options['mqtt']['log_messages']  = parser.get("mqtt","log_messages")
+    options['mqtt'] = loadBrokerSection(parser, "mqtt")
+
+    # Optional local archive of readings
+    options['archive'] = {}
+    options['archive']['directory'] = parser.get("archive","directory", fallback="")
+    options['archive']['flush']     = parser.getfloat("archive","flush", fallback=5.0)
+    options['archive']['log_level'] = parser.get("archive","log_level", fallback="info")
+
+    # Additional brokers, publishing the same messages
+    options['global']['brokers'] = [name.strip() for name in parser.get("global","brokers", fallback="mqtt").split(',') if name.strip()]
+    if not options['global']['brokers']:
+        raise Exception("brokers must list at least one broker section")
+    for section in options['global']['brokers']:
+        if section == "mqtt":
+            continue
+        if not parser.has_section(section):
+            raise Exception("Missing section " + section)
+        options[section] = loadBrokerSection(parser, section, defaults=options['mqtt'])
+    outboxes = [options[section]['outbox'] for section in options['global']['brokers'] if options[section]['outbox']]
+    if len(outboxes) != len(set(outboxes)):
+        raise Exception("Each broker section must have its own outbox file")
 
     return options
 
@@ -0,0 +1,275 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Local control and status interface of the running daemon,
+on a UNIX domain socket. One request per line, either JSON:
+
+    {"cmd": "profile", "args": [10]}
+
+or just words, handy with socat:
+
+    echo "status" | socat - UNIX-CONNECT:/run/tessw/tessw.sock
+
+One JSON response per line: {"ok": true, "result": ...} or {"ok": false, "error": "..."}
+
+Queries:  status, photometers, readings, queues, counters, config
+Commands: pause, resume, reload, flush, profile [seconds],
+          memory [start|stop|report], dump
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import json
+import time
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger             import Logger
+from twisted.internet           import reactor, defer
+from twisted.internet.protocol  import Factory
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.protocols.basic    import LineOnlyReceiver
+
+#--------------
+# local imports
+# -------------
+
+from tessw                    import (VERSION_STRING, CONTROL_SERVICE, SUPVR_SERVICE, MQTT_SERVICE,
+                                      ARCHIVE_SERVICE, MEMORY_SERVICE, MONITOR_SERVICE)
+from tessw.metrics            import REGISTRY, REACTOR_LAG, REACTOR_LAG_MAX
+from tessw.service.reloadable import Service
+
+# ----------------
+# Module constants
+# ----------------
+
+# Options whose values are never shown
+SECRETS = ('password',)
+
+MASK = '********'
+
+# Service Logging namespace
+NAMESPACE = 'ctrl'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def masked(options):
+    '''Copy of the options with secrets masked'''
+    result = {}
+    for key, value in options.items():
+        if isinstance(value, dict):
+            result[key] = masked(value)
+        elif key in SECRETS and value:
+            result[key] = MASK
+        else:
+            result[key] = value
+    return result
+
+
+def parseRequest(line):
+    '''Returns (command, argument list)'''
+    if line.startswith('{'):
+        request = json.loads(line)
+        return request['cmd'], list(request.get('args', []))
+    words = line.split()
+    if not words:
+        raise ValueError("Empty request")
+    return words[0], words[1:]
+
+# -------
+# Classes
+# -------
+
+class ControlProtocol(LineOnlyReceiver):
+
+    delimiter  = b'\n'
+    MAX_LENGTH = 4096
+
+    def lineReceived(self, line):
+        try:
+            command, args = parseRequest(line.decode('utf-8').strip())
+            handler = self.factory.service.handler(command)
+        except Exception as e:
+            self._reply({'ok': False, 'error': str(e)})
+            return
+        d = defer.maybeDeferred(handler, *args)
+        d.addCallbacks(self._done, self._failed, errbackArgs=(command,))
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _done(self, result):
+        self._reply({'ok': True, 'result': result})
+
+    def _failed(self, failure, command):
+        log.debug("Control command {cmd} failed: {excp!s}", cmd=command, excp=failure.value)
+        self._reply({'ok': False, 'error': str(failure.value)})
+
+    def _reply(self, response):
+        if self.transport is not None:
+            self.transport.write(json.dumps(response, default=str).encode('utf-8') + self.delimiter)
+
+
+
+class ControlService(Service):
+    '''
+    Status queries and commands on a UNIX domain socket.
+    Status responses are built from values already kept by the other
+    services (counters, health states, queue lengths), so that polling
+    them does not perturb the ingestion of readings.
+    '''
+
+    def __init__(self, options, **kargs):
+        self.options = options      # All sections, for the config query
+        self.path    = options['global']['control']
+        self.port    = None
+        self.started = None
+
+    # -----------
+    # Service API
+    # -----------
+
+    def startService(self):
+        log.info("starting {name} on {path}", name=CONTROL_SERVICE, path=self.path)
+        super().startService()
+        self.started = time.time()
+        factory = Factory.forProtocol(ControlProtocol)
+        factory.service = self
+        endpoint = UNIXServerEndpoint(reactor, self.path, mode=0o600, wantPID=True)
+        endpoint.listen(factory).addCallbacks(self._listening, self._notListening)
+
+
+    def stopService(self):
+        super().stopService()
+        if self.port is not None:
+            return self.port.stopListening()
+
+
+    def reloadService(self, options):
+        self.options = dict(options)    # Shared with the other services
+        self.options['global'] = dict(options['global'], control=self.path)   # Not reloadable
+
+    # -----------
+    # Control API
+    # -----------
+
+    def handler(self, command):
+        try:
+            return getattr(self, 'do_' + command)
+        except AttributeError:
+            raise ValueError("Unknown command {0}".format(command))
+
+    # Queries
+
+    def do_status(self):
+        monitor = self._service(MONITOR_SERVICE, None)
+        return {
+            'version'    : VERSION_STRING,
+            'uptime'     : time.time() - self.started,
+            'paused'     : self._service(SUPVR_SERVICE).paused,
+            'photometers': self.do_photometers(),
+            'brokers'    : self.do_queues(),
+            'reactor'    : {
+                'lag'     : REACTOR_LAG.collect(),
+                'lag_max' : monitor.recentMaxLag if monitor is not None else REACTOR_LAG_MAX.get(),
+            },
+        }
+
+    def do_photometers(self):
+        return self._service(SUPVR_SERVICE).getStatus()
+
+    def do_readings(self):
+        return {phot['label']: {'tstamp': phot['tstamp'], 'reading': phot['reading']} for phot in self.do_photometers()}
+
+    def do_queues(self):
+        return self._service(MQTT_SERVICE).getStatus()
+
+    def do_counters(self):
+        return REGISTRY.collect()
+
+    def do_config(self):
+        return masked(self.options)
+
+    # Commands
+
+    def do_pause(self):
+        self._service(SUPVR_SERVICE).pauseService()
+        return "paused"
+
+    def do_resume(self):
+        self._service(SUPVR_SERVICE).resumeService()
+        return "resumed"
+
+    @defer.inlineCallbacks
+    def do_reload(self):
+        yield self.parent.reloadService()
+        return "reloaded"
+
+    @defer.inlineCallbacks
+    def do_flush(self):
+        yield self._service(MQTT_SERVICE).flush()
+        archive = self._service(ARCHIVE_SERVICE, None)
+        if archive is not None:
+            yield archive.flush()
+        return "flushed"
+
+    def do_profile(self, duration=None):
+        return self.parent.profileService(int(duration) if duration is not None else None)
+
+    def do_memory(self, action='report'):
+        memory = self._service(MEMORY_SERVICE)
+        if action == 'start':
+            memory.startTracing()
+            return "tracing"
+        if action == 'stop':
+            memory.stopTracing()
+            return "not tracing"
+        if action == 'report':
+            return memory.report()
+        raise ValueError("Unknown memory action {0}".format(action))
+
+    def do_dump(self):
+        return self.parent.dumpService()
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _service(self, name, *default):
+        try:
+            return self.parent.getServiceNamed(name)
+        except KeyError:
+            if default:
+                return default[0]
+            raise ValueError("No {0} running".format(name))
+
+    def _listening(self, port):
+        self.port = port
+
+    def _notListening(self, failure):
+        # i.e. no /run/tessw when not started by systemd
+        log.warn("Control interface disabled, could not listen on {path}: {excp!s}", path=self.path, excp=failure.value)
+
+
+__all__ = [
+    "ControlService",
+]
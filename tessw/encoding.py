@@ -0,0 +1,216 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import json
+import zlib
+import math
+
+from operator import itemgetter
+
+# Optional binary encodings
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Payload encodings
+JSON    = 'json'
+MSGPACK = 'msgpack'
+CBOR    = 'cbor'
+
+ENCODINGS = (JSON, MSGPACK, CBOR)
+
+# Reading keys whose values are constant for a given photometer
+CONSTANT_KEYS = ('name', 'rev')
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def available():
+    '''Encodings whose libraries are installed'''
+    return tuple(name for name, module in ((JSON, json), (MSGPACK, msgpack), (CBOR, cbor2)) if module is not None)
+
+
+def _getter(keys):
+    '''Like operator.itemgetter, but always returning a tuple'''
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda obj: (obj[key],)
+    if not keys:
+        return lambda obj: ()
+    return itemgetter(*keys)
+
+# -------
+# Classes
+# -------
+
+class JSONTemplate(object):
+    '''
+    Specialized JSON serializer for the readings of a single photometer.
+    Readings from a given firmware always have the same keys in the same
+    order, numeric values and some constant values (name, rev).
+    For the last reading schema seen, the template keeps a format string 
+    with the keys and constant values already encoded, so that a reading 
+    is serialized with a single % operation. Readings not matching the 
+    schema are serialized by json.dumps() and may give a new schema,
+    as well as readings with non finite float values (NaN, Infinity).
+    The output is always byte-identical to json.dumps(reading).
+    '''
+
+    # Variable value types handled by the format string
+    FORMATS = {float: '%r', int: '%d'}
+
+    def __init__(self, constants=CONSTANT_KEYS):
+        self.constants = constants
+        self._keys     = None   # key sequence of the schema
+        self._format   = None   # format string for the variable values
+        self._types    = None   # types of the variable values
+        self._fixed    = None   # values of the constant keys
+        self._fixedTypes  = None
+        self._getVariable = None
+        self._getFixed    = None
+        self._getFloats   = None
+
+    def dumps(self, reading):
+        if tuple(reading) == self._keys:
+            values = self._getVariable(reading)
+            if tuple(map(type, values)) == self._types:
+                fixed = self._getFixed(reading)
+                if fixed == self._fixed and tuple(map(type, fixed)) == self._fixedTypes:
+                    # float %r gives nan & inf where JSON wants NaN & Infinity
+                    if all(map(math.isfinite, self._getFloats(reading))):
+                        return self._format % values
+                    return json.dumps(reading)
+        self._compile(reading)
+        return json.dumps(reading)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _compile(self, reading):
+        '''Learn the schema from this reading, if it can be handled'''
+        self._keys = None
+        parts    = []
+        variable = []
+        fixed    = []
+        for key, value in reading.items():
+            if type(key) is not str:
+                return
+            if key in self.constants:
+                text = json.dumps(value).replace('%', '%%')
+                fixed.append(key)
+            elif type(value) in self.FORMATS:
+                text = self.FORMATS[type(value)]
+                variable.append(key)
+            else:
+                return
+            parts.append(json.dumps(key).replace('%', '%%') + ': ' + text)
+        self._format      = '{' + ', '.join(parts) + '}'
+        self._getVariable = _getter(variable)
+        self._getFixed    = _getter(fixed)
+        self._getFloats   = _getter([key for key in variable if type(reading[key]) is float])
+        self._types       = tuple(type(reading[key]) for key in variable)
+        self._fixed       = self._getFixed(reading)
+        self._fixedTypes  = tuple(map(type, self._fixed))
+        self._keys        = tuple(reading)
+
+
+
+class Encoder(object):
+    '''
+    Encodes payloads to be published.
+    JSON payloads are text (as they always were), the rest are bytearrays.
+    The content type is given by a topic suffix: none for plain JSON,
+    or "/<encoding>[-zlib]" otherwise (e.g. "/msgpack", "/json-zlib").
+    '''
+
+    def __init__(self, encoding=JSON, compress=False):
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding {0}".format(encoding))
+        if encoding not in available():
+            raise ImportError("Python library for {0} encoding is not installed".format(encoding))
+        self.encoding = encoding
+        self.compress = compress
+        if encoding == JSON and not compress:
+            self.suffix = ""
+        else:
+            self.suffix = "/" + encoding + ("-zlib" if compress else "")
+        self._dumps = {
+            JSON    : self._json,
+            MSGPACK : self._msgpack,
+            CBOR    : self._cbor,
+        }[encoding]
+
+    def template(self):
+        '''
+        Returns an encoding function for the readings of a single photometer.
+        Plain JSON readings use a specialized JSONTemplate serializer.
+        '''
+        if self.encoding == JSON and not self.compress:
+            return JSONTemplate().dumps
+        return self.encode
+
+    def encode(self, obj, **kwargs):
+        '''kwargs are only used by JSON (i.e. separators)'''
+        payload = self._dumps(obj, **kwargs)
+        if self.compress:
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            payload = bytearray(zlib.compress(payload))
+        return payload
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _json(self, obj, **kwargs):
+        return json.dumps(obj, **kwargs)
+
+    def _msgpack(self, obj, **kwargs):
+        return bytearray(msgpack.packb(obj, use_bin_type=True))
+
+    def _cbor(self, obj, **kwargs):
+        return bytearray(cbor2.dumps(obj))
+
+
+__all__ = [
+    "Encoder",
+    "JSONTemplate",
+    "available",
+    "ENCODINGS",
+    "JSON",
+    "MSGPACK",
+    "CBOR",
+]
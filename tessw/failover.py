@@ -0,0 +1,155 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from zope.interface import implementer
+
+from twisted.logger              import Logger
+from twisted.internet            import reactor, defer, task
+from twisted.internet.protocol   import Factory, Protocol
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.endpoints  import clientFromString
+
+#--------------
+# local imports
+# -------------
+
+from tessw.mqttqueue import NAMESPACE
+
+# ----------------
+# Module constants
+# ----------------
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def splitEndpoints(brokers):
+    '''Comma separated list of Twisted-style client endpoints'''
+    return [broker.strip() for broker in brokers.split(',') if broker.strip()]
+
+# -------
+# Classes
+# -------
+
+@implementer(IStreamClientEndpoint)
+class FailoverEndpoint(object):
+    '''
+    Client endpoint over an ordered list of equivalent brokers.
+
+    - connect() tries the healthy brokers in order, then the unhealthy ones,
+      moving to the next one as soon as a connection attempt fails.
+    - A broker is unhealthy for cooldown seconds after failing a connection
+      attempt or losing its connection.
+    - While connected to other than the primary broker, the primary one is
+      probed every cooldown seconds with a bare TCP connection. Once it
+      answers, the current connection is dropped, so that the reconnecting
+      service fails back to the primary broker.
+    '''
+
+    # So that we can patch it in tests with Clock ...
+    clock = reactor
+
+    def __init__(self, reactor, brokers, cooldown):
+        self.brokers   = splitEndpoints(brokers)
+        self.endpoints = [clientFromString(reactor, broker) for broker in self.brokers]
+        self.cooldown  = cooldown
+        self.current   = None   # index of the connected broker
+        self.protocol  = None
+        self._failedAt = [None] * len(self.endpoints)
+        self._failingBack = False
+        self._probe = task.LoopingCall(self._probePrimary)
+        self._probe.clock = self.clock
+
+    @property
+    def broker(self):
+        '''Description of the connected (or primary) broker'''
+        return self.brokers[self.current or 0]
+
+    def isHealthy(self, i):
+        failedAt = self._failedAt[i]
+        return failedAt is None or self.clock.seconds() - failedAt >= self.cooldown
+
+    @defer.inlineCallbacks
+    def connect(self, factory):
+        healthy   = [i for i in range(len(self.endpoints)) if self.isHealthy(i)]
+        unhealthy = [i for i in range(len(self.endpoints)) if not self.isHealthy(i)]
+        failure = None
+        for i in healthy + unhealthy:
+            try:
+                protocol = yield self.endpoints[i].connect(factory)
+            except Exception as e:
+                log.warn("Connection to {broker} failed: {excp!s}", broker=self.brokers[i], excp=e)
+                self._failedAt[i] = self.clock.seconds()
+                failure = e
+                continue
+            self._failedAt[i] = None
+            self.current  = i
+            self.protocol = protocol
+            if i != 0 and not self._probe.running:
+                log.info("Failed over to {broker}, probing {primary} every {t} seconds",
+                    broker=self.brokers[i], primary=self.brokers[0], t=self.cooldown)
+                self._probe.start(self.cooldown, now=False)
+            elif i == 0 and self._probe.running:
+                self._probe.stop()
+            return protocol
+        raise failure
+
+
+    def disconnected(self):
+        '''Called when the current connection is lost'''
+        if self.current is not None and not self._failingBack:
+            self._failedAt[self.current] = self.clock.seconds()
+        self._failingBack = False
+        self.current  = None
+        self.protocol = None
+
+
+    def stop(self):
+        if self._probe.running:
+            self._probe.stop()
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    @defer.inlineCallbacks
+    def _probePrimary(self):
+        factory = Factory.forProtocol(Protocol)
+        factory.noisy = False   # No "Starting factory" logs on every probe
+        try:
+            protocol = yield self.endpoints[0].connect(factory)
+        except Exception as e:
+            log.debug("Primary broker {broker} still unreachable: {excp!s}", broker=self.brokers[0], excp=e)
+            return
+        protocol.transport.loseConnection()
+        self._failedAt[0] = None
+        self._probe.stop()
+        if self.current not in (None, 0) and self.protocol is not None:
+            log.info("Primary broker {broker} is back, failing back", broker=self.brokers[0])
+            self._failingBack = True
+            self.protocol.transport.loseConnection()
+
+
+__all__ = [
+    "FailoverEndpoint",
+    "splitEndpoints",
+]
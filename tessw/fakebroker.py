@@ -0,0 +1,327 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Minimal in-process MQTT 3.1.1 broker, to exercise the publisher
+without a real broker. It is a sink: it acknowledges and records
+every PUBLISH received, but does not route messages to subscribers.
+
+    broker = FakeBroker(latency=0.05, bandwidth=10000)
+    broker.listen("tcp:1883:interface=127.0.0.1")   # or ...
+    endpoint = MemoryEndpoint(broker)                # in-memory transport
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import struct
+
+from collections import namedtuple
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from zope.interface import implementer
+
+from twisted.logger              import Logger
+from twisted.internet            import reactor, defer
+from twisted.internet.protocol   import Protocol, Factory
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.endpoints  import serverFromString
+from twisted.protocols.loopback  import loopbackAsync
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# MQTT control packet types
+CONNECT     = 1
+CONNACK     = 2
+PUBLISH     = 3
+PUBACK      = 4
+PUBREC      = 5
+PUBREL      = 6
+PUBCOMP     = 7
+SUBSCRIBE   = 8
+SUBACK      = 9
+UNSUBSCRIBE = 10
+UNSUBACK    = 11
+PINGREQ     = 12
+PINGRESP    = 13
+DISCONNECT  = 14
+
+# Service Logging namespace
+NAMESPACE = 'fakeb'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# A recorded PUBLISH
+Received = namedtuple('Received', ('tstamp', 'clientId', 'topic', 'payload', 'qos', 'dup', 'retain'))
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def encodeLength(n):
+    '''MQTT variable length encoding of remaining length'''
+    encoded = bytearray()
+    while True:
+        digit, n = n % 128, n // 128
+        encoded.append(digit | 0x80 if n else digit)
+        if not n:
+            return bytes(encoded)
+
+
+def decodeHeader(data):
+    '''
+    Returns (packet type, flags, remaining length, header length)
+    or None if data does not hold a complete fixed header yet
+    '''
+    if len(data) < 2:
+        return None
+    length, multiplier = 0, 1
+    for i in range(1, 5):
+        if i >= len(data):
+            return None
+        length += (data[i] & 0x7F) * multiplier
+        if not data[i] & 0x80:
+            return data[0] >> 4, data[0] & 0x0F, length, i + 1
+        multiplier *= 128
+    raise ValueError("Malformed remaining length")
+
+
+def decodeString(data, offset):
+    '''Returns (UTF-8 string, next offset)'''
+    n = struct.unpack_from('!H', data, offset)[0]
+    return data[offset+2:offset+2+n].decode('utf-8'), offset + 2 + n
+
+
+def packet(kind, payload=b'', flags=0):
+    return bytes([kind << 4 | flags]) + encodeLength(len(payload)) + payload
+
+# -------
+# Classes
+# -------
+
+class FakeBrokerProtocol(Protocol):
+    '''One client connection to the FakeBroker'''
+
+    def __init__(self):
+        self.clientId = None
+        self._buffer  = bytearray()
+        self._budget  = None    # bytes that can be processed now under the bandwidth cap
+        self._refill  = None    # DelayedCall resuming processing
+        self._unreleased = set()  # QoS 2 packet ids waiting for PUBREL
+
+    def connectionMade(self):
+        self.factory.clients.append(self)
+
+    def connectionLost(self, reason):
+        if self in self.factory.clients:
+            self.factory.clients.remove(self)
+        if self._refill is not None and self._refill.active():
+            self._refill.cancel()
+
+    def dataReceived(self, data):
+        self._buffer.extend(data)
+        if self._refill is None:
+            self._process()
+
+    def drop(self):
+        '''Forced, abrupt disconnection: pending data is neither processed nor replied'''
+        log.info("Dropping connection from {id}", id=self.clientId)
+        if self in self.factory.clients:
+            self.factory.clients.remove(self)
+        abort = getattr(self.transport, 'abortConnection', self.transport.loseConnection)
+        abort()
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _process(self):
+        self._refill = None
+        bandwidth = self.factory.bandwidth
+        while True:
+            header = decodeHeader(self._buffer)
+            if header is None:
+                return
+            kind, flags, length, offset = header
+            size = offset + length
+            if len(self._buffer) < size:
+                return
+            if bandwidth:
+                if self._budget is None or self._budget < size:
+                    # Wait the time it takes this packet to arrive
+                    self._budget = size
+                    self._refill = self.factory.clock.callLater(size/bandwidth, self._process)
+                    return
+                self._budget = None
+            body = bytes(self._buffer[offset:size])
+            del self._buffer[:size]
+            self._handle(kind, flags, body)
+            if self not in self.factory.clients:
+                return
+
+    def _reply(self, data):
+        latency = self.factory.latency
+        if latency:
+            self.factory.clock.callLater(latency, self._write, data)
+        else:
+            self._write(data)
+
+    def _write(self, data):
+        if self in self.factory.clients:
+            self.transport.write(data)
+
+    def _handle(self, kind, flags, body):
+        factory = self.factory
+        if kind == CONNECT:
+            protocol, offset = decodeString(body, 0)
+            level, connectFlags = body[offset], body[offset+1]
+            self.clientId, offset = decodeString(body, offset + 4)
+            self.cleanSession = bool(connectFlags & 0x02)
+            log.debug("<== CONNECT {id} ({proto} level {lvl})", id=self.clientId, proto=protocol, lvl=level)
+            self._reply(packet(CONNACK, bytes([0, factory.returnCode])))
+            if factory.returnCode:
+                self.transport.loseConnection()
+        elif kind == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, offset = decodeString(body, 0)
+            packetId = None
+            if qos:
+                packetId = struct.unpack_from('!H', body, offset)[0]
+                offset += 2
+            if qos < 2 or packetId not in self._unreleased:
+                factory.received(Received(factory.clock.seconds(), self.clientId, topic, body[offset:], qos, bool(flags & 0x08), bool(flags & 0x01)))
+            if qos == 1:
+                self._reply(packet(PUBACK, struct.pack('!H', packetId)))
+            elif qos == 2:
+                self._unreleased.add(packetId)
+                self._reply(packet(PUBREC, struct.pack('!H', packetId)))
+        elif kind == PUBREL:
+            packetId = struct.unpack('!H', body[:2])[0]
+            self._unreleased.discard(packetId)
+            self._reply(packet(PUBCOMP, body[:2]))
+        elif kind == SUBSCRIBE:
+            packetId, offset, granted = body[:2], 2, bytearray()
+            while offset < len(body):
+                topic, offset = decodeString(body, offset)
+                granted.append(min(body[offset], 2))
+                offset += 1
+            self._reply(packet(SUBACK, packetId + bytes(granted)))
+        elif kind == UNSUBSCRIBE:
+            self._reply(packet(UNSUBACK, body[:2]))
+        elif kind == PINGREQ:
+            self._reply(packet(PINGRESP))
+        elif kind == DISCONNECT:
+            self.transport.loseConnection()
+        else:
+            log.warn("Unexpected packet type {kind} from {id}", kind=kind, id=self.clientId)
+
+
+
+class FakeBroker(Factory):
+    '''
+    In-process MQTT 3.1.1 sink broker.
+
+    - latency:    seconds before sending any reply (CONNACK, PUBACK, ...)
+    - bandwidth:  inbound bytes per second, 0 for unlimited
+    - dropEvery:  drop the connection after every dropEvery PUBLISH, 0 for never
+    - returnCode: CONNACK return code (0 = accepted, other values refuse the connection)
+
+    Received PUBLISH packets are recorded in messages.
+    waitFor(n) returns a Deferred firing when n messages have been received.
+    '''
+
+    protocol = FakeBrokerProtocol
+
+    # So that we can patch it in tests with Clock ...
+    clock = reactor
+
+    def __init__(self, latency=0, bandwidth=0, dropEvery=0, returnCode=0):
+        self.latency    = latency
+        self.bandwidth  = bandwidth
+        self.dropEvery  = dropEvery
+        self.returnCode = returnCode
+        self.messages   = []
+        self.clients    = []
+        self._waiting   = []    # (n, Deferred)
+        self._ports     = []
+
+    def listen(self, description="tcp:1883:interface=127.0.0.1"):
+        '''Listen on a Twisted-style server endpoint. Returns a Deferred firing with the port'''
+        d = serverFromString(reactor, description).listen(self)
+        d.addCallback(self._listening)
+        return d
+
+    def stop(self):
+        for client in list(self.clients):
+            client.drop()
+        return defer.DeferredList([defer.maybeDeferred(port.stopListening) for port in self._ports])
+
+    def dropAll(self):
+        '''Forced disconnection of all clients'''
+        for client in list(self.clients):
+            client.drop()
+
+    def received(self, message):
+        self.messages.append(message)
+        n = len(self.messages)
+        for item in [item for item in self._waiting if item[0] <= n]:
+            self._waiting.remove(item)
+            item[1].callback(self.messages)
+        if self.dropEvery and n % self.dropEvery == 0:
+            self.dropAll()
+
+    def waitFor(self, n):
+        if len(self.messages) >= n:
+            return defer.succeed(self.messages)
+        deferred = defer.Deferred()
+        self._waiting.append((n, deferred))
+        return deferred
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _listening(self, port):
+        self._ports.append(port)
+        return port
+
+
+
+@implementer(IStreamClientEndpoint)
+class MemoryEndpoint(object):
+    '''Client endpoint connecting to a FakeBroker through in-memory transports'''
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def connect(self, factory):
+        client = factory.buildProtocol(None)
+        server = self.broker.buildProtocol(None)
+        loopbackAsync(server, client)
+        return defer.succeed(client)
+
+
+__all__ = [
+    "FakeBroker",
+    "MemoryEndpoint",
+    "Received",
+]
@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from zope.interface import implementer
+
+from twisted.logger              import Logger
+from twisted.internet            import defer
+from twisted.internet.interfaces import IPushProducer
+
+#--------------
+# local imports
+# -------------
+
+from tessw.mqttqueue          import NAMESPACE
+from tessw.mqttservice        import MQTTService
+from tessw.service.reloadable import MultiService
+
+# ----------------
+# Module constants
+# ----------------
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# -------
+# Classes
+# -------
+
+@implementer(IPushProducer)
+class FanOutService(MultiService):
+    '''
+    Publishes the same messages to several brokers.
+    Each broker section gets its own MQTTService child, with its own
+    connection, backoff, queue or outbox, so that a slow or unreachable
+    broker does not stall delivery to the others.
+    It offers the MQTTService API to the Supervisor. With the block queue
+    policy, photometers are only paused when the queues of all brokers are
+    saturated: until then, a full queue discards the incoming messages.
+    '''
+
+    def __init__(self, options, sections):
+        MultiService.__init__(self)
+        self._producers    = []
+        self._wasSaturated = False
+        for section in sections:
+            service = MQTTService(options[section], section)
+            service.setName(section)
+            service.setServiceParent(self)
+            service.registerProducer(self)
+
+    # -----------
+    # Service API
+    # -----------
+
+    @defer.inlineCallbacks
+    def reloadService(self, options):
+        for service in self:
+            if service.section in options:
+                yield service.reloadService(options)
+            else:
+                log.warn("Broker section {section} removed, restart needed to stop publishing to it", section=service.section)
+
+    # ----------------------------
+    # Backpressure (IPushProducer)
+    # ----------------------------
+
+    def pauseProducing(self):
+        '''Called by a broker queue when saturated'''
+        self._update()
+
+    def resumeProducing(self):
+        '''Called by a broker queue when drained'''
+        self._update()
+
+    def stopProducing(self):
+        pass
+
+    # ---------------
+    # MQTTService API
+    # ---------------
+
+    @property
+    def saturated(self):
+        return all(service.saturated for service in self)
+
+    def registerProducer(self, producer):
+        producer = IPushProducer(producer)
+        self._producers.append(producer)
+        if self.saturated:
+            producer.pauseProducing()
+
+    def unregisterProducer(self, producer):
+        try:
+            self._producers.remove(producer)
+        except ValueError:
+            pass
+
+    def flush(self):
+        return defer.gatherResults([service.flush() for service in self])
+
+    def getStatus(self):
+        return [status for service in self for status in service.getStatus()]
+
+    def addRegisterRequest(self, photometer_info):
+        for service in self:
+            service.addRegisterRequest(photometer_info)
+
+    def addStatus(self, status):
+        for service in self:
+            service.addStatus(status)
+
+    def addReading(self, reading, trace=None):
+        for service in self:
+            service.addReading(reading, trace)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _update(self):
+        '''Pause or resume photometers as a whole'''
+        saturated = self.saturated
+        if saturated and not self._wasSaturated:
+            log.warn("All broker queues saturated, pausing producers")
+            for producer in self._producers:
+                producer.pauseProducing()
+        elif self._wasSaturated and not saturated:
+            log.info("Some broker queue drained, resuming producers")
+            for producer in self._producers:
+                producer.resumeProducing()
+        self._wasSaturated = saturated
+
+
+__all__ = [
+    "FanOutService",
+]
@@ -0,0 +1,159 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+from tessw.metrics import PHOTOMETER_TRANSITIONS
+
+# ----------------
+# Module constants
+# ----------------
+
+# Photometer health states
+CONNECTING  = 'connecting'    # serial port not yet open
+REGISTERING = 'registering'   # serial port open, waiting for photometer info
+ONLINE      = 'online'        # registered and delivering samples regularly
+DEGRADED    = 'degraded'      # delivering samples, but intermittently
+STALLED     = 'stalled'       # missed the last sampling cycle(s)
+OFFLINE     = 'offline'       # missed ncycles consecutive sampling cycles
+
+STATES = (CONNECTING, REGISTERING, ONLINE, DEGRADED, STALLED, OFFLINE)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# -------
+# Classes
+# -------
+
+class PhotometerHealth(object):
+    '''
+    Per photometer health state machine.
+    It is fed by the supervisor with the outcome of each sampling cycle
+    (a sample was available or not) and derives the photometer state
+    from the sample arrival statistics:
+    - consecutive misses
+    - exponentially weighted availability (fraction of cycles with a sample)
+    - exponentially weighted inter-arrival time between samples, 
+      compared to the expected sampling period, if given
+    On every state change, onTransition(health, previous_state) is called.
+    '''
+
+    ALPHA            = 0.2  # EWMA smoothing factor
+    MIN_AVAILABILITY = 0.9  # Below this availability, an online photometer is degraded
+    MAX_INTERVAL     = 1.5  # Above this many periods between samples, an online photometer is degraded
+
+    def __init__(self, label, ncycles, onTransition=None, period=None):
+        self.label        = label
+        self.ncycles      = ncycles
+        self.period       = period  # expected time between samples, in seconds
+        self.onTransition = onTransition
+        self.state        = CONNECTING
+        self.since        = time.time()    # wall-clock time of last transition
+        self.connected    = False
+        self.registered   = False
+        self.misses       = 0       # consecutive cycles without a sample
+        self.availability = 1.0     # EWMA of samples per cycle
+        self.interval     = None    # EWMA of sample inter-arrival time
+        self.lastArrival  = None    # monotonic time of last sample
+        self.transitions  = {state: PHOTOMETER_TRANSITIONS.labels(label, state) for state in STATES}
+
+    # ------------------
+    # State machine API
+    # ------------------
+
+    def connect(self):
+        '''The serial port has been opened'''
+        self.connected = True
+        self._evaluate()
+
+    def register(self):
+        '''The photometer info has been sent to the register queue'''
+        self.registered = True
+        self._evaluate()
+
+    def hit(self):
+        '''A sample was available in this sampling cycle'''
+        now = time.monotonic()
+        if self.lastArrival is not None:
+            delta = now - self.lastArrival
+            self.interval = delta if self.interval is None else self.interval + self.ALPHA*(delta - self.interval)
+        self.lastArrival  = now
+        self.misses       = 0
+        self.availability += self.ALPHA*(1.0 - self.availability)
+        self._evaluate()
+
+    def miss(self):
+        '''No sample was available in this sampling cycle'''
+        self.misses       = min(self.ncycles, self.misses + 1)
+        self.availability -= self.ALPHA*self.availability
+        self._evaluate()
+
+    def isOffline(self):
+        return self.state == OFFLINE
+
+    def status(self):
+        '''Dictionary summary of the current health'''
+        return {
+            'state'        : self.state,
+            'since'        : self.since,
+            'misses'       : self.misses,
+            'availability' : round(self.availability, 3),
+            'interval'     : None if self.interval is None else round(self.interval, 3),
+        }
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _evaluate(self):
+        if self.misses >= self.ncycles:
+            state = OFFLINE
+        elif not self.registered:
+            state = REGISTERING if self.connected else CONNECTING
+        elif self.misses > 0:
+            state = STALLED
+        elif self.availability < self.MIN_AVAILABILITY or self._slow():
+            state = DEGRADED
+        else:
+            state = ONLINE
+        if state != self.state:
+            previous   = self.state
+            self.state = state
+            self.since = time.time()
+            self.transitions[state].inc()
+            if self.onTransition:
+                self.onTransition(self, previous)
+
+    def _slow(self):
+        return bool(self.period) and self.interval is not None and self.interval > self.MAX_INTERVAL*self.period
+
+
+__all__ = [
+    "PhotometerHealth",
+    "STATES",
+    "CONNECTING",
+    "REGISTERING",
+    "ONLINE",
+    "DEGRADED",
+    "STALLED",
+    "OFFLINE",
+]
@@ -13,19 +13,53 @@ from __future__ import division, absolute_import
 
 import os
 import sys
+import json
+import time
+import atexit
+import tempfile
+import threading
+
+from collections import deque, OrderedDict
 
 # ---------------
 # Twisted imports
 # ---------------
 
+from zope.interface import implementer
+
 from twisted.logger   import (
     Logger, LogLevel, globalLogBeginner, textFileLogObserver, 
-    FilteringLogObserver, LogLevelFilterPredicate)
+    FilteringLogObserver, LogLevelFilterPredicate, ILogObserver,
+    ILogFilterPredicate, PredicateResult, LogPublisher,
+    formatEvent, formatEventAsClassicLogText, formatTime)
+from twisted.logger._flatten import KeyFlattener, aFormatter
+from twisted.internet.task  import LoopingCall
 
 # ----------------
 # Module constants
 # ----------------
 
+# Log events kept in memory waiting to be written. Further events are dropped.
+BUFFER_SIZE = 10000
+
+# Maximun time an event waits in memory before being written, in seconds
+FLUSH_PERIOD = 1.0
+
+# Rotated log files kept (file.1 ... file.N)
+BACKUPS = 5
+
+# Distinct messages remembered for deduplication. Older ones are forgotten first.
+MAX_REMEMBERED = 1000
+
+# Maximum time between the end of a repetition window and its summary, in seconds
+SUMMARY_PERIOD = 1.0
+
+# Minimum time between flight recorder dumps triggered by critical events, in seconds
+MIN_DUMP_INTERVAL = 60
+
+# Event keys kept in event snapshots besides the flattened fields
+SNAPSHOT_KEYS = ('log_time', 'log_level', 'log_namespace', 'log_system', 'log_format', 'log_failure')
+
 # -----------------------
 # Module global variables
 # -----------------------
@@ -37,22 +71,85 @@ logLevelFilterPredicate = LogLevelFilterPredicate(defaultLogLevel=LogLevel.info)
 # Module Utility Functions
 # ------------------------
 
-def startLogging(console=True, filepath=None):
+def formatEventAsJSON(event):
+    '''
+    One compact JSON object per event, with the time, level,
+    namespace and formatted message, plus the traceback of failures
+    '''
+    record = {
+        'time'  : formatTime(event.get('log_time')),
+        'level' : event['log_level'].name if 'log_level' in event else None,
+        'ns'    : event.get('log_namespace'),
+        'msg'   : formatEvent(event),
+    }
+    if 'log_failure' in event:
+        record['traceback'] = event['log_failure'].getTraceback()
+    return json.dumps(record, separators=(',',':')) + '\n'
+
+
+def flattenEvent(event):
+    '''
+    Flattens the event fields into event['log_flattened'], where formatEvent() 
+    takes them from, as twisted.logger does, but honouring their format specs 
+    (i.e. "{lag:.3f}"), which Twisted ignores. Unformattable events are left as they are.
+    '''
+    fmt = event.get('log_format')
+    if fmt is None or 'log_flattened' in event:
+        return
+    fields, keys = {}, KeyFlattener()
+    try:
+        for literal, name, spec, conversion in aFormatter.parse(fmt):
+            if name is None:
+                continue
+            key = keys.flatKey(name, spec, conversion or 's')
+            if name.endswith("()"):
+                value = aFormatter.get_field(name[:-2], (), event)[0]()
+            else:
+                value = aFormatter.get_field(name, (), event)[0]
+            fields[key] = format(aFormatter.convert_field(value, conversion), spec or '')
+    except Exception:
+        return
+    event['log_flattened'] = fields
+
+
+def snapshotEvent(event):
+    '''
+    Flattened copy of the event, with only its SNAPSHOT_KEYS, to be formatted later,
+    maybe in another thread, whatever happens afterwards to the logged objects.
+    A shallow copy of unformattable events, so that formatEvent() reports why.
+    '''
+    flattenEvent(event)
+    if 'log_flattened' not in event:
+        return dict(event)
+    snapshot = {key: event[key] for key in SNAPSHOT_KEYS if key in event}
+    snapshot['log_flattened'] = event['log_flattened']
+    return snapshot
+
+
+def startLogging(console=True, filepath=None, fmt='text', maxSize=0):
     '''
     Starts the global Twisted logger subsystem with maybe
-    stdout and/or a file specified in the config file
+    stdout and/or a file specified in the config file.
+    The log file is written from a background thread, in 'text' 
+    or 'json' lines format and rotated when exceeding maxSize bytes (if not 0).
+    Events are filtered by level and then, only those passing it, by repetition,
+    once for all observers. The flight recorder gets them all, unfiltered.
     '''
-    global logLevelFilterPredicate
+    global logLevelFilterPredicate, logRepeatFilterPredicate, flightRecorder
    
     observers = []
     if console:
-        observers.append( FilteringLogObserver(observer=textFileLogObserver(sys.stdout),  
-            predicates=[logLevelFilterPredicate] ))
+        observers.append(textFileLogObserver(sys.stdout))
     
     if filepath is not None and filepath != "":
-        observers.append( FilteringLogObserver(observer=textFileLogObserver(open(filepath,'a')), 
-            predicates=[logLevelFilterPredicate] ))
-    globalLogBeginner.beginLoggingTo(observers)
+        formatter = formatEventAsJSON if fmt == 'json' else formatEventAsClassicLogText
+        observer  = AsyncFileLogObserver(filepath, formatter, maxSize)
+        observer.start()
+        atexit.register(observer.stop)
+        observers.append(observer)
+    # The repetition filter only sees the events that pass the level filter
+    globalLogBeginner.beginLoggingTo([ FilteringLogObserver(observer=LogPublisher(*observers), 
+        predicates=[logLevelFilterPredicate, logRepeatFilterPredicate]), flightRecorder ])
 
 
 def setLogLevel(namespace=None, levelStr='info'):
@@ -65,6 +162,308 @@ def setLogLevel(namespace=None, levelStr='info'):
     level = LogLevel.levelWithName(levelStr)
     logLevelFilterPredicate.setLogLevelForNamespace(namespace=namespace, level=level)
 
+
+def setFlightRecorder(size, directory=None):
+    '''Keep the last size log events (0 = none) to be dumped in directory'''
+    global flightRecorder
+
+    flightRecorder.resize(size, directory)
+
+
+def setLogLimits(window=60, rate=0, burst=0):
+    '''
+    Identical events of a namespace within window seconds are collapsed (0 = never).
+    Each namespace may log up to rate events per second, with bursts of burst events (0 = unlimited).
+    '''
+    global logRepeatFilterPredicate
+
+    logRepeatFilterPredicate.window = window
+    logRepeatFilterPredicate.rate   = rate
+    logRepeatFilterPredicate.burst  = max(burst, rate)
+    logRepeatFilterPredicate.schedule()
+
+# -------
+# Classes
+# -------
+
+@implementer(ILogFilterPredicate)
+class RepeatFilterPredicate(object):
+    '''
+    Log filter predicate collapsing identical events (same namespace, level, format
+    and flattened fields) logged again within window seconds of the first one. 
+    When the window expires, a single "repeated N times" event is logged instead of all of them.
+    It also limits the rate of events per namespace with a token bucket.
+    Errors and critical events are never rate limited.
+    Events are flattened but not formatted here, so that the observers format them only once.
+    Pending summaries are logged by a LoopingCall every SUMMARY_PERIOD seconds at most, 
+    so that a burst that stops gets its summary too.
+    '''
+
+    def __init__(self, window=0, rate=0, burst=0):
+        self.window   = window
+        self.rate     = rate
+        self.burst    = burst
+        self._seen    = OrderedDict()   # (namespace, level, format, fields hash) -> [expiry time, repetitions, event]
+        self._buckets = {}              # namespace -> [tokens, last time, suppressed]
+        self._logging = False           # logging summaries
+        self._summary = None            # LoopingCall logging summaries
+
+    def schedule(self):
+        '''(Re)starts the periodic summaries, if anything has to be summarized'''
+        if self._summary is not None and self._summary.running:
+            self._summary.stop()
+        self._summary = None
+        if self.window or self.rate:
+            period = min(self.window or SUMMARY_PERIOD, SUMMARY_PERIOD)
+            self._summary = LoopingCall(self.summarize)
+            self._summary.start(period, now=False)
+
+    def summarize(self):
+        '''Logs the summaries of the expired windows and suppressed events'''
+        self._expire(time.monotonic())
+        for namespace, bucket in self._buckets.items():
+            if bucket[2]:
+                self._suppressed(namespace, bucket)
+
+    def __call__(self, event):
+        if self._logging or not (self.window or self.rate):
+            return PredicateResult.maybe
+        now = time.monotonic()
+        self._expire(now)
+        namespace = event.get('log_namespace')
+        level     = event.get('log_level')
+        if self.window:
+            flattenEvent(event)
+            fields = event.get('log_flattened', {})
+            key = (namespace, level, event.get('log_format'), hash(tuple(sorted(fields.items()))))
+            entry = self._seen.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return PredicateResult.no
+            self._seen[key] = [now + self.window, 0, event]
+            if len(self._seen) > MAX_REMEMBERED:
+                self._summarize(*self._seen.popitem(last=False))
+        if self.rate and level is not None and level < LogLevel.error:
+            bucket = self._buckets.get(namespace)
+            if bucket is None:
+                bucket = self._buckets[namespace] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return PredicateResult.no
+            bucket[0] -= 1
+            if bucket[2]:
+                self._suppressed(namespace, bucket)
+        return PredicateResult.maybe
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _expire(self, now):
+        while self._seen:
+            key, entry = next(iter(self._seen.items()))
+            if entry[0] > now:
+                break
+            del self._seen[key]
+            self._summarize(key, entry)
+
+    def _summarize(self, key, entry):
+        if entry[1]:
+            namespace, level = key[0:2]
+            self._log(namespace, level, "Last message repeated {n} times: {message}", n=entry[1], message=formatEvent(entry[2]))
+
+    def _suppressed(self, namespace, bucket):
+        suppressed, bucket[2] = bucket[2], 0
+        self._log(namespace, LogLevel.warn, "{n} log messages suppressed (more than {rate} per second)", n=suppressed, rate=self.rate)
+
+    def _log(self, namespace, level, fmt, **kwargs):
+        self._logging = True
+        try:
+            Logger(namespace=namespace).emit(level, fmt, **kwargs)
+        finally:
+            self._logging = False
+
+
+# Global object to collapse repeated events and rate limit namespaces
+logRepeatFilterPredicate = RepeatFilterPredicate()
+
+
+
+@implementer(ILogObserver)
+class AsyncFileLogObserver(object):
+    '''
+    Log observer that never blocks the reactor on disk I/O nor formatting.
+    Event snapshots are appended to a bounded buffer (dropping them if it is full),
+    so that events may be freely modified afterwards, and formatted and written
+    in batches by a background thread, at least every FLUSH_PERIOD seconds.
+    The file is rotated when it would exceed maxSize bytes, keeping BACKUPS older files.
+    It is opened in append mode, so that it also plays well with external truncation
+    (i.e. logrotate copytruncate).
+    '''
+
+    def __init__(self, path, formatter=formatEventAsClassicLogText, maxSize=0, backups=BACKUPS):
+        self.path      = path
+        self.formatter = formatter
+        self.maxSize   = maxSize
+        self.backups   = backups
+        self.dropped   = 0
+        self._buffer   = deque()
+        self._wakeup   = threading.Condition()
+        self._stopped  = False
+        self._thread   = threading.Thread(target=self._run, name="log writer", daemon=True)
+        self._file     = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, event):
+        # Called from any thread, usually the reactor's
+        if len(self._buffer) >= BUFFER_SIZE:
+            self.dropped += 1
+            return
+        self._buffer.append(snapshotEvent(event))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        '''Write the pending events and stop the writer thread'''
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            with self._wakeup:
+                if not self._stopped:
+                    self._wakeup.wait(FLUSH_PERIOD)
+                stopped = self._stopped
+            try:
+                self._write()
+            except Exception as e:
+                sys.stderr.write("Error writing log file {0}: {1}\n".format(self.path, e))
+        self._file.close()
+
+    def _write(self):
+        buffer, lines = self._buffer, []
+        for i in range(len(buffer)):
+            event = buffer.popleft()
+            try:
+                text = self.formatter(event)
+            except Exception as e:
+                text = "Unformattable event {0!r}: {1}\n".format(event.get('log_format'), e)
+            if text is not None:
+                lines.append(text)
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.append(self.formatter({'log_time': time.time(), 'log_level': LogLevel.warn, 'log_namespace': 'logger',
+                'log_format': "{n} log events dropped", 'n': dropped}))
+        if not lines:
+            return
+        size  = os.fstat(self._file.fileno()).st_size if self.maxSize else 0
+        chunk = []
+        for line in lines:
+            if self.maxSize and size and size + len(line) > self.maxSize:
+                self._file.write(''.join(chunk))
+                self._rotate()
+                size, chunk = 0, []
+            chunk.append(line)
+            size += len(line)
+        self._file.write(''.join(chunk))
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = "{0}.{1}".format(self.path, i)
+            if os.path.exists(older):
+                os.replace(older, "{0}.{1}".format(self.path, i+1))
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+
+
+@implementer(ILogObserver)
+class FlightRecorder(object):
+    '''
+    Fixed size in-memory ring of the most recent log events of all levels,
+    debug included, whatever the namespace log levels. Only event snapshots 
+    are kept, so that later changes to the logged objects (i.e. readings) 
+    do not show up in the dump.
+    The ring is dumped to a file in directory on critical events (which include
+    unhandled failures), at most once per MIN_DUMP_INTERVAL, or on demand (i.e. SIGUSR2).
+    Messages are formatted when dumped.
+    '''
+
+    def __init__(self, size=0, directory=None):
+        self.directory = directory or tempfile.gettempdir()
+        self._ring     = deque(maxlen=size)
+        self._lastDump = None     # monotonic time
+        self._dumping  = False
+
+    @property
+    def size(self):
+        return self._ring.maxlen
+
+    def resize(self, size, directory=None):
+        if size != self._ring.maxlen:
+            self._ring = deque(self._ring, maxlen=size)
+        if directory:
+            self.directory = directory
+
+    def __call__(self, event):
+        if not self._ring.maxlen or self._dumping:
+            return
+        self._ring.append(snapshotEvent(event))
+        if event.get('log_level') == LogLevel.critical:
+            now = time.monotonic()
+            if self._lastDump is None or now - self._lastDump >= MIN_DUMP_INTERVAL:
+                try:
+                    self.dump()
+                except Exception:
+                    pass    # Already logged
+
+    def dump(self):
+        '''Write the recorded events to a new file. Returns its path'''
+        self._lastDump = time.monotonic()
+        events = list(self._ring)
+        base = os.path.join(self.directory, time.strftime("flight-%Y%m%dT%H%M%S"))
+        path, i = base + ".log", 1
+        while os.path.exists(path):
+            path, i = "{0}-{1}.log".format(base, i), i + 1
+        self._dumping = True
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(path, 'w', encoding='utf-8') as fd:
+                for event in events:
+                    try:
+                        text = formatEventAsClassicLogText(event)
+                    except Exception as e:
+                        text = "Unformattable event {0!r}: {1}\n".format(event.get('log_format'), e)
+                    if text is not None:
+                        fd.write(text)
+            Logger(namespace='logger').warn("Flight recorder: last {n} log events dumped to {path}", n=len(events), path=path)
+        except Exception as e:
+            Logger(namespace='logger').error("Flight recorder: could not dump to {path}: {excp!s}", path=path, excp=e)
+            raise
+        finally:
+            self._dumping = False
+        return path
+
+
+# Global object keeping the most recent events
+flightRecorder = FlightRecorder()
+
 # ----------------------------------------------------------------------
 
 # Convenient syslog functions for both Widndows and Linux
@@ -95,4 +494,4 @@ else:
     sysLogError = syslog.syslog
 
 
-__all__ = ["startLogging", "setLogLevel", "sysLogError", "sysLogInfo"]
\ No newline at end of file
+__all__ = ["startLogging", "setLogLevel", "setLogLimits", "setFlightRecorder", "AsyncFileLogObserver", "FlightRecorder", "sysLogError", "sysLogInfo"]
\ No newline at end of file
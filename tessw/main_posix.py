@@ -50,5 +50,7 @@ serv = IService(application)
 log.info('{program} {version}', program=serv.name, version=VERSION_STRING) 
 sysLogInfo("Starting {0} {1} Linux service".format(serv.name, VERSION_STRING ))
 serv.startService()
+# So that queued messages and readings are saved on SIGTERM too
+reactor.addSystemEventTrigger('before', 'shutdown', serv.stopService)
 reactor.run()
 sysLogInfo("{0} {1} Linux service stopped".format(serv.name, VERSION_STRING))
@@ -0,0 +1,228 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import sys
+import functools
+import tracemalloc
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger           import Logger
+from twisted.internet         import task, defer
+from twisted.internet.threads import deferToThread
+
+#--------------
+# local imports
+# -------------
+
+from tessw                    import MEMORY_SERVICE
+from tessw.metrics            import TRACED_MEMORY
+from tessw.service.reloadable import Service
+
+# ----------------
+# Module constants
+# ----------------
+
+# Allocations not worth reporting
+IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# Service Logging namespace
+NAMESPACE = 'memry'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+@functools.lru_cache(maxsize=None)
+def moduleName(filename):
+    '''
+    Module an allocation site belongs to: the full dotted name
+    for tessw modules and the top level package for the rest
+    '''
+    for prefix in sorted((os.path.abspath(path or os.curdir) for path in sys.path), key=len, reverse=True):
+        if filename.startswith(prefix + os.sep):
+            name = os.path.splitext(filename[len(prefix)+1:])[0].replace(os.sep, '.')
+            if name.endswith('.__init__'):
+                name = name[:-len('.__init__')]
+            return name if name.split('.')[0] == 'tessw' else name.split('.')[0]
+    return filename
+
+
+def groupByModule(snapshot, previous=None):
+    '''
+    Allocation statistics of a snapshot, grouped by module and compared
+    to a previous snapshot, if any. Returns a list of dictionaries
+    (module, size, diff, count) sorted by decreasing size growth.
+    '''
+    if previous is None:
+        stats = [(stat.traceback[0].filename, stat.size, stat.size, stat.count) for stat in snapshot.statistics('filename')]
+    else:
+        stats = [(stat.traceback[0].filename, stat.size, stat.size_diff, stat.count) for stat in snapshot.compare_to(previous, 'filename')]
+    modules = {}
+    for filename, size, diff, count in stats:
+        entry = modules.setdefault(moduleName(filename), [0, 0, 0])
+        entry[0] += size
+        entry[1] += diff
+        entry[2] += count
+    result = [{'module': name, 'size': size, 'diff': diff, 'count': count} for name, (size, diff, count) in modules.items()]
+    result.sort(key=lambda entry: (entry['diff'], entry['size']), reverse=True)
+    return result
+
+
+def _kib(n):
+    return "{0:.1f} KiB".format(n/1024)
+
+# -------
+# Classes
+# -------
+
+class MemoryProfiler(Service):
+    '''
+    Opt-in tracemalloc based memory profiling.
+    While tracing, a snapshot is taken every memory_interval seconds and
+    compared to the previous one; the memory_top modules whose allocations
+    grew the most are logged. Snapshots can also be taken on demand.
+    Nothing is traced (no overhead at all) while memory_interval is 0
+    and tracing has not been started on demand.
+    '''
+
+    def __init__(self, options, **kargs):
+        self.options   = options
+        self._task     = task.LoopingCall(self._periodic)
+        self._previous = None     # last snapshot
+        self._started  = False    # we started tracemalloc
+        self._taking   = None     # Deferred of the snapshot being taken
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    # -----------
+    # Service API
+    # -----------
+
+    def startService(self):
+        super().startService()
+        if self.options['memory_interval'] > 0:
+            self.startTracing()
+            self._task.start(self.options['memory_interval'], now=False)
+
+
+    def stopService(self):
+        if self._task.running:
+            self._task.stop()
+        self.stopTracing()
+        return super().stopService()
+
+
+    def reloadService(self, options):
+        options = options['global']
+        self.options['memory_top'] = options['memory_top']
+        if options['memory_interval'] != self.options['memory_interval']:
+            self.options['memory_interval'] = options['memory_interval']
+            if self._task.running:
+                self._task.stop()
+            if options['memory_interval'] > 0:
+                self.startTracing()
+                self._task.start(options['memory_interval'], now=False)
+            else:
+                self.stopTracing()
+
+    # ------------------
+    # Memory tracing API
+    # ------------------
+
+    def startTracing(self):
+        if tracemalloc.is_tracing():
+            return
+        log.info("starting {name}, memory allocations are being traced", name=MEMORY_SERVICE)
+        tracemalloc.start()
+        self._started = True
+        TRACED_MEMORY.setFunction(lambda: tracemalloc.get_traced_memory()[0])
+
+
+    def stopTracing(self):
+        if not self._started:
+            return      # Not ours
+        log.info("Memory allocations no longer traced")
+        tracemalloc.stop()
+        TRACED_MEMORY.setFunction(None)
+        self._started  = False
+        self._previous = None
+
+
+    def report(self):
+        '''
+        Take a snapshot and compare it to the previous one, in a thread.
+        Returns a Deferred firing with the per module statistics (see groupByModule)
+        '''
+        if not tracemalloc.is_tracing():
+            return defer.fail(RuntimeError("Memory allocations are not being traced"))
+        if self._taking is not None:
+            return defer.fail(RuntimeError("Snapshot already in progress"))
+        snapshot = tracemalloc.take_snapshot()
+        self._taking = deferToThread(self._compare, snapshot, self._previous)
+        self._taking.addCallbacks(self._compared, self._notCompared)
+        return self._taking
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _periodic(self):
+        self.report().addErrback(lambda failure: None)   # Do not stop the periodic task
+
+
+    def _compare(self, snapshot, previous):
+        '''Runs in a thread'''
+        snapshot = snapshot.filter_traces(IGNORED)
+        return snapshot, groupByModule(snapshot, previous)
+
+
+    def _notCompared(self, failure):
+        self._taking = None
+        log.failure("Error comparing memory snapshots: {excp!s}", failure=failure, excp=failure.value)
+        return failure
+
+
+    def _compared(self, result):
+        self._taking = None
+        filtered, stats = result
+        since = "since the last snapshot" if self._previous is not None else "in total"
+        self._previous = filtered
+        current, peak = tracemalloc.get_traced_memory()
+        top = stats[:self.options['memory_top']]
+        log.info("Traced memory {current} (peak {peak}). Top {n} modules by growth {since}:\n{lines}",
+            current=_kib(current), peak=_kib(peak), n=len(top), since=since,
+            lines='\n'.join("{0:>12} {1:>12} {2:>9} blocks  {3}".format('+'+_kib(entry['diff']) if entry['diff'] >= 0 else _kib(entry['diff']),
+                _kib(entry['size']), entry['count'], entry['module']) for entry in top))
+        return stats
+
+
+__all__ = [
+    "MemoryProfiler",
+    "groupByModule",
+]
@@ -0,0 +1,349 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import bisect
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger             import Logger
+from twisted.internet           import reactor
+from twisted.internet.endpoints import serverFromString
+from twisted.web.server         import Site
+from twisted.web.resource       import Resource
+
+#--------------
+# local imports
+# -------------
+
+from tessw                    import METRICS_SERVICE
+from tessw.service.reloadable import Service
+
+# ----------------
+# Module constants
+# ----------------
+
+# Default histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets for readings waiting up to a polling period, in seconds
+STAGE_BUCKETS = BUCKETS + (30.0, 60.0, 120.0, 300.0)
+
+# Finer buckets for the time spent in individual reactor calls, in seconds
+CALL_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = b'text/plain; version=0.0.4; charset=utf-8'
+
+# Service Logging namespace
+NAMESPACE = 'metrc'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# -------
+# Classes
+# -------
+
+class Registry(object):
+    '''Set of metrics exposed together'''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Duplicate metric {0}".format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self.metrics[name]
+
+    def collect(self):
+        '''
+        All metrics as a dictionary of name -> list of (labels dictionary, value),
+        where histogram values are their count and sum
+        '''
+        result = {}
+        for name, metric in self.metrics.items():
+            result[name] = [(dict(zip(metric.labelNames, values)), child.collect()) for values, child in metric.children()]
+        return result
+
+    def exposition(self):
+        '''All metrics in Prometheus text exposition format'''
+        lines = []
+        for name in sorted(self.metrics):
+            self.metrics[name].expose(lines)
+        return '\n'.join(lines) + '\n'
+
+
+# The process wide registry
+REGISTRY = Registry()
+
+
+class Metric(object):
+    '''
+    Base class for metrics with an optional set of label names.
+    The per label values children are obtained with labels(...), once,
+    and kept by the instrumented code, so that updates are plain
+    attribute increments in the hot paths.
+    A metric without labels is its own (single) child.
+    '''
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name       = name
+        self.help       = help
+        self.labelNames = tuple(labels)
+        self._children  = {}
+        if registry is not None:
+            registry.register(self)
+        if not self.labelNames:
+            self._init()
+            self._children[()] = self
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelNames):
+            raise ValueError("{0} expects labels {1}".format(self.name, self.labelNames))
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self.__class__.__new__(self.__class__)
+            child.name = self.name
+            child._copyFrom(self)
+            child._init()
+            self._children[values] = child
+            return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(value) for value in values), None)
+
+    def children(self):
+        '''(label values, child) pairs'''
+        return list(self._children.items())
+
+    def expose(self, lines):
+        lines.append("# HELP {0} {1}".format(self.name, self.help.replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append("# TYPE {0} {1}".format(self.name, self.TYPE))
+        for values, child in sorted(self._children.items()):
+            child._expose(lines, self.labelNames, values)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _copyFrom(self, parent):
+        pass
+
+    def _init(self):
+        raise NotImplementedError
+
+    def _expose(self, lines, names, values):
+        lines.append("{0}{1} {2}".format(self.name, _labels(names, values), _number(self.get())))
+
+    def collect(self):
+        return self.get()
+
+
+
+class Counter(Metric):
+    '''Monotonically increasing value'''
+
+    TYPE = 'counter'
+
+    def _init(self):
+        self.value    = 0
+        self.function = None
+
+    def inc(self, n=1):
+        self.value += n
+
+    def setFunction(self, function):
+        '''Counter kept elsewhere, i.e. dropped messages in a queue'''
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+
+class Gauge(Metric):
+    '''
+    Value that goes up and down. It can also be computed on
+    collection time from a function, i.e. the length of a queue.
+    '''
+
+    TYPE = 'gauge'
+
+    def _init(self):
+        self.value    = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, n=1):
+        self.value += n
+
+    def dec(self, n=1):
+        self.value -= n
+
+    def setFunction(self, function):
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+
+class Histogram(Metric):
+    '''Distribution of observed values in cumulative buckets'''
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        Metric.__init__(self, name, help, labels, registry)
+
+    def _copyFrom(self, parent):
+        self.buckets = parent.buckets
+
+    def _init(self):
+        self.counts = [0] * (len(self.buckets) + 1)   # last one is +Inf
+        self.sum    = 0.0
+        self.count  = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def collect(self):
+        return {'count': self.count, 'sum': self.sum}
+
+    def _expose(self, lines, names, values):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(self.name, _labels(names, values, ('le', _number(bound))), cumulative))
+        lines.append("{0}_sum{1} {2}".format(self.name, _labels(names, values), repr(self.sum)))
+        lines.append("{0}_count{1} {2}".format(self.name, _labels(names, values), self.count))
+
+
+
+class MetricsResource(Resource):
+    '''Serves a registry in Prometheus text format'''
+
+    isLeaf = True
+
+    def __init__(self, registry=REGISTRY):
+        Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', CONTENT_TYPE)
+        return self.registry.exposition().encode('utf-8')
+
+
+
+class MetricsService(Service):
+    '''
+    HTTP endpoint for the metrics registry (any path),
+    i.e. tcp:9108:interface=127.0.0.1
+    '''
+
+    def __init__(self, endpoint, registry=REGISTRY):
+        self.endpoint = endpoint
+        self.registry = registry
+        self.port     = None
+
+    def startService(self):
+        log.info("starting {name} on {endpoint}", name=METRICS_SERVICE, endpoint=self.endpoint)
+        super().startService()
+        d = serverFromString(reactor, self.endpoint).listen(Site(MetricsResource(self.registry)))
+        d.addCallbacks(self._listening, self._notListening)
+
+    def stopService(self):
+        super().stopService()
+        if self.port is not None:
+            return self.port.stopListening()
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _listening(self, port):
+        self.port = port
+
+    def _notListening(self, failure):
+        log.failure("Could not serve metrics on {endpoint}: {excp!s}", failure=failure, endpoint=self.endpoint, excp=failure.value)
+
+# ------------------------------------------
+# Metrics of the tessw-publisher components
+# ------------------------------------------
+
+LINES_RECEIVED = Counter("tessw_lines_received_total", "Lines received from the photometer", ("photometer",))
+LINES_PARSED   = Counter("tessw_lines_parsed_total", "Lines parsed as readings", ("photometer",))
+LINES_REJECTED = Counter("tessw_lines_rejected_total", "Lines not recognized as readings", ("photometer",))
+LINES_PAUSED   = Counter("tessw_lines_paused_total", "Lines discarded while the photometer was paused by backpressure", ("photometer",))
+BUFFER_OVERWRITES = Counter("tessw_buffer_overwrites_total", "Readings overwritten in the photometer buffer before being polled", ("photometer",))
+POLL_MISSES    = Counter("tessw_poll_misses_total", "Polling cycles without a reading from the photometer", ("photometer",))
+PHOTOMETER_TRANSITIONS = Counter("tessw_photometer_transitions_total", "Photometer health state transitions, by state entered", ("photometer", "state"))
+QUEUE_DEPTH    = Gauge("tessw_queue_depth", "Messages waiting in the outbound queue", ("broker",))
+QUEUE_DROPPED  = Counter("tessw_queue_dropped_total", "Messages dropped by the outbound queue", ("broker",))
+PUBLISHED      = Counter("tessw_published_total", "Messages published (acknowledged for QoS > 0)", ("broker",))
+PUBLISH_FAILED = Counter("tessw_publish_failed_total", "Failed publications", ("broker",))
+PUBLISH_LATENCY = Histogram("tessw_publish_latency_seconds", "Time from publish to acknowledgement", ("broker",))
+REACTOR_LAG    = Histogram("tessw_reactor_lag_seconds", "Delay of the reactor monitor probe over its scheduled time")
+REACTOR_LAG_MAX = Gauge("tessw_reactor_lag_max_seconds", "Maximum reactor lag in the last report period")
+READING_STAGE  = Histogram("tessw_reading_stage_seconds", "Time taken by a reading to reach a pipeline stage from the previous one", ("stage",), buckets=STAGE_BUCKETS)
+READING_LATENCY = Histogram("tessw_reading_latency_seconds", "Time from reception to publication of a reading", ("broker",), buckets=STAGE_BUCKETS)
+TRACED_MEMORY  = Gauge("tessw_traced_memory_bytes", "Memory allocated by Python, while being traced")
+CALL_DURATION  = Histogram("tessw_call_duration_seconds", "Time spent in reactor calls", ("call",), buckets=CALL_BUCKETS)
+
+
+__all__ = [
+    "Registry",
+    "REGISTRY",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsService",
+]
@@ -0,0 +1,146 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger           import Logger
+from twisted.internet         import reactor
+
+#--------------
+# local imports
+# -------------
+
+from tessw                    import MONITOR_SERVICE
+from tessw.metrics            import REACTOR_LAG, REACTOR_LAG_MAX, CALL_DURATION
+from tessw.service.reloadable import Service
+
+# ----------------
+# Module constants
+# ----------------
+
+# Late probes are reported at most once in this period, in seconds
+REPORT_PERIOD = 60
+
+# Service Logging namespace
+NAMESPACE = 'lagmn'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# -------
+# Classes
+# -------
+
+class ReactorMonitor(Service):
+    '''
+    Event loop saturation monitor.
+    A probe is scheduled every lag_interval seconds and the delay with which
+    it actually fires (the reactor lag) is recorded in a histogram.
+    Probes later than lag_threshold seconds are reported as warnings,
+    summarized once per REPORT_PERIOD, together with the slowest
+    instrumented reactor calls (lineReceived, poll, publish) in that period.
+    '''
+
+    # So that we can patch it in tests with Clock.callLater ...
+    callLater = reactor.callLater
+
+    def __init__(self, options, **kargs):
+        self.options   = options
+        self._probe    = None     # DelayedCall
+        self._expected = None     # monotonic time the probe should fire
+        self._reported = 0        # monotonic time of the last report
+        self._late     = 0        # late probes since the last report
+        self._maxLag   = 0.0      # since the last report
+        self._calls    = {}       # snapshot of CALL_DURATION sums & counts at the last report
+
+    @property
+    def recentMaxLag(self):
+        '''Maximum lag in the current or last report period'''
+        return max(self._maxLag, REACTOR_LAG_MAX.get())
+
+    # -----------
+    # Service API
+    # -----------
+
+    def startService(self):
+        log.info("starting {name}, probing every {t} seconds", name=MONITOR_SERVICE, t=self.options['lag_interval'])
+        super().startService()
+        self._reported = time.monotonic()
+        self._calls    = self._snapshot()
+        self._schedule()
+
+
+    def stopService(self):
+        if self._probe is not None and self._probe.active():
+            self._probe.cancel()
+        self._probe = None
+        return super().stopService()
+
+
+    def reloadService(self, options):
+        self.options['lag_threshold'] = options['global']['lag_threshold']
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _schedule(self):
+        interval = self.options['lag_interval']
+        self._expected = time.monotonic() + interval
+        self._probe = self.callLater(interval, self._fired)
+
+
+    def _fired(self):
+        lag = max(0.0, time.monotonic() - self._expected)
+        REACTOR_LAG.observe(lag)
+        if lag > self._maxLag:
+            self._maxLag = lag
+        if lag > self.options['lag_threshold']:
+            self._late += 1
+        now = time.monotonic()
+        if now - self._reported >= REPORT_PERIOD:
+            self._report(now)
+        self._schedule()
+
+
+    def _report(self, now):
+        REACTOR_LAG_MAX.set(self._maxLag)
+        calls = self._snapshot()
+        if self._late:
+            summary = []    # average time spent per call in the period
+            for name, (total, count) in sorted(calls.items()):
+                total0, count0 = self._calls.get(name, (0.0, 0))
+                if count > count0:
+                    summary.append("{0} {1:.2f} ms avg x {2}".format(name, 1000*(total-total0)/(count-count0), count-count0))
+            log.warn("Reactor lagging: {n} probes later than {t} s in the last {p:.0f} s, max lag {lag:.3f} s. Calls: {calls}",
+                n=self._late, t=self.options['lag_threshold'], p=now - self._reported, lag=self._maxLag,
+                calls=', '.join(summary) or 'none')
+        self._calls    = calls
+        self._reported = now
+        self._late     = 0
+        self._maxLag   = 0.0
+
+
+    def _snapshot(self):
+        return {values[0]: (child.sum, child.count) for values, child in CALL_DURATION.children()}
+
+
+__all__ = [
+    "ReactorMonitor",
+]
@@ -0,0 +1,247 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+from collections import deque
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger              import Logger
+from twisted.internet            import defer
+from twisted.internet.interfaces import IPushProducer
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Queue drop policies when full
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+COALESCE    = 'coalesce'
+BLOCK       = 'block'
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE, BLOCK)
+
+# Producers are resumed when the queue drains below this fraction of its capacity
+LOW_WATER = 0.5
+
+# Service Logging namespace
+NAMESPACE = 'mqttS'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# -------
+# Classes
+# -------
+
+class Message(object):
+    '''
+    An already encoded MQTT message waiting to be published.
+    key identifies the photometer it comes from (for coalescing)
+    or is None for messages that must never be coalesced.
+    '''
+
+    __slots__ = ('topic', 'payload', 'qos', 'key', 'rowid', 'traces')
+
+    def __init__(self, topic, payload, qos=0, key=None, rowid=None, traces=None):
+        self.topic   = topic
+        self.payload = payload
+        self.qos     = qos
+        self.key     = key
+        self.rowid   = rowid    # Outbox row id, if persisted
+        self.traces  = traces   # Latency traces of the readings carried, if any
+
+    def __len__(self):
+        return len(self.topic) + len(self.payload)
+
+
+
+class BoundedQueue(object):
+    '''
+    A DeferredQueue-like FIFO queue of Messages bounded both in
+    number of messages and in bytes.
+    When full, incoming messages are handled according to a policy:
+    - drop-oldest: discard the oldest queued messages to make room.
+    - drop-newest: discard the incoming message.
+    - coalesce:    replace the oldest queued message from the same
+                   photometer, falling back to drop-oldest.
+    - block:       pause the registered IPushProducers while the queue
+                   is saturated and resume them when it drains below its
+                   low water mark. Control messages (register, status,
+                   whose key is None) are queued even beyond the limits, 
+                   so that no photometer state transition is lost. 
+                   Other messages arriving while full are discarded.
+    With the other policies, producers are never paused, so that the
+    policy decides which readings are lost.
+    Messages handed out by get() are kept in flight until ack()'ed
+    and are put back in front of the queue by rewind().
+    '''
+
+    def __init__(self, size, nbytes, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy {0}".format(policy))
+        self.size      = size
+        self.nbytes    = nbytes
+        self.policy    = policy
+        self.pending   = deque()
+        self.waiting   = []
+        self.bytes     = 0
+        self.dropped   = 0
+        self.saturated = False
+        self._inflight  = {}    # id(message) -> message, in order
+        self._producers = []
+
+    def __len__(self):
+        return len(self.pending)
+
+    # ------------------------
+    # Backpressure (producers)
+    # ------------------------
+
+    def registerProducer(self, producer):
+        producer = IPushProducer(producer)
+        self._producers.append(producer)
+        if self.saturated:
+            producer.pauseProducing()
+
+    def unregisterProducer(self, producer):
+        try:
+            self._producers.remove(producer)
+        except ValueError:
+            pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    # ---------
+    # Queue API
+    # ---------
+
+    def put(self, message):
+        if self.waiting:
+            self.waiting.pop(0).callback(message)
+            return
+        if self._full(message) and not self._makeRoom(message):
+            self.dropped += 1
+            log.debug("Queue full, dropping newest message on {topic}", topic=message.topic)
+            return
+        self.pending.append(message)
+        self.bytes += len(message)
+        if self.policy == BLOCK and not self.saturated and self._full(message):
+            self.saturated = True
+            log.warn("Queue saturated ({n} messages, {b} bytes), pausing producers", n=len(self.pending), b=self.bytes)
+            for producer in self._producers:
+                producer.pauseProducing()
+
+
+    def poll(self):
+        '''Next message without waiting, or None if the queue is empty'''
+        if not self.pending:
+            return None
+        message = self.pending.popleft()
+        self.bytes -= len(message)
+        self._inflight[id(message)] = message
+        if self.saturated and len(self.pending) <= LOW_WATER*self.size and self.bytes <= LOW_WATER*self.nbytes:
+            self.saturated = False
+            log.info("Queue drained ({n} messages, {b} bytes), resuming producers", n=len(self.pending), b=self.bytes)
+            for producer in self._producers:
+                producer.resumeProducing()
+        return message
+
+
+    def get(self):
+        message = self.poll()
+        if message is not None:
+            return defer.succeed(message)
+        deferred = defer.Deferred(canceller=self.waiting.remove)
+        deferred.addCallback(self._takeOff)
+        self.waiting.append(deferred)
+        return deferred
+
+
+    def ack(self, message):
+        '''
+        Message has been published and can be forgotten.
+        Late or duplicate acknowledgements (i.e. after a rewind) are ignored
+        '''
+        self._inflight.pop(id(message), None)
+
+
+    def rewind(self, keep=()):
+        '''
+        Put unacknowledged messages back in front of the queue, in order,
+        except those in keep, which are still in flight
+        '''
+        for message in reversed(list(self._inflight.values())):
+            if message not in keep:
+                del self._inflight[id(message)]
+                self.pending.appendleft(message)
+                self.bytes += len(message)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _takeOff(self, message):
+        self._inflight[id(message)] = message
+        return message
+
+    def _full(self, message):
+        '''True if there is no room for message'''
+        return len(self.pending) >= self.size or self.bytes + len(message) > self.nbytes
+
+    def _evict(self, index):
+        victim = self.pending[index]
+        del self.pending[index]
+        self.bytes -= len(victim)
+        self.dropped += 1
+        log.debug("Queue full, dropping queued message on {topic}", topic=victim.topic)
+
+    def _makeRoom(self, message):
+        '''Apply the drop policy. Returns False if the incoming message must be dropped'''
+        if len(message) > self.nbytes:
+            return False
+        if self.policy == BLOCK:
+            return message.key is None
+        if self.policy == DROP_NEWEST:
+            return False
+        if self.policy == COALESCE and message.key is not None:
+            for i, queued in enumerate(self.pending):
+                if queued.key == message.key:
+                    self._evict(i)
+                    break
+        while self.pending and self._full(message):
+            self._evict(0)
+        return True
+
+
+__all__ = [
+    "Message",
+    "BoundedQueue",
+    "POLICIES",
+    "DROP_OLDEST",
+    "DROP_NEWEST",
+    "COALESCE",
+    "BLOCK",
+]
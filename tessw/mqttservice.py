@@ -11,6 +11,8 @@
 from __future__ import division, absolute_import
 
 import json
+import time
+import random
 import platform
 
 # ---------------
@@ -19,18 +21,26 @@ import platform
 
 from twisted.logger               import Logger
 from twisted.internet             import reactor, task
-from twisted.internet.defer       import inlineCallbacks, DeferredQueue, DeferredList
-from twisted.internet.endpoints   import clientFromString
+from twisted.internet.defer       import inlineCallbacks, DeferredList, Deferred, CancelledError, succeed
+from twisted.internet.task        import TaskDone
+from twisted.internet.error       import ConnectionClosed
 from twisted.application.internet import ClientService, backoffPolicy
 
 from mqtt.error          import MQTTStateError
 from mqtt.client.factory import MQTTFactory
+from mqtt.client.pubsubs import MQTTSessionCleared
 
 #--------------
 # local imports
 # -------------
 
-from tessw.logger import setLogLevel
+from tessw.logger    import setLogLevel
+from tessw.mqttqueue import Message, BoundedQueue
+from tessw.outbox    import Outbox
+from tessw.batcher   import ReadingBatcher, encodeBatch
+from tessw.encoding  import Encoder
+from tessw.failover  import FailoverEndpoint
+from tessw.metrics   import QUEUE_DEPTH, QUEUE_DROPPED, PUBLISHED, PUBLISH_FAILED, PUBLISH_LATENCY, CALL_DURATION
 
 # ----------------
 # Module constants
@@ -44,6 +54,11 @@ INITIAL_DELAY = 4   # seconds
 FACTOR        = 2
 MAX_DELAY     = 600 # seconds
 
+# Reconnection delay after losing the connection 
+# when there are alternative brokers
+FAILOVER_DELAY  = 0.1  # seconds
+FAILOVER_JITTER = 0.2  # seconds
+
 # Service Logging namespace
 NAMESPACE = 'mqttS'
 
@@ -56,26 +71,66 @@ PROTOCOL_NAMESPACE = 'mqtt'
 
 log  = Logger(namespace=NAMESPACE)
 
-class MQTTService(ClientService):
+PUBLISH_DURATION = CALL_DURATION.labels('publish')
 
-    # Default publish QoS
-    
-    QoS = 0
-    
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def failoverPolicy(policy, delay=FAILOVER_DELAY, jitter=FAILOVER_JITTER):
+    '''
+    Retry at once after losing the connection, as the failover endpoint
+    will try the other brokers. Backs off with policy when all of them fail.
+    '''
+    def retry(attempt):
+        if attempt <= 1:
+            return delay + random.uniform(0, jitter)
+        return policy(attempt - 1)
+    return retry
+
+# -------
+# Classes
+# -------
 
-    def __init__(self, options, **kargs):
+class MQTTService(ClientService):
+
+    def __init__(self, options, section="mqtt", **kargs):
         self.options = options
+        self.section = section
         setLogLevel(namespace=NAMESPACE, levelStr=options['log_level'])
         setLogLevel(namespace=PROTOCOL_NAMESPACE, levelStr=options['log_messages'])
         self.factory     = MQTTFactory(profile=MQTTFactory.PUBLISHER)
-        self.endpoint    = clientFromString(reactor, self.options['broker'])
+        self.endpoint    = FailoverEndpoint(reactor, self.options['broker'], self.options['probe_interval'])
         self.task = None
+        self._pending = 0       # messages in the publishing window
+        self._wakeup  = None    # Deferred the publishing task waits for
+        self._slot    = None    # Deferred fired when there is room in the window
+        self._session = set()   # QoS > 0 messages held by the MQTT session until acknowledged
+        self._sessionAddr = None
+        self.clientId = self.options['client_id'] or "tessw-publisher" + '@' + HOSTNAME
         if self.options['username'] == "":
             self.options['username'] = None
             self.options['password'] = None
-        ClientService.__init__(self, self.endpoint, self.factory, 
-            retryPolicy=backoffPolicy(initialDelay=INITIAL_DELAY, factor=FACTOR, maxDelay=MAX_DELAY))
-        self.queue = DeferredQueue()
+        policy = backoffPolicy(initialDelay=INITIAL_DELAY, factor=FACTOR, maxDelay=MAX_DELAY)
+        if len(self.endpoint.brokers) > 1:
+            policy = failoverPolicy(policy)
+        ClientService.__init__(self, self.endpoint, self.factory, retryPolicy=policy)
+        if self.options['outbox']:
+            self.queue = Outbox(options['outbox'], options['outbox_size'], options['outbox_commit'])
+        else:
+            self.queue = BoundedQueue(options['queue_size'], options['queue_bytes'], options['queue_policy'])
+        self.encoder      = Encoder(options['encoding'])
+        self.batchEncoder = Encoder(options['encoding'], options['compress'])
+        QUEUE_DEPTH.labels(section).setFunction(lambda: len(self.queue))
+        QUEUE_DROPPED.labels(section).setFunction(lambda: self.queue.dropped)
+        self._nPublished = PUBLISHED.labels(section)
+        self._nFailed    = PUBLISH_FAILED.labels(section)
+        self._latency    = PUBLISH_LATENCY.labels(section)
+        self.batcher = None
+        self._templates = {}    # photometer name -> (reading topic, encoding function)
+        if options['batch_size'] > 1:
+            self.batcher = ReadingBatcher(options['batch_size'], options['batch_window']/1000, 
+                options['batch_mode'], self.addBatch)
     
     # -----------
     # Service API
@@ -83,25 +138,38 @@ class MQTTService(ClientService):
     
     def startService(self):
         log.info("starting MQTT Client Service")
-        self.whenConnected().addCallback(self.connectToBroker)
+        self.queue.start()
+        self.whenConnected().addCallbacks(self.connectToBroker, self._notConnected)
         super().startService()
 
 
     @inlineCallbacks
     def stopService(self):
+        if self.batcher:
+            self.batcher.flushAll()
         try:
             yield ClientService.stopService(self)
         except Exception as e:
             log.failure("Exception {excp!s}", excp=e)
             reactor.stop()
+        finally:
+            self.endpoint.stop()
+            yield self.queue.stop()
 
 
-    @inlineCallbacks
     def reloadService(self, options):
+        '''
+        Reload the reloadable properties only.
+        Neither the connection nor the queued messages are affected.
+        '''
+        options = options[self.section]
         setLogLevel(namespace=NAMESPACE, levelStr=options['log_level'])
         setLogLevel(namespace=PROTOCOL_NAMESPACE, levelStr=options['log_messages'])
         log.info("new log level is {lvl}", lvl=options['log_level'])
-        self.options = options
+        if options['topic'] != self.options['topic']:
+            self._templates = {}
+        for key in ('log_level', 'log_messages', 'topic'):
+            self.options[key] = options[key]
       
 
     # -------------
@@ -121,17 +189,20 @@ class MQTTService(ClientService):
         self.protocol                 = protocol
         self.protocol.onPublish       = self.publish
         self.protocol.onDisconnection = self.onDisconnection
-        self.protocol.setWindowSize(3)
+        self.protocol.setWindowSize(self.options['window'])
         try:
-            yield self.protocol.connect("tessw-publisher" + '@' + HOSTNAME, 
+            yield self.protocol.connect(self.clientId, 
                 username=self.options['username'], password=self.options['password'], 
-                keepalive=self.options['keepalive'])
+                keepalive=self.options['keepalive'], cleanStart=self.options['clean_session'])
         except Exception as e:
             log.failure("Connecting to {broker} raised {excp!s}", 
-               broker=self.options['broker'], excp=e)
+               broker=self.endpoint.broker, excp=e)
+            if len(self.endpoint.brokers) > 1:
+                self.protocol.transport.loseConnection()    # Try the next one
         else:
-            log.info("Connected to {broker}", broker=self.options['broker'])
-            reactor.callLater(0, self.publish)
+            log.info("Connected to {broker}", broker=self.endpoint.broker)
+            self._resumeSession(protocol)
+            self.task = self.publish()
 
 
     def onDisconnection(self, reason):
@@ -139,38 +210,222 @@ class MQTTService(ClientService):
         Disconenction handler.
         Tells ClientService what to do when the connection is lost
         '''
-        log.warn("tessw-publisher lost connection with its MQTT broker")
-        if self.task:
-            self.task.cancel()
-        self.task = None
-        self.whenConnected().addCallback(self.connectToBroker)
+        log.warn("tessw-publisher lost connection with its MQTT broker {broker}", broker=self.endpoint.broker)
+        self.endpoint.disconnected()
+        self._stopPublishing()
+        self.whenConnected().addCallbacks(self.connectToBroker, self._notConnected)
+
+
+    @property
+    def saturated(self):
+        '''True while the outbound queue applies backpressure'''
+        return self.queue.saturated
+
+
+    def registerProducer(self, producer):
+        '''Producers to be paused when the outbound queue is saturated'''
+        self.queue.registerProducer(producer)
+
+
+    def unregisterProducer(self, producer):
+        self.queue.unregisterProducer(producer)
+
+
+    def flush(self):
+        '''
+        Publish the readings being batched and commit the outbox now.
+        Returns a Deferred
+        '''
+        if self.batcher:
+            self.batcher.flushAll()
+        if self.options['outbox']:
+            return self.queue.flush()
+        return succeed(None)
+
+
+    def getStatus(self):
+        '''Cheap status summary per broker, for the control interface'''
+        return [{
+            'broker'    : self.section,
+            'endpoint'  : self.endpoint.broker,
+            'connected' : self.task is not None,
+            'saturated' : self.queue.saturated,
+            'queue'     : len(self.queue),
+            'dropped'   : self.queue.dropped,
+            'inflight'  : self._pending,
+            'published' : self._nPublished.value,
+            'failed'    : self._nFailed.value,
+            'latency'   : {'count': self._latency.count, 'sum': self._latency.sum},
+        }]
+
 
-  
     def addRegisterRequest(self, photometer_info):
         topic = "{0}/{1}".format(self.options['topic'], "register")
-        self.queue.put( (topic, photometer_info) )
+        self.queue.put(Message(topic, json.dumps(photometer_info), qos=self.options['register_qos']))
 
 
-    def addReading(self, reading):
-        topic = "{0}/{1}/{2}".format(self.options['topic'], reading['name'], "reading")
-        self.queue.put( (topic, reading) )
+    def addStatus(self, status):
+        topic = "{0}/{1}/{2}".format(self.options['topic'], status['name'], "status")
+        self.queue.put(Message(topic, json.dumps(status), qos=self.options['register_qos']))
+
+
+    def addReading(self, reading, trace=None):
+        if trace is not None:
+            trace = trace.branch()
+            trace.mark()
+        if self.batcher:
+            self.batcher.add(reading, trace)
+            return
+        name = reading['name']
+        try:
+            topic, encode = self._templates[name]
+        except KeyError:
+            topic  = "{0}/{1}/{2}{3}".format(self.options['topic'], name, "reading", self.encoder.suffix)
+            encode = self.encoder.template()
+            self._templates[name] = (topic, encode)
+        self.queue.put(Message(topic, encode(reading), qos=self.options['reading_qos'], key=name, 
+            traces=None if trace is None else (trace,)))
+
+
+    def addBatch(self, name, readings, traces=None):
+        '''Batches go to {topic}/{name}/readings or {topic}/gateway/{hostname}/readings'''
+        name  = name if name is not None else "gateway/" + HOSTNAME
+        topic = "{0}/{1}/{2}{3}".format(self.options['topic'], name, "readings", self.batchEncoder.suffix)
+        payload = self.batchEncoder.encode(encodeBatch(readings), separators=(',',':'))
+        self.queue.put(Message(topic, payload, qos=self.options['reading_qos'], key=name, traces=traces))
 
 
-    @inlineCallbacks
     def publish(self):
+        '''
+        Pipelined publishing: keeps up to 'window' messages in flight.
+        Each wakeup drains all the queued messages that fit in the window,
+        as a cooperative task, so that a backlog does not take a reactor 
+        round trip per message nor starve the serial ports.
+        Messages are acknowledged to the queue (i.e. deleted from the outbox) 
+        when their publish() Deferred fires: upon PUBACK for QoS 1 
+        or as soon as they are written for QoS 0.
+        Returns the cooperative task.
+        '''
         log.info("Entering Registry & Data Publishing Phase")
-        while True:
-            try:
-                topic, reading = yield self.queue.get()
-                msg = json.dumps(reading)
-                yield self.protocol.publish(topic=topic, qos=self.QoS, message=msg)
-            except MQTTStateError as e:
-                log.error("{excp}",excp=e)
-            except Exception as e:
-                log.failure("Error when publishing: {excp!s}",excp=e)
-            else:
-                pass
+        self._pending = 0
+        self._wakeup  = None
+        self._slot    = None
+        return task.cooperate(self._drain(self.protocol))
 
     # --------------
     # Helper methods
     # --------------
+
+    def _drain(self, protocol):
+        '''Publishing iterator. Yields Deferreds to wait for messages or window room'''
+        window = self.options['window']
+        while True:
+            if self._pending >= window:
+                self._slot = self._wakeup = Deferred()
+                yield self._wakeup
+                continue
+            message = self.queue.poll()
+            if message is None:
+                self._wakeup = self.queue.get()
+                self._wakeup.addCallback(self._send, protocol)
+                yield self._wakeup
+                continue
+            self._send(message, protocol)
+            yield None
+
+
+    def _send(self, message, protocol):
+        self._pending += 1
+        start = time.perf_counter()
+        deferred = protocol.publish(topic=message.topic, qos=message.qos, message=message.payload)
+        PUBLISH_DURATION.observe(time.perf_counter() - start)
+        if message.qos and not deferred.called:
+            self._session.add(message)
+        deferred.addCallbacks(self._published, self._notPublished, 
+            callbackArgs=(message, time.monotonic()), errbackArgs=(message, protocol))
+        deferred.addBoth(self._release, protocol)
+
+
+    def _release(self, result, protocol):
+        '''A message left the window'''
+        if protocol is not self.protocol or self.task is None:
+            return      # From a previous connection or no longer publishing
+        self._pending -= 1
+        slot, self._slot = self._slot, None
+        if slot is not None and not slot.called:
+            slot.callback(None)
+
+
+    def _stopPublishing(self):
+        if self.task is None:
+            return
+        wakeup, self._wakeup = self._wakeup, None
+        self._slot = None
+        try:
+            self.task.stop()
+        except TaskDone:
+            pass
+        if wakeup is not None and not wakeup.called:
+            wakeup.cancel()
+        self.task = None
+        log.debug("Publishing phase cancelled")
+
+
+    def _notConnected(self, failure):
+        failure.trap(CancelledError)
+        log.debug("Service stopped before connecting to {broker}", broker=self.endpoint.broker)
+
+
+    def _resumeSession(self, protocol):
+        '''
+        Messages not acknowledged in the previous connection are published again.
+        With a persistent session on the same broker, the MQTT protocol itself
+        resends its unacknowledged packets with the DUP flag, so they are kept in flight.
+        '''
+        if self.options['clean_session']:
+            self.queue.rewind()
+            return
+        if self._sessionAddr is not None and self._sessionAddr != protocol.addr:
+            self._abandonSession(self._sessionAddr)
+        self._sessionAddr = protocol.addr
+        self.queue.rewind(keep=self._session)
+
+
+    def _abandonSession(self, addr):
+        '''Session state with a broker we are no longer connected to (i.e. after a failover)'''
+        factory  = self.factory
+        requests = list(factory.windowPublish.pop(addr, {}).values())
+        requests.extend(factory.windowPubRelease.pop(addr, {}).values())
+        requests.extend(factory.queuePublishTx.pop(addr, ()))
+        pending  = [request.deferred for request in requests if not request.deferred.called]
+        log.info("Abandoning the session with {addr}, {n} messages to be published again", addr=addr, n=len(pending))
+        for deferred in pending:
+            deferred.errback(MQTTSessionCleared())
+
+
+    def _published(self, result, message, start):
+        self._latency.observe(time.monotonic() - start)
+        if message.traces is not None:
+            for trace in message.traces:
+                trace.mark()
+                trace.finish(message.key, self.section)
+        self._nPublished.value += 1
+        self._session.discard(message)
+        self.queue.ack(message)
+
+
+    def _notPublished(self, failure, message, protocol):
+        self._nFailed.value += 1
+        self._session.discard(message)
+        if failure.check(MQTTStateError, ConnectionClosed):
+            # Connection gone before onDisconnection() is called: stop draining the queue
+            # into it, once. The message is kept in flight, to be rewound when reconnected.
+            if protocol is self.protocol and self.task is not None:
+                log.warn("Publishing stopped, no connection with {broker}: {excp!s}", broker=self.endpoint.broker, excp=failure.value)
+                self._stopPublishing()
+        elif failure.check(ValueError, TypeError):
+            log.failure("Error when publishing, discarding message: {excp!s}", failure=failure, excp=failure.value)
+            self.queue.ack(message)
+        else:
+            # Kept in flight, to be published again after reconnecting
+            log.error("Publishing on {topic} failed: {excp!s}", topic=message.topic, excp=failure.value)
@@ -0,0 +1,286 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import sqlite3
+
+from collections import deque
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger   import Logger
+from twisted.internet import defer, task
+from twisted.internet.threads import deferToThread
+
+#--------------
+# local imports
+# -------------
+
+from tessw.mqttqueue import Message
+
+# ----------------
+# Module constants
+# ----------------
+
+# Rows read from disk at a time when draining a backlog
+FETCH_SIZE = 100
+
+# Flush immediately when this many messages are waiting for a group commit
+GROUP_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox_t
+(
+    rowid    INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic    TEXT NOT NULL,
+    payload  BLOB NOT NULL,
+    qos      INTEGER NOT NULL DEFAULT 0,
+    key      TEXT
+)
+'''
+
+# Service Logging namespace
+NAMESPACE = 'mqttS'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# -------
+# Classes
+# -------
+
+class Outbox(object):
+    '''
+    Persistent FIFO of outbound Messages in a SQLite database in WAL mode.
+    It has the same interface as BoundedQueue and survives restarts,
+    crashes and long broker outages, at the cost of disk space only.
+
+    - put() buffers messages in memory, which are inserted in a single
+      transaction (group commit, one fsync) every commit interval seconds,
+      in a thread, so that a slow disk never blocks the reactor.
+    - get() hands out committed messages strictly in order and keeps them
+      in flight until ack()'ed. Acknowledged rows are deleted in the next
+      group commit, so that the table itself is the crash-safe offset:
+      after a crash, unacknowledged messages are published again.
+    - rewind() hands out again the in flight messages (i.e. on reconnect).
+    - When the table exceeds size rows, the oldest ones are discarded.
+    '''
+
+    def __init__(self, path, size, interval):
+        self.path      = path
+        self.size      = size
+        self.interval  = interval
+        self.waiting   = []
+        self.dropped   = 0
+        self.saturated = False      # Never applies backpressure
+        self._unsaved  = []         # put() but not yet committed
+        self._acked    = []         # row ids acknowledged but not yet deleted
+        self._ready    = deque()    # committed messages not yet handed out
+        self._inflight = {}         # row id -> message handed out but not acknowledged
+        self._cursor   = 0          # highest row id read into memory
+        self._backlog  = True       # there may be committed rows not yet in memory
+        self._transit  = 0          # messages added by the commit in progress
+        self._committing = None     # Deferred of the commit in progress
+        self._task     = task.LoopingCall(self.flush)
+        # Written to only from the commit thread, read from the reactor thread.
+        self._conn     = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(SCHEMA)
+        self._reader   = sqlite3.connect(path, isolation_level=None)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM outbox_t").fetchone()[0]
+        if self._count:
+            log.info("Outbox {path} has {n} messages pending from a previous run", path=path, n=self._count)
+
+    def __len__(self):
+        return self._count + self._transit + len(self._unsaved) - len(self._acked)
+
+    def start(self):
+        self._task.start(self.interval, now=False)
+
+    @defer.inlineCallbacks
+    def stop(self):
+        if self._task.running:
+            self._task.stop()
+        if self._committing is not None:
+            yield self._committing
+        yield self.flush()
+        self._reader.close()
+        self._conn.close()
+
+    # ------------------------
+    # Backpressure (producers)
+    # ------------------------
+
+    def registerProducer(self, producer):
+        pass
+
+    def unregisterProducer(self, producer):
+        pass
+
+    # ---------
+    # Queue API
+    # ---------
+
+    def put(self, message):
+        self._unsaved.append(message)
+        if len(self._unsaved) >= GROUP_SIZE:
+            self.flush()
+
+
+    def poll(self):
+        '''Next committed message without waiting, or None if there is none'''
+        self._fill()
+        return self._takeOff() if self._ready else None
+
+
+    def get(self):
+        message = self.poll()
+        if message is not None:
+            return defer.succeed(message)
+        deferred = defer.Deferred(canceller=self.waiting.remove)
+        self.waiting.append(deferred)
+        return deferred
+
+
+    def ack(self, message):
+        '''Message has been published and can be deleted from disk'''
+        if self._inflight.pop(message.rowid, None) is not None:
+            self._acked.append(message.rowid)
+
+
+    def rewind(self, keep=()):
+        '''
+        Put unacknowledged messages back in front of the queue, in order,
+        except those in keep, which are still in flight
+        '''
+        for rowid in sorted(self._inflight, reverse=True):
+            if self._inflight[rowid] not in keep:
+                self._ready.appendleft(self._inflight.pop(rowid))
+
+
+    def flush(self):
+        '''
+        Group commit of pending insertions and deletions, in a thread.
+        Returns a Deferred fired when committed (or failed and logged)
+        '''
+        if self._committing is not None:
+            return defer.succeed(None)  # The next one will commit them
+        if not (self._unsaved or self._acked):
+            return defer.succeed(None)
+        unsaved, self._unsaved = self._unsaved, []
+        acked,   self._acked   = self._acked,   []
+        self._transit = len(unsaved) - len(acked)
+        excess = self._count + self._transit - self.size
+        self._committing = deferToThread(self._commit, unsaved, acked, excess)
+        self._committing.addCallbacks(self._committed, self._notCommitted,
+            callbackArgs=(unsaved, acked), errbackArgs=(unsaved, acked))
+        return self._committing
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _commit(self, unsaved, acked, excess):
+        '''
+        Runs in a thread. Inserts, deletes and discards the excess oldest rows
+        in a single transaction. Returns (new row ids, discarded row ids)
+        '''
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            rowids = []
+            for message in unsaved:
+                cursor.execute("INSERT INTO outbox_t(topic, payload, qos, key) VALUES (?,?,?,?)",
+                    (message.topic, message.payload, message.qos, message.key))
+                rowids.append(cursor.lastrowid)
+            cursor.executemany("DELETE FROM outbox_t WHERE rowid = ?", [(rowid,) for rowid in acked])
+            discarded = self._trim(cursor, excess) if excess > 0 else set()
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return rowids, discarded
+
+
+    def _committed(self, result, unsaved, acked):
+        '''In memory side effects, once the transaction has been committed'''
+        rowids, discarded = result
+        self._committing = None
+        self._transit    = 0
+        for message, rowid in zip(unsaved, rowids):
+            message.rowid = rowid
+        self._count += len(unsaved) - len(acked) - len(discarded)
+        if discarded:
+            self._ready   = deque(message for message in self._ready if message.rowid not in discarded)
+            self._acked   = [rowid for rowid in self._acked if rowid not in discarded]
+            for rowid in discarded.intersection(self._inflight):
+                del self._inflight[rowid]
+            self.dropped += len(discarded)
+            log.warn("Outbox full, discarded {n} oldest messages", n=len(discarded))
+        if not self._backlog:
+            # _fill() may have already read them while committing
+            fresh = [message for message in unsaved if message.rowid > self._cursor and message.rowid not in discarded]
+            self._ready.extend(fresh)
+            if fresh:
+                self._cursor = fresh[-1].rowid
+        while self.waiting:
+            self._fill()
+            if not self._ready:
+                break
+            self.waiting.pop(0).callback(self._takeOff())
+        if len(self._unsaved) >= GROUP_SIZE:
+            self.flush()
+
+
+    def _notCommitted(self, failure, unsaved, acked):
+        log.failure("Error writing to outbox {path}: {excp!s}", failure=failure, path=self.path, excp=failure.value)
+        self._committing = None
+        self._transit    = 0
+        self._unsaved = unsaved + self._unsaved
+        self._acked   = acked   + self._acked
+
+
+    def _takeOff(self):
+        message = self._ready.popleft()
+        self._inflight[message.rowid] = message
+        return message
+
+
+    def _fill(self):
+        '''Read the next chunk of committed rows from disk when draining a backlog'''
+        if self._ready or not self._backlog:
+            return
+        rows = self._reader.execute("SELECT rowid, topic, payload, qos, key FROM outbox_t WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (self._cursor, FETCH_SIZE)).fetchall()
+        for rowid, topic, payload, qos, key in rows:
+            payload = payload if isinstance(payload, str) else bytearray(payload)
+            self._ready.append(Message(topic, payload, qos=qos, key=key, rowid=rowid))
+        if rows:
+            self._cursor = rows[-1][0]
+        self._backlog = len(rows) == FETCH_SIZE
+
+
+    def _trim(self, cursor, n):
+        '''Discard the n oldest rows. Returns their row ids'''
+        rowids = [row[0] for row in cursor.execute("SELECT rowid FROM outbox_t ORDER BY rowid LIMIT ?", (n,))]
+        cursor.executemany("DELETE FROM outbox_t WHERE rowid = ?", [(rowid,) for rowid in rowids])
+        return set(rowids)
+
+
+__all__ = [
+    "Outbox",
+]
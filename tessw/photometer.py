@@ -30,10 +30,12 @@ from zope.interface               import implementer
 # local imports
 # -------------
 
-from tessw                    import TESSW
+from tessw                    import TESSW, TSTAMP_FORMAT
 from tessw.logger             import setLogLevel
 from tessw.utils              import chop
 from tessw.config             import read_options
+from tessw.metrics            import BUFFER_OVERWRITES, LINES_RECEIVED, LINES_PARSED, LINES_REJECTED, LINES_PAUSED
+from tessw.trace              import TRACE
 from tessw.service.reloadable import Service
 
 
@@ -60,6 +62,7 @@ class CircularBuffer(object):
         self._producer = None
         self._push     = None
         self.log       = log
+        self._overwrites = BUFFER_OVERWRITES.labels(log.namespace)
 
     # -------------------
     # IConsumer interface
@@ -78,6 +81,11 @@ class CircularBuffer(object):
         self._producer = None
 
     def write(self, data):
+        if len(self._buffer) == self._buffer.maxlen:
+            self._overwrites.value += 1
+        trace = data.get(TRACE)
+        if trace is not None:
+            trace.mark()
         self._buffer.append(data)
 
     # -------------------
@@ -109,6 +117,8 @@ class PhotometerService(Service):
         self.serport   = None
         self.buffer    = CircularBuffer(self.BUFFER_SIZE, self.log)
         self.counter   = 0
+        self.last_tstamp  = None
+        self.last_reading = None    # last curated reading
         # Handling of Asynchronous getInfo()
         self.info = None
         self.info_deferred = None
@@ -140,7 +150,8 @@ class PhotometerService(Service):
 
     def stopService(self):
         self.log.warn("stopping {name}", name=self.name)
-        self.protocol.transport.loseConnection()
+        if self.protocol is not None:
+            self.protocol.transport.loseConnection()
         self.protocol = None
         self.serport  = None
         #self.parent.childStopped(self)
@@ -150,8 +161,7 @@ class PhotometerService(Service):
     # Extended Service API
     # --------------------
 
-    @inlineCallbacks
-    def reloadService(self, new_options):
+    def reloadService(self, options):
         '''
         Reload configuration.
         Returns a Deferred
@@ -203,8 +213,25 @@ class PhotometerService(Service):
             reading.pop('udp', None)
             reading.pop('ain', None)
             reading.pop('ZP',  None)
+        self.last_reading = reading
         return reading
 
+
+    def getStatus(self):
+        '''Cheap status summary, for the control interface'''
+        return {
+            'label'     : self.label,
+            'name'      : self.info['name'] if self.info else self.options.get('name'),
+            'connected' : self.protocol is not None,
+            'received'  : LINES_RECEIVED.labels(self.label).value,
+            'parsed'    : LINES_PARSED.labels(self.label).value,
+            'rejected'  : LINES_REJECTED.labels(self.label).value,
+            'paused'    : LINES_PAUSED.labels(self.label).value,
+            'overwrites': BUFFER_OVERWRITES.labels(self.label).value,
+            'tstamp'    : self.last_tstamp.strftime(TSTAMP_FORMAT) if self.last_tstamp else None,
+            'reading'   : self.last_reading,
+        }
+
     
     def getInfo(self):
         '''Asynchronous operations'''
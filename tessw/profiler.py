@@ -0,0 +1,118 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import io
+import os
+import os.path
+import time
+import pstats
+import cProfile
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger   import Logger
+from twisted.internet import reactor, defer
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Service Logging namespace
+NAMESPACE = 'prof'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# -------
+# Classes
+# -------
+
+class Profiler(object):
+    '''
+    On-demand cProfile session of the reactor thread for a number of seconds.
+    Statistics are dumped to a pstats file in directory
+    (see python -m pstats <file>) and the top entries,
+    by cumulative time, are logged.
+    '''
+
+    # So that we can patch it in tests with Clock.callLater ...
+    callLater = reactor.callLater
+
+    def __init__(self, duration, directory, top):
+        self.duration  = duration
+        self.directory = directory
+        self.top       = top
+        self._profile  = None
+        self._deferred = None
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def start(self, duration=None):
+        '''
+        Must be called from the reactor thread.
+        Returns a Deferred firing with the pstats file path.
+        '''
+        if self.running:
+            log.warn("Profiling already in progress")
+            return defer.fail(RuntimeError("Profiling already in progress"))
+        duration = duration or self.duration
+        log.info("Profiling for {t} seconds", t=duration)
+        self._deferred = defer.Deferred()
+        self._profile  = cProfile.Profile()
+        self._profile.enable()
+        self.callLater(duration, self.stop)
+        return self._deferred
+
+    def stop(self):
+        if not self.running:
+            return
+        profile, self._profile = self._profile, None
+        profile.disable()
+        deferred, self._deferred = self._deferred, None
+        try:
+            path = self._dump(profile)
+        except Exception as e:
+            log.failure("Error dumping profile: {excp!s}", excp=e)
+            deferred.errback(e)
+        else:
+            deferred.callback(path)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _dump(self, profile):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, time.strftime("tessw-%Y%m%dT%H%M%S.pstats"))
+        profile.dump_stats(path)
+        stream = io.StringIO()
+        stats  = pstats.Stats(profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        log.info("Profile saved to {path}. Top {n} by cumulative time:\n{stats}", path=path, n=self.top, stats=stream.getvalue())
+        return path
+
+
+__all__ = [
+    "Profiler",
+]
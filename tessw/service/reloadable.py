@@ -23,9 +23,11 @@ import signal
 
 from zope.interface import implementer, Interface
 
+from twisted.logger   import Logger
 from twisted.persisted import sob
 from twisted.python    import components
 from twisted.internet  import defer, task
+from twisted.internet.threads import deferToThread
 from twisted.application.service import IService, Service as BaseService, MultiService as BaseMultiService, Process
 
 #--------------
@@ -38,6 +40,9 @@ from .interfaces import IReloadable
 # Module constants
 # ----------------
 
+# Service Logging namespace
+NAMESPACE = 'reload'
+
 # ----------------
 # Global functions
 # -----------------
@@ -48,6 +53,8 @@ from .interfaces import IReloadable
 # Module global variables
 # -----------------------
 
+log  = Logger(namespace=NAMESPACE)
+
 
 # --------------------------------------------------------------
 # --------------------------------------------------------------
@@ -105,10 +112,29 @@ class TopLevelService(MultiService):
         '''
         TopLevelService.instance.sigreloaded = True
 
+    @staticmethod
+    def sigprofile(signum, frame):
+        '''
+        Signal handler (SIGUSR1)
+        '''
+        TopLevelService.instance.sigprofiled = True
+
+    @staticmethod
+    def sigdump(signum, frame):
+        '''
+        Signal handler (SIGUSR2)
+        '''
+        TopLevelService.instance.sigdumped = True
+
     def __init__(self):
         super(TopLevelService, self).__init__()
         TopLevelService.instance = self
         self.sigreloaded  = False
+        self.sigprofiled  = False
+        self.sigdumped    = False
+        self.reader       = None    # Options reader, set by the application
+        self.profiler     = None    # Set by the application, if any
+        self.recorder     = None    # Set by the application, if any
         self.periodicTask = task.LoopingCall(self._sighandler)
 
     def __getstate__(self):
@@ -118,6 +144,16 @@ class TopLevelService(MultiService):
             del dic['instance']
         if "sigreloaded" in dic:
             del dic['sigreloaded']
+        if "sigprofiled" in dic:
+            del dic['sigprofiled']
+        if "sigdumped" in dic:
+            del dic['sigdumped']
+        if "reader" in dic:
+            del dic['reader']
+        if "profiler" in dic:
+            del dic['profiler']
+        if "recorder" in dic:
+            del dic['recorder']
         if "periodicTask" in dic:
             del dic['periodicTask']
         return dic
@@ -137,11 +173,57 @@ class TopLevelService(MultiService):
         '''
         if self.sigreloaded:
             self.sigreloaded = False
-            self.reloadService()
-        
+            self.reloadService().addErrback(lambda failure: None)   # Already logged
+        if self.sigprofiled:
+            self.sigprofiled = False
+            self.profileService().addErrback(lambda failure: None)  # Already logged
+        if self.sigdumped:
+            self.sigdumped = False
+            self.dumpService().addErrback(lambda failure: None)     # Already logged
+
+    def reloadService(self, options=None):
+        '''
+        Reload all services with the same options.
+        If not given, they are read here, once, in a thread.
+        Returns a Deferred
+        '''
+        if options is not None:
+            return super().reloadService(options)
+        d = deferToThread(self.reader)
+        d.addCallbacks(self._reload, self._notReloaded)
+        return d
+
+    def profileService(self, duration=None):
+        '''
+        Profile the running daemon for some seconds, if there is a profiler.
+        Returns a Deferred firing with the statistics file path.
+        '''
+        if self.profiler is None:
+            return defer.fail(RuntimeError("No profiler configured"))
+        return self.profiler.start(duration)
+
+    def dumpService(self):
+        '''
+        Dump the flight recorder of recent log events, if there is one.
+        Returns a Deferred firing with the dump file path.
+        '''
+        if self.recorder is None:
+            return defer.fail(RuntimeError("No flight recorder configured"))
+        return defer.maybeDeferred(self.recorder.dump)
+
+    def _reload(self, result):
+        options, cmdline_opts = result
+        return super().reloadService(options)
+
+    def _notReloaded(self, failure):
+        log.error("Error trying to reload: {excp!s}", excp=failure.value)
+        return failure
+
 if os.name != "nt":
     # Install this signal handlers
     signal.signal(signal.SIGHUP,  TopLevelService.sigreload)
+    signal.signal(signal.SIGUSR1, TopLevelService.sigprofile)
+    signal.signal(signal.SIGUSR2, TopLevelService.sigdump)
 
 # --------------------------------------------------------------
 # --------------------------------------------------------------
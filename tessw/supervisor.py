@@ -10,20 +10,28 @@
 
 from __future__ import division, absolute_import
 
+import time
+import datetime
+
 # ---------------
 # Twisted imports
 # ---------------
 
 from twisted.logger         import Logger
 from twisted.internet       import reactor, task
-from twisted.internet.defer import inlineCallbacks,  DeferredList, gatherResults
+from twisted.internet.defer import inlineCallbacks,  DeferredList, gatherResults, maybeDeferred
 
 #--------------
 # local imports
 # -------------
 
-from tessw                    import VERSION_STRING, MQTT_SERVICE, PHOTOMETER_SERVICE, SUPVR_SERVICE
-from tessw.logger             import setLogLevel
+from tessw                    import VERSION_STRING, MQTT_SERVICE, PHOTOMETER_SERVICE, SUPVR_SERVICE, ARCHIVE_SERVICE, TSTAMP_FORMAT
+from tessw.logger             import setLogLevel, setLogLimits, setFlightRecorder
+from tessw.photometer         import PhotometerService
+from tessw.health             import PhotometerHealth, OFFLINE
+from tessw.utils              import mac_jitter, next_boundary
+from tessw.metrics            import POLL_MISSES, CALL_DURATION
+from tessw.trace              import TRACE, setSampling
 from tessw.service.reloadable import MultiService
 
 # ----------------
@@ -33,24 +41,31 @@ from tessw.service.reloadable import MultiService
 # Service Logging namespace
 NAMESPACE = 'supvr'
 
+# Photometer options that cannot be changed without restarting its service
+PHOTOMETER_IDENTITY = ('endpoint', 'old_firmware', 'mac_address', 'name', 'zp')
+
 # -----------------------
 # Module global variables
 # -----------------------
 
 log  = Logger(namespace=NAMESPACE)
 
+POLL_DURATION = CALL_DURATION.labels('poll')
+
 class SupervisorService(MultiService):
 
 
     def __init__(self, options, **kargs):
         MultiService.__init__(self)
         setLogLevel(namespace=NAMESPACE, levelStr=options['log_level'])
+        setSampling(options['trace_sample'])
         self.options    = options
         self.photometers = []   # Array of photometers
         self.task = None        # Periodic task to poll Photometers
+        self.tasks = []         # Per photometer (periodic task, delayed start) in wall-clock aligned mode
         self.i = 0              # current photometer being sampled
-        self._registryDone = {}
-        self._errorCount        = {} 
+        self._health = {}       # Per photometer health state machine
+        self.paused = False     # Photometers not being polled
         
     # -----------
     # Service API
@@ -59,31 +74,77 @@ class SupervisorService(MultiService):
     def startService(self):
         log.info('starting {name}', name=SUPVR_SERVICE)
         self.mqttService    = self.parent.getServiceNamed(MQTT_SERVICE)
+        try:
+            self.archiveService = self.parent.getServiceNamed(ARCHIVE_SERVICE)
+        except KeyError:
+            self.archiveService = None
         N = self.options['nphotom']
         for i in range(1, N+1):
             self.photometers.append(self.getServiceNamed(PHOTOMETER_SERVICE + ' ' + str(i)))
-        self._registryDone = {phot.label: False for phot in self.photometers}
-        self._errorCount   = {phot.label: 0     for phot in self.photometers}
+        self._health = {phot.label: PhotometerHealth(phot.label, self.options['ncycles'], self._onTransition, self.options['T']) 
+            for phot in self.photometers}
         super().startService()
+        for phot in self.photometers:
+            self._attach(phot)
         self.task = reactor.callLater(0, self.getInfo)
 
 
+    def stopService(self):
+        '''No more readings are polled while the other services are stopping'''
+        log.info('stopping {name}', name=SUPVR_SERVICE)
+        if self.task is not None and not isinstance(self.task, task.LoopingCall) and self.task.active():
+            self.task.cancel()  # getInfo() not called yet
+        self.unschedule()
+        return super().stopService()
+
+
     @inlineCallbacks
     def reloadService(self, options):
         '''
-        Reload service parameters
+        Reload service parameters.
+        The new photometer sections are diffed against the running services:
+        new photometers are started, removed ones are stopped and those whose
+        identity (serial port, MAC, name ...) changed are restarted.
+        Unchanged photometers keep their serial port open.
         '''
         log.warn("{version} reloading config", version=VERSION_STRING)
-        try:
-            options, cmdline_opts  = yield deferToThread(read_options)
-        except Exception as e:
-            log.error("Error trying to reload: {excp!s}", excp=e)
-        else:
-            log.warn("{version} config reloaded ok.", version=VERSION_STRING)
-            self.options = options['global']
-            setLogLevel(namespace=self.label,     levelStr=self.options['log_level'])
-            setLogLevel(namespace=self.namespace, levelStr=self.options['log_messages'])
-            yield super().reloadService(options=options)
+        self.options = options['global']
+        setLogLevel(namespace=NAMESPACE, levelStr=self.options['log_level'])
+        setLogLimits(self.options['log_window'], self.options['log_rate'], self.options['log_burst'])
+        setFlightRecorder(self.options['recorder_size'], self.options['recorder_dir'])
+        setSampling(self.options['trace_sample'])
+        self.unschedule()
+        self.i = 0
+        current = {phot.label: phot for phot in self.photometers}
+        wanted  = ['phot' + str(i) for i in range(1, self.options['nphotom']+1)]
+        # Stop removed photometers and those that must be restarted
+        for label, phot in list(current.items()):
+            if label not in wanted or any(phot.options[key] != options[label][key] for key in PHOTOMETER_IDENTITY):
+                log.warn("removing photometer {label}", label=label)
+                self._detach(phot)
+                yield maybeDeferred(phot.disownServiceParent)
+                del self._health[label]
+                del current[label]
+        # Start new photometers and reload the unchanged ones
+        added = []
+        for label in wanted:
+            if label in current:
+                yield maybeDeferred(current[label].reloadService, options)
+                self._health[label].ncycles = self.options['ncycles']
+                self._health[label].period  = self.options['T']
+            else:
+                log.warn("adding photometer {label}", label=label)
+                current[label] = self._buildPhotometer(label, options[label])
+                added.append(current[label])
+        self.photometers = [current[label] for label in wanted]
+        for phot in added:
+            self._health[phot.label] = PhotometerHealth(phot.label, self.options['ncycles'], self._onTransition, self.options['T'])
+            phot.setServiceParent(self)     # also starts it
+            self._attach(phot)
+        if not self.paused:
+            self.schedule()
+        self._register(added)
+        log.warn("{version} config reloaded ok.", version=VERSION_STRING)
             
     # --------------
     # Photometer API
@@ -92,9 +153,6 @@ class SupervisorService(MultiService):
     def numberOfPhotometers(self):
         return self.options['nphotom']
 
-    def registryDone(self):
-        self._registryDone = True
-
     def childStopped(self, child):
         log.warn("Will stop the reactor asap.")
         try:
@@ -104,62 +162,175 @@ class SupervisorService(MultiService):
 
 
 
+    def pauseService(self):
+        '''Stop polling photometers. Their latest readings are kept in their buffers'''
+        if not self.paused:
+            log.warn("Pausing photometer polling")
+            self.paused = True
+            self.unschedule()
+
+
+    def resumeService(self):
+        if self.paused:
+            log.warn("Resuming photometer polling")
+            self.paused = False
+            self.schedule()
+
+
+    def getStatus(self):
+        '''Cheap status summary of every photometer, for the control interface'''
+        result = []
+        for phot in self.photometers:
+            status = phot.getStatus()
+            health = self._health.get(phot.label)
+            if health is not None:
+                status.update({
+                    'state'       : health.state,
+                    'since'       : health.since,
+                    'registered'  : health.registered,
+                    'misses'      : health.misses,
+                    'availability': health.availability,
+                    'interval'    : health.interval,
+                })
+            status['poll_misses'] = POLL_MISSES.labels(phot.label).value
+            result.append(status)
+        return result
+
+
     def getInfo(self):
         '''Get registry info for all photometers'''
         log.info("Getting info from all photometers")
-        N = self.options['nphotom']
-        self.task = task.LoopingCall(self.poll)
-        self.task.start(self.options['T']//N, now=False)
-        deferreds = [photometer.getInfo() for photometer in self.photometers]
-        for deferred, photometer in zip(deferreds, self.photometers):
-            deferred.addCallback(self._addInfo, photometer.label)
-            deferred.addErrback(self._timeout, photometer.label)
-        dli = gatherResults(deferreds, consumeErrors=False).addCallback(self._info_complete)
+        self.schedule()
+        dli = self._register(self.photometers)
         self.kk = dli
         return dli
 
 
-    def isOffline(self, item):
-        flag = item[1] == self.options['ncycles']
-        if flag:
-            log.warn("Photometer {label} went offline", label=item[0])
-        return flag
+    def schedule(self):
+        '''
+        Start the periodic photometer sampling.
+        By default, photometers are polled in round robin every T/N seconds,
+        counting from service start time. In aligned mode, each photometer is
+        polled every T seconds on wall-clock boundaries of T, delayed by a
+        deterministic per-MAC jitter so that a fleet of gateways does not
+        hit the broker in the same instant.
+        '''
+        T = self.options['T']
+        if not self.options['align']:
+            N = self.options['nphotom']
+            self.task = task.LoopingCall(self.poll)
+            self.task.start(T//N, now=False)
+            return
+        now = reactor.seconds()
+        for i, photometer in enumerate(self.photometers):
+            offset = mac_jitter(photometer.options['mac_address'], self.options['jitter'])
+            delay  = next_boundary(now, T, offset) - now
+            log.info("{label} sampling aligned to {T}s boundaries + {offset:.3f}s, first in {delay:.3f}s", 
+                label=photometer.label, T=T, offset=offset, delay=delay)
+            loop = task.LoopingCall(self.pollPhotometer, i)
+            self.tasks.append((loop, reactor.callLater(delay, loop.start, T, now=True)))
+
+
+    def unschedule(self):
+        '''Stop the periodic photometer sampling'''
+        if isinstance(self.task, task.LoopingCall) and self.task.running:
+            self.task.stop()
+        for loop, delayed in self.tasks:
+            if delayed.active():
+                delayed.cancel()
+            if loop.running:
+                loop.stop()
+        self.tasks = []
+
+
+    def isOffline(self, health):
+        return health.state == OFFLINE
 
 
     def poll(self):
-        i      = self.i
+        '''Round robin polling of photometers'''
+        i = self.i
+        try:
+            self.pollPhotometer(i)
+        finally:
+            self.i = (i + 1) % len(self.photometers)
+
+
+    def pollPhotometer(self, i):
+        '''Polls photometer i, in both round robin and aligned modes'''
+        start = time.perf_counter()
+        try:
+            self._pollPhotometer(i)
+        finally:
+            POLL_DURATION.observe(time.perf_counter() - start)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _pollPhotometer(self, i):
         label  = self.photometers[i].label
         try:
             sample = self.photometers[i].buffer.getBuffer().popleft()   
         except IndexError as e:
-            ec = self._errorCount[label] + 1
-            self._errorCount[label] = min(self.options['ncycles'], ec)
-            result_list = map(self.isOffline, self._errorCount.items())
+            if self.mqttService.saturated:
+                log.debug("Photometer[{i}] paused by MQTT queue backpressure", i=i)
+                return
+            self._health[label].miss()
+            POLL_MISSES.labels(label).inc()
+            result_list = map(self.isOffline, self._health.values())
             if all(result_list):
                 log.critical("No photometer is alive. Stopping the daemon")
                 reactor.stop()
         else:
             # Take out uneeded information
-            self._errorCount[label] = 0
+            trace = sample.pop(TRACE, None)
+            if trace is not None:
+                trace.mark()
+            self._health[label].hit()
             self.photometers[i].handleInfo(sample)
-            if self._registryDone[label]:
+            if self._health[label].registered:
                 sample = self.photometers[i].curate(sample)
                 log.info("Photometer[{i}] = {sample}", sample=sample, i=i)
-                self.mqttService.addReading(sample)
+                if trace is not None:
+                    trace.mark()
+                    trace.observe()
+                self.mqttService.addReading(sample, trace)
+                if self.archiveService:
+                    self.archiveService.addReading(sample, self.photometers[i].last_tstamp or datetime.datetime.utcnow())
             else:
                 log.warn("Not yet registered. Ignoring sample from Photometer[{i}]",i=i)
-        finally:
-            self.i = (i + 1) % len(self.photometers)
 
-    # --------------
-    # Helper methods
-    # --------------
+    def _attach(self, photometer):
+        '''Hook up a started photometer to health monitoring and MQTT backpressure'''
+        if photometer.protocol is not None:
+            self._health[photometer.label].connect()
+            self.mqttService.registerProducer(photometer.protocol)
+
+    def _detach(self, photometer):
+        if photometer.protocol is not None:
+            self.mqttService.unregisterProducer(photometer.protocol)
+
+    def _buildPhotometer(self, label, options):
+        photometer = PhotometerService(options, label)
+        photometer.setName(PHOTOMETER_SERVICE + ' ' + label[len('phot'):])
+        return photometer
+
+    def _register(self, photometers):
+        '''Get registry info for the given photometers'''
+        deferreds = [photometer.getInfo() for photometer in photometers]
+        for deferred, photometer in zip(deferreds, photometers):
+            deferred.addCallback(self._addInfo, photometer.label)
+            deferred.addErrback(self._timeout, photometer.label)
+        return gatherResults(deferreds, consumeErrors=False).addCallback(self._info_complete)
 
     def _addInfo(self, photometer_info, *args):
         label = args[0]
+        if label not in self._health:
+            return      # removed by a reload while waiting for its info
         log.debug("Passing {label} photometer info ({name}) to register queue", label=label, name=photometer_info['name'])
-        self._registryDone[label] = True
         self.mqttService.addRegisterRequest(photometer_info)
+        self._health[label].register()
 
     def _info_complete(self, *args):
         log.info("Finished getting info from all photometers")
@@ -167,4 +338,23 @@ class SupervisorService(MultiService):
     def _timeout(self, failure, *args):
         log.error("Photometer {label} timeout getting info", label=args[0])
 
+    def _onTransition(self, health, previous):
+        '''Publish photometer health state transitions'''
+        photometer = [phot for phot in self.photometers if phot.label == health.label][0]
+        name = (photometer.info or {}).get('name') or photometer.options['name']
+        if health.state == OFFLINE:
+            log.warn("Photometer {label} went offline", label=health.label)
+        else:
+            log.info("Photometer {label} went {state} (was {previous})", label=health.label, state=health.state, previous=previous)
+        status = {
+            'name'         : name,
+            'mac'          : photometer.options['mac_address'],
+            'state'        : health.state,
+            'prev'         : previous,
+            'tstamp'       : time.strftime(TSTAMP_FORMAT, time.gmtime(health.since)),
+            'misses'       : health.misses,
+            'availability' : round(health.availability, 3),
+        }
+        self.mqttService.addStatus(status)
+
 
@@ -11,6 +11,7 @@
 from __future__ import division, absolute_import
 
 import re
+import time
 import datetime
 import json
 
@@ -32,6 +33,9 @@ from zope.interface               import implementer
 
 import tessw.utils
 
+from tessw.metrics import LINES_RECEIVED, LINES_PARSED, LINES_REJECTED, LINES_PAUSED, CALL_DURATION
+from tessw.trace   import TRACE, Trace
+
 # ----------------
 # Module constants
 # ----------------
@@ -103,6 +107,12 @@ class TESSProtocolBase(LineOnlyReceiver):
         self._consumer = None
         self._paused   = True
         self._stopped  = False
+        photometer     = namespace.lower()
+        self._received = LINES_RECEIVED.labels(photometer)
+        self._parsed   = LINES_PARSED.labels(photometer)
+        self._rejected = LINES_REJECTED.labels(photometer)
+        self._skipped  = LINES_PAUSED.labels(photometer)
+        self._duration = CALL_DURATION.labels('lineReceived')
 
 
     def connectionMade(self):
@@ -112,13 +122,24 @@ class TESSProtocolBase(LineOnlyReceiver):
         self.log.debug("connectionLost() {reason}", reason=reason)
 
     def lineReceived(self, line):
+        start = time.monotonic()
         now = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(seconds=0.5)
         line = line.decode('latin_1')  # from bytearray to string
         self.log.info("<== TESS-W [{l:02d}] {line}", l=len(line), line=line)
-        handled, reading = self._handleUnsolicitedResponse(line, now)
-        if handled:
-            self._consumer.write(reading)
-            self.log.debug("<== TESS-W : {reading}", reading=reading)
+        self._received.value += 1
+        if self._paused or self._stopped:
+            self.log.debug("Producer either paused({p}) or stopped({s})", p=self._paused, s=self._stopped)
+            self._skipped.value += 1
+        else:
+            handled, reading = self._handleUnsolicitedResponse(line, now)
+            if handled:
+                self._parsed.value += 1
+                reading[TRACE] = Trace(start)
+                self._consumer.write(reading)
+                self.log.debug("<== TESS-W : {reading}", reading=reading)
+            else:
+                self._rejected.value += 1
+        self._duration.observe(time.monotonic() - start)
     
     # -----------------------
     # IPushProducer interface
@@ -177,9 +198,6 @@ class TESSProtocolOld(TESSProtocolBase):
         Handle unsolicited responses from tessw.
         Returns True if handled, False otherwise
         '''
-        if self._paused or self._stopped:
-            self.log.debug("Producer either paused({p}) or stopped({s})", p=self._paused, s=self._stopped)
-            return False, None
         ur, matchobj = self._match_unsolicited(line)
         if not ur:
             return False, None
@@ -217,9 +235,6 @@ class TESSProtocolNew(TESSProtocolBase):
         Handle Unsolicted responses from zptess.
         Returns True if handled, False otherwise
         '''
-        if self._paused or self._stopped:
-            self.log.debug("Producer either paused({p}) or stopped({s})", p=self._paused, s=self._stopped)
-            return False, None
         try:
             reading = json.loads(line)
         except Exception as e:
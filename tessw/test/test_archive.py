@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import datetime
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial    import unittest
+from twisted.internet import defer
+
+#--------------
+# local imports
+# -------------
+
+from tessw.archive import ArchiveService, archivePaths, readRange
+
+# ----------------
+# Module constants
+# ----------------
+
+DAY = datetime.datetime(2020, 6, 1)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def at(seconds):
+    return DAY + datetime.timedelta(seconds=seconds)
+
+# -------
+# Classes
+# -------
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        self.service   = ArchiveService({'directory': self.directory, 'flush': 3600, 'log_level': 'warn'})
+        self.service.startService()
+
+    @defer.inlineCallbacks
+    def archive(self, batches):
+        '''Each batch is a list of (photometer, seconds) written together'''
+        for batch in batches:
+            for name, seconds in batch:
+                self.service.addReading({'name': name, 'seq': seconds}, at(seconds))
+            yield self.service.flush()
+
+    @defer.inlineCallbacks
+    def test_buffered_readings_written_on_stop(self):
+        for seconds in range(3):
+            self.service.addReading({'name': 'stars1', 'seq': seconds}, at(seconds))
+        yield self.service.stopService()
+        data, index = archivePaths(self.directory, DAY.date())
+        with open(data) as fd:
+            self.assertEqual(len(fd.readlines()), 3)
+        self.assertEqual(self.service.written, 3)
+
+    @defer.inlineCallbacks
+    def test_read_range_interleaved(self):
+        # Readings from two photometers polled at different times,
+        # so that their tstamps are not monotonic within each batch
+        yield self.archive([
+            [('stars1', 0),  ('stars2', 50), ('stars1', 10), ('stars2', 40)],
+            [('stars1', 60), ('stars2', 55), ('stars1', 70), ('stars2', 100)],
+            [('stars1', 200), ('stars2', 190)],
+        ])
+        yield self.service.stopService()
+        found = sorted(reading['seq'] for reading in readRange(self.directory, at(40), at(100)))
+        self.assertEqual(found, [40, 50, 55, 60, 70, 100])
+        found = sorted(reading['seq'] for reading in readRange(self.directory, at(5), at(45)))
+        self.assertEqual(found, [10, 40])
+        found = sorted(reading['seq'] for reading in readRange(self.directory, at(195), at(300)))
+        self.assertEqual(found, [200])
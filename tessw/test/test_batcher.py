@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial         import unittest
+from twisted.internet.task import Clock
+
+#--------------
+# local imports
+# -------------
+
+from tessw.batcher import encodeBatch, ReadingBatcher, PER_PHOTOMETER, PER_GATEWAY
+
+# -------
+# Classes
+# -------
+
+class EncodeBatchTestCase(unittest.TestCase):
+
+    def test_encode(self):
+        readings = [
+            {'name': 'stars1', 'mag': 20.1, 'freq': 10.0},
+            {'name': 'stars2', 'mag': 19.5, 'tamb': 12.0},
+        ]
+        self.assertEqual(encodeBatch(readings), {
+            'keys': ['name', 'mag', 'freq', 'tamb'],
+            'rows': [['stars1', 20.1, 10.0, None], ['stars2', 19.5, None, 12.0]],
+        })
+
+    def test_empty(self):
+        self.assertEqual(encodeBatch([]), {'keys': [], 'rows': []})
+
+
+
+class ReadingBatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock   = Clock()
+        self.emitted = []
+        self.patch(ReadingBatcher, 'callLater', self.clock.callLater)
+
+    def emit(self, key, batch, traces):
+        self.emitted.append((key, [reading['mag'] for reading in batch], traces))
+
+    def test_size(self):
+        batcher = ReadingBatcher(3, 60, PER_PHOTOMETER, self.emit)
+        for mag in (20.1, 20.2, 20.3):
+            batcher.add({'name': 'stars1', 'mag': mag})
+        self.assertEqual(self.emitted, [('stars1', [20.1, 20.2, 20.3], None)])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_window(self):
+        batcher = ReadingBatcher(3, 60, PER_PHOTOMETER, self.emit)
+        batcher.add({'name': 'stars1', 'mag': 20.1})
+        self.clock.advance(30)
+        batcher.add({'name': 'stars1', 'mag': 20.2})
+        self.clock.advance(29)
+        self.assertEqual(self.emitted, [])
+        # The window starts with the first reading of the batch
+        self.clock.advance(1)
+        self.assertEqual(self.emitted, [('stars1', [20.1, 20.2], None)])
+
+    def test_per_photometer(self):
+        batcher = ReadingBatcher(2, 60, PER_PHOTOMETER, self.emit)
+        batcher.add({'name': 'stars1', 'mag': 20.1})
+        batcher.add({'name': 'stars2', 'mag': 19.1})
+        batcher.add({'name': 'stars1', 'mag': 20.2})
+        self.assertEqual(self.emitted, [('stars1', [20.1, 20.2], None)])
+        self.clock.advance(60)
+        self.assertEqual(self.emitted[1], ('stars2', [19.1], None))
+
+    def test_per_gateway(self):
+        batcher = ReadingBatcher(2, 60, PER_GATEWAY, self.emit)
+        batcher.add({'name': 'stars1', 'mag': 20.1}, trace='t1')
+        batcher.add({'name': 'stars2', 'mag': 19.1}, trace='t2')
+        self.assertEqual(self.emitted, [(None, [20.1, 19.1], ['t1', 't2'])])
+
+    def test_flush_all(self):
+        batcher = ReadingBatcher(3, 60, PER_PHOTOMETER, self.emit)
+        batcher.add({'name': 'stars1', 'mag': 20.1})
+        batcher.add({'name': 'stars2', 'mag': 19.1})
+        batcher.flushAll()
+        self.assertEqual(sorted(key for key, batch, traces in self.emitted), ['stars1', 'stars2'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
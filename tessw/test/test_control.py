@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import json
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial              import unittest
+from twisted.internet           import defer, reactor, task
+from twisted.internet.protocol  import Factory
+from twisted.internet.testing   import StringTransport
+from twisted.logger             import LogLevel, globalLogPublisher
+
+#--------------
+# local imports
+# -------------
+
+from tessw.control import ControlService, ControlProtocol, parseRequest, masked, MASK
+
+# ----------------
+# Module constants
+# ----------------
+
+OPTIONS = {
+    'global'      : {'control': '/run/tessw/tessw.sock', 'nphotom': 1},
+    'mqtt'        : {'broker': 'tcp:test-mqtt.example.org:1883', 'username': 'tessw', 'password': 'secret'},
+    'mqtt_backup' : {'broker': 'tcp:127.0.0.1:1883', 'username': '', 'password': ''},
+}
+
+# -------
+# Classes
+# -------
+
+class ParseRequestTestCase(unittest.TestCase):
+
+    def test_words(self):
+        self.assertEqual(parseRequest("status"), ("status", []))
+        self.assertEqual(parseRequest("  profile   10 "), ("profile", ["10"]))
+
+    def test_json(self):
+        self.assertEqual(parseRequest('{"cmd": "profile", "args": [10]}'), ("profile", [10]))
+        self.assertEqual(parseRequest('{"cmd": "status"}'), ("status", []))
+
+    def test_bad_requests(self):
+        self.assertRaises(ValueError, parseRequest, "")
+        self.assertRaises(ValueError, parseRequest, '{"cmd": ')
+        self.assertRaises(KeyError, parseRequest, '{"args": []}')
+
+
+
+class MaskedTestCase(unittest.TestCase):
+
+    def test_masked(self):
+        result = masked(OPTIONS)
+        self.assertEqual(result['mqtt']['password'], MASK)
+        self.assertEqual(result['mqtt']['username'], 'tessw')
+        # Nothing to hide
+        self.assertEqual(result['mqtt_backup']['password'], '')
+        self.assertEqual(result['global'], OPTIONS['global'])
+
+    def test_not_mutated(self):
+        masked(OPTIONS)
+        self.assertEqual(OPTIONS['mqtt']['password'], 'secret')
+
+
+
+class ControlProtocolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        factory = Factory.forProtocol(ControlProtocol)
+        factory.service = ControlService(OPTIONS)
+        self.protocol  = factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def request(self, line):
+        self.transport.clear()
+        self.protocol.dataReceived(line + b'\n')
+        return json.loads(self.transport.value().decode('utf-8'))
+
+    def test_config(self):
+        response = self.request(b'config')
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['result']['mqtt']['password'], MASK)
+        self.assertEqual(self.request(b'{"cmd": "config"}'), response)
+
+    def test_errors(self):
+        self.assertEqual(self.request(b'bogus'), {'ok': False, 'error': "Unknown command bogus"})
+        self.assertFalse(self.request(b'{"cmd": ')['ok'])
+        self.assertFalse(self.request(b'   ')['ok'])
+        # Wrong number of arguments
+        self.assertFalse(self.request(b'config now')['ok'])
+        # No supervisor to ask
+        self.assertFalse(self.request(b'pause')['ok'])
+
+
+
+
+class ControlServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        globalLogPublisher.addObserver(self.events.append)
+        self.addCleanup(globalLogPublisher.removeObserver, self.events.append)
+
+    @defer.inlineCallbacks
+    def test_missing_runtime_directory(self):
+        path = os.path.join(self.mktemp(), "tessw", "tessw.sock")
+        service = ControlService({'global': {'control': path}})
+        service.startService()
+        yield task.deferLater(reactor, 0, lambda: None)
+        yield service.stopService()
+        self.assertIsNone(service.port)
+        levels = [event['log_level'] for event in self.events if event.get('log_namespace') == 'ctrl']
+        self.assertIn(LogLevel.warn, levels)
+        self.assertNotIn(LogLevel.error, levels)
+        self.assertNotIn(LogLevel.critical, levels)
@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import json
+import zlib
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial import unittest
+
+#--------------
+# local imports
+# -------------
+
+from tessw          import encoding
+from tessw.encoding import JSONTemplate, Encoder, available, JSON, MSGPACK, CBOR
+
+# ----------------
+# Module constants
+# ----------------
+
+READING = {'seq': 1, 'name': 'stars_info', 'freq': 4606.0, 'mag': 20.12, 'tamb': 29.87, 'tsky': 24.81, 'rev': 1, 'wdBm': -80}
+
+# -------
+# Classes
+# -------
+
+class JSONTemplateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.template = JSONTemplate()
+        self.calls = []
+        dumps = json.dumps
+        def counted(*args, **kwargs):
+            self.calls.append(args[0])
+            return dumps(*args, **kwargs)
+        self.patch(encoding.json, 'dumps', counted)
+
+    def reading(self, **kwargs):
+        reading = {'seq': 1, 'name': 'stars_info', 'freq': 4606.0, 'mag': 20.12, 'tamb': 29.87, 'tsky': 24.81, 'rev': 1, 'wdBm': -80}
+        reading.update(kwargs)
+        return reading
+
+    def assertIdentical(self, reading):
+        text = self.template.dumps(reading)
+        self.assertEqual(text, json.dumps(reading))
+
+    def test_identical_to_json(self):
+        for seq in range(3):
+            self.assertIdentical(self.reading(seq=seq, mag=20.12 + seq))
+        self.assertIdentical(self.reading(name='stars%d "nan"', seq=7))
+        self.assertIdentical(self.reading(mag=0.1 + 0.2, freq=1e22, tamb=-0.0))
+
+    def test_fast_path(self):
+        self.template.dumps(self.reading())
+        n = len(self.calls)
+        for seq in range(10):
+            self.assertIdentical(self.reading(seq=seq, mag=20.0 + seq/10))
+        # Only the assertions call json.dumps
+        self.assertEqual(len(self.calls), n + 10)
+
+    def test_non_finite(self):
+        self.template.dumps(self.reading())
+        for value in (float('nan'), float('inf'), float('-inf')):
+            self.assertIdentical(self.reading(mag=value))
+        self.assertIdentical(self.reading())
+
+    def test_bool(self):
+        for value in (True, False):
+            self.assertIdentical(self.reading(alarm=value))
+            self.assertIdentical(self.reading(seq=value))
+
+
+
+class EncoderTestCase(unittest.TestCase):
+
+    def decode(self, encoder, payload):
+        if encoder.compress:
+            payload = zlib.decompress(bytes(payload))
+        if encoder.encoding == JSON:
+            return json.loads(payload.decode('utf-8') if isinstance(payload, bytes) else payload)
+        if encoder.encoding == MSGPACK:
+            import msgpack
+            return msgpack.unpackb(bytes(payload), raw=False)
+        import cbor2
+        return cbor2.loads(bytes(payload))
+
+    def test_suffix(self):
+        self.assertEqual(Encoder().suffix, "")
+        self.assertEqual(Encoder(JSON, compress=True).suffix, "/json-zlib")
+        for name in available():
+            if name != JSON:
+                self.assertEqual(Encoder(name).suffix, "/" + name)
+                self.assertEqual(Encoder(name, compress=True).suffix, "/" + name + "-zlib")
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, Encoder, 'xml')
+
+    def test_plain_json_is_text(self):
+        self.assertEqual(Encoder().encode(READING), json.dumps(READING))
+        self.assertEqual(Encoder().template()(READING), json.dumps(READING))
+
+    def test_round_trip(self):
+        for name in available():
+            for compress in (False, True):
+                encoder = Encoder(name, compress)
+                for encode in (encoder.encode, encoder.template()):
+                    payload = encode(READING)
+                    if (name, compress) != (JSON, False):
+                        self.assertIsInstance(payload, bytearray)
+                    self.assertEqual(self.decode(encoder, payload), READING)
+
+    def test_binary_smaller(self):
+        for name in (MSGPACK, CBOR):
+            if name not in available():
+                continue
+            self.assertLess(len(Encoder(name).encode(READING)), len(json.dumps(READING)))
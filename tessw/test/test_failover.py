@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import configparser
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from zope.interface import implementer
+
+from twisted.trial               import unittest
+from twisted.internet            import defer, reactor, task
+from twisted.internet.error      import ConnectionRefusedError
+from twisted.internet.protocol   import Factory, Protocol
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.logger              import globalLogPublisher, formatEvent
+
+#--------------
+# local imports
+# -------------
+
+from tessw             import mqttservice
+from tessw.config      import loadBrokerSection
+from tessw.failover    import FailoverEndpoint
+from tessw.fakebroker  import FakeBroker
+from tessw.mqttservice import MQTTService
+
+# ----------------
+# Module constants
+# ----------------
+
+CONFIG_EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "files", "etc", "tessw", "config.example.ini")
+
+# -------
+# Classes
+# -------
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.lost = False
+
+    def loseConnection(self):
+        self.lost = True
+
+
+
+@implementer(IStreamClientEndpoint)
+class FakeEndpoint(object):
+
+    def __init__(self, name, attempts):
+        self.name = name
+        self.up = True
+        self.attempts = attempts
+
+    def connect(self, factory):
+        self.attempts.append(self.name)
+        if not self.up:
+            return defer.fail(ConnectionRefusedError())
+        protocol = factory.buildProtocol(None)
+        protocol.transport = FakeTransport()
+        return defer.succeed(protocol)
+
+
+
+class FailoverEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(FailoverEndpoint, 'clock', self.clock)
+        self.endpoint = FailoverEndpoint(reactor, "tcp:127.0.0.1:1,tcp:127.0.0.1:2", 30)
+        self.attempts = []
+        self.fakes = [FakeEndpoint('primary', self.attempts), FakeEndpoint('secondary', self.attempts)]
+        self.endpoint.endpoints = self.fakes
+        self.factory = Factory.forProtocol(Protocol)
+
+    def tearDown(self):
+        self.endpoint.stop()
+
+    @defer.inlineCallbacks
+    def test_failover_and_cooldown(self):
+        self.fakes[0].up = False
+        yield self.endpoint.connect(self.factory)
+        self.assertEqual(self.endpoint.current, 1)
+        self.assertFalse(self.endpoint.isHealthy(0))
+        # Unhealthy brokers are tried last during the cooldown
+        self.clock.advance(1)
+        self.fakes[1].up = False
+        del self.attempts[:]
+        yield self.assertFailure(self.endpoint.connect(self.factory), ConnectionRefusedError)
+        self.assertEqual(self.attempts, ['secondary', 'primary'])
+        # And first again once it is over
+        self.clock.advance(30)
+        self.assertTrue(self.endpoint.isHealthy(0))
+        del self.attempts[:]
+        yield self.assertFailure(self.endpoint.connect(self.factory), ConnectionRefusedError)
+        self.assertEqual(self.attempts, ['primary', 'secondary'])
+
+    @defer.inlineCallbacks
+    def test_failback(self):
+        self.fakes[0].up = False
+        protocol = yield self.endpoint.connect(self.factory)
+        self.assertTrue(self.endpoint._probe.running)
+        self.clock.advance(30)
+        self.assertFalse(protocol.transport.lost)
+        self.fakes[0].up = True
+        self.clock.advance(30)
+        self.assertTrue(protocol.transport.lost)
+        self.assertFalse(self.endpoint._probe.running)
+        # A fail back is not a failure of the secondary broker
+        self.endpoint.disconnected()
+        self.assertTrue(self.endpoint.isHealthy(1))
+        yield self.endpoint.connect(self.factory)
+        self.assertEqual(self.endpoint.current, 0)
+
+    @defer.inlineCallbacks
+    def test_quiet_probe(self):
+        broker = FakeBroker()
+        port = yield broker.listen("tcp:0:interface=127.0.0.1")
+        self.addCleanup(broker.stop)
+        endpoint = FailoverEndpoint(reactor, "tcp:127.0.0.1:{0},tcp:127.0.0.1:1".format(port.getHost().port), 60)
+        endpoint.current = 1
+        events = []
+        globalLogPublisher.addObserver(events.append)
+        self.addCleanup(globalLogPublisher.removeObserver, events.append)
+        yield endpoint._probe.start(60, now=True)    # Stopped when the primary answers
+        yield task.deferLater(reactor, 0, lambda: None)
+        self.assertTrue(endpoint.isHealthy(0))
+        messages = [formatEvent(event) for event in events]
+        self.assertEqual([message for message in messages if 'factory' in message], [])
+
+
+
+class MQTTServiceFailoverTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.patch(mqttservice, 'backoffPolicy', lambda **kwargs: lambda attempt: 0.05)
+        self.primary   = FakeBroker()
+        self.secondary = FakeBroker()
+        # Find a free port for the primary broker, which starts down
+        port = yield self.primary.listen("tcp:0:interface=127.0.0.1")
+        self.primaryPort = port.getHost().port
+        yield self.primary.stop()
+        self.primary._ports = []
+        port = yield self.secondary.listen("tcp:0:interface=127.0.0.1")
+        parser = configparser.ConfigParser()
+        parser.read(CONFIG_EXAMPLE)
+        parser.set("mqtt", "broker", "tcp:127.0.0.1:{0},tcp:127.0.0.1:{1}".format(self.primaryPort, port.getHost().port))
+        parser.set("mqtt", "probe_interval", "1")
+        self.service = MQTTService(loadBrokerSection(parser, "mqtt"), "failovertest")
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.service.stopService()
+        yield self.primary.stop()
+        yield self.secondary.stop()
+        yield task.deferLater(reactor, 0.2, lambda: None)   # The client notifies disconnections 0.1s later
+
+    @defer.inlineCallbacks
+    def waitUntil(self, condition):
+        for i in range(300):
+            if condition():
+                return
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        self.fail("Timed out")
+
+    @defer.inlineCallbacks
+    def test_failover_and_failback(self):
+        self.service.startService()
+        self.service.addReading({'name': 'stars1', 'seq': 0})
+        yield self.secondary.waitFor(1)
+        self.assertEqual(self.service.endpoint.current, 1)
+        yield self.primary.listen("tcp:{0}:interface=127.0.0.1".format(self.primaryPort))
+        yield self.waitUntil(lambda: self.service.endpoint.current == 0 and self.service.task is not None)
+        self.service.addReading({'name': 'stars1', 'seq': 1})
+        messages = yield self.primary.waitFor(1)
+        self.assertEqual(len(self.secondary.messages), 1)
+        self.assertIn(b'"seq": 1', bytes(messages[0].payload))
@@ -0,0 +1,116 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import configparser
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial    import unittest
+from twisted.internet import defer, reactor, task
+
+#--------------
+# local imports
+# -------------
+
+from tessw                      import mqttservice
+from tessw.config               import loadBrokerSection
+from tessw.fanout               import FanOutService
+from tessw.fakebroker           import FakeBroker, MemoryEndpoint
+from tessw.test.test_mqttqueue  import FakeProducer
+
+# ----------------
+# Module constants
+# ----------------
+
+CONFIG_EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "files", "etc", "tessw", "config.example.ini")
+
+SECTIONS = ["mqtt", "mqtt_backup"]
+
+# -------
+# Classes
+# -------
+
+class FanOutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = configparser.ConfigParser()
+        self.parser.read(CONFIG_EXAMPLE)
+        self.parser.set("mqtt", "reading_qos", "1")
+        self.parser.add_section("mqtt_backup")
+        self.parser.set("mqtt_backup", "broker", "tcp:127.0.0.1:1")
+        self.patch(mqttservice, 'backoffPolicy', lambda **kwargs: lambda attempt: 0.05)
+        self.brokers = [FakeBroker(), FakeBroker()]
+
+    def build(self):
+        options = {'mqtt': loadBrokerSection(self.parser, "mqtt")}
+        options['mqtt_backup'] = loadBrokerSection(self.parser, "mqtt_backup", options['mqtt'])
+        self.service = FanOutService(options, SECTIONS)
+        return self.service
+
+    def connect(self, *sections):
+        for section, broker in zip(SECTIONS, self.brokers):
+            if section in sections:
+                self.service.getServiceNamed(section).endpoint.endpoints = [MemoryEndpoint(broker)]
+
+    @defer.inlineCallbacks
+    def shutdown(self):
+        yield self.service.stopService()
+        for broker in self.brokers:
+            yield broker.stop()
+        yield task.deferLater(reactor, 0.2, lambda: None)   # The client notifies disconnections 0.1s later
+
+    @defer.inlineCallbacks
+    def test_same_messages_to_every_broker(self):
+        self.build()
+        self.connect(*SECTIONS)
+        self.service.startService()
+        for seq in range(10):
+            self.service.addReading({'name': 'stars1', 'seq': seq})
+        for broker in self.brokers:
+            yield broker.waitFor(10)
+        payloads = [[message.payload for message in broker.messages] for broker in self.brokers]
+        self.assertEqual(payloads[0], payloads[1])
+        self.assertEqual(len(set(payloads[0])), 10)
+        yield self.shutdown()
+
+    @defer.inlineCallbacks
+    def test_unreachable_broker_does_not_stall(self):
+        self.build()
+        self.connect("mqtt")
+        self.service.startService()
+        for seq in range(10):
+            self.service.addReading({'name': 'stars1', 'seq': seq})
+        yield self.brokers[0].waitFor(10)
+        self.assertEqual(len(self.service.getServiceNamed("mqtt_backup").queue), 10)
+        yield self.shutdown()
+
+    def test_pause_only_when_all_saturated(self):
+        self.parser.set("mqtt", "queue_policy", "block")
+        self.parser.set("mqtt", "queue_size", "2")
+        self.parser.set("mqtt_backup", "queue_size", "4")
+        self.build()
+        producer = FakeProducer()
+        self.service.registerProducer(producer)
+        for seq in range(3):
+            self.service.addReading({'name': 'stars1', 'seq': seq})
+        self.assertTrue(self.service.getServiceNamed("mqtt").saturated)
+        self.assertFalse(producer.paused)
+        self.service.addReading({'name': 'stars1', 'seq': 3})
+        self.assertTrue(producer.paused)
+        # Draining any of them resumes the producers
+        backup = self.service.getServiceNamed("mqtt_backup").queue
+        while backup.saturated:
+            backup.poll()
+        self.assertFalse(producer.paused)
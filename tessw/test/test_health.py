@@ -0,0 +1,101 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial import unittest
+
+#--------------
+# local imports
+# -------------
+
+from tessw         import health
+from tessw.health  import PhotometerHealth, REGISTERING, ONLINE, DEGRADED, STALLED, OFFLINE
+from tessw.metrics import REGISTRY
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def transitions(label):
+    '''Exported transition counts of a photometer, by state'''
+    samples = REGISTRY.collect()['tessw_photometer_transitions_total']
+    return {labels['state']: value for labels, value in samples if labels['photometer'] == label}
+
+# -------
+# Classes
+# -------
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+
+class PhotometerHealthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = []
+        self.health  = PhotometerHealth('healthtest', 3, lambda health, previous: self.changes.append((previous, health.state)))
+
+    def test_lifecycle(self):
+        self.health.connect()
+        self.health.register()
+        self.health.hit()
+        self.assertEqual(self.health.state, ONLINE)
+        self.health.miss()
+        self.assertEqual(self.health.state, STALLED)
+        self.health.miss()
+        self.health.miss()
+        self.assertEqual(self.health.state, OFFLINE)
+        self.assertEqual([state for previous, state in self.changes], [REGISTERING, ONLINE, STALLED, OFFLINE])
+
+    def test_transitions_exported(self):
+        before = transitions('healthtest')
+        self.health.connect()
+        self.health.register()
+        self.health.miss()
+        self.health.hit()
+        after = transitions('healthtest')
+        self.assertEqual(after[REGISTERING] - before[REGISTERING], 1)
+        self.assertEqual(after[STALLED] - before[STALLED], 1)
+        self.assertEqual(after[ONLINE] - before[ONLINE], 1)
+        self.assertEqual(after[DEGRADED] - before[DEGRADED], 1)
+        self.assertEqual(after[OFFLINE] - before[OFFLINE], 0)
+
+    def test_slow_photometer_degraded(self):
+        clock = FakeTime()
+        self.patch(health, 'time', clock)
+        self.health = PhotometerHealth('healthtest', 3, lambda health, previous: self.changes.append((previous, health.state)), period=60)
+        self.health.connect()
+        self.health.register()
+        self.health.hit()
+        self.assertEqual(self.health.state, ONLINE)
+        clock.now += 180    # Every third period
+        self.health.hit()
+        self.assertEqual(self.health.state, DEGRADED)
+        for i in range(6):
+            clock.now += 60
+            self.health.hit()
+        self.assertEqual(self.health.state, DEGRADED)
+        clock.now += 60
+        self.health.hit()
+        self.assertEqual(self.health.state, ONLINE)
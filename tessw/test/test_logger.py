@@ -0,0 +1,141 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+import threading
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial    import unittest
+from twisted.internet import defer, reactor, task
+from twisted.logger   import LogLevel, PredicateResult, formatEvent
+
+#--------------
+# local imports
+# -------------
+
+from tessw.logger import AsyncFileLogObserver, RepeatFilterPredicate, FlightRecorder
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def event(fmt, level=LogLevel.info, namespace='test', **kwargs):
+    kwargs.update(log_format=fmt, log_level=level, log_namespace=namespace, log_time=time.time())
+    return kwargs
+
+# -------
+# Classes
+# -------
+
+class AsyncFileLogObserverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path     = self.mktemp()
+        self.observer = AsyncFileLogObserver(self.path)
+        self.observer.start()
+
+    def tearDown(self):
+        self.observer.stop()
+
+    def lines(self):
+        with open(self.path) as fd:
+            return fd.readlines()
+
+    def test_event_modified_after_logging(self):
+        sample = {'mag': 20.1}
+        self.observer(event("reading {sample}", sample=sample))
+        sample['mag'] = 0.0
+        self.observer.stop()
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn("reading {'mag': 20.1}", lines[0])
+
+    def test_formatted_in_writer_thread(self):
+        threads = []
+        def formatter(event):
+            threads.append(threading.current_thread())
+            return formatEvent(event) + '\n'
+        self.observer.formatter = formatter
+        self.observer(event("lag {lag:.3f} s", lag=0.12345))
+        self.assertEqual(threads, [])
+        self.observer.stop()
+        self.assertEqual(threads, [self.observer._thread])
+        self.assertEqual(self.lines(), ["lag 0.123 s\n"])
+
+    def test_unformattable_event(self):
+        def broken(event):
+            if event['log_format'] == 'broken':
+                raise ValueError("broken formatter")
+            return event['log_format'] + '\n'
+        self.observer.formatter = broken
+        for fmt in ('first', 'broken', 'last'):
+            self.observer(event(fmt))
+        self.observer.stop()
+        lines = self.lines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], "first\n")
+        self.assertIn("Unformattable event 'broken'", lines[1])
+        self.assertEqual(lines[2], "last\n")
+
+
+
+class RepeatFilterPredicateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.summaries = []
+        self.predicate = RepeatFilterPredicate(window=0.05)
+        self.predicate._log = lambda namespace, level, fmt, **kwargs: self.summaries.append(formatEvent(dict(kwargs, log_format=fmt)))
+        self.predicate.schedule()
+
+    def tearDown(self):
+        self.predicate.window = 0
+        self.predicate.schedule()
+
+    def test_same_message_different_fields(self):
+        self.assertEqual(self.predicate(event("mag {mag}", mag=20.1)), PredicateResult.maybe)
+        self.assertEqual(self.predicate(event("mag {mag}", mag=20.2)), PredicateResult.maybe)
+        self.assertEqual(self.predicate(event("mag {mag}", mag=20.1)), PredicateResult.no)
+        self.assertEqual(self.predicate(event("mag {mag}", mag=20.1, level=LogLevel.warn)), PredicateResult.maybe)
+
+    def test_format_specs_kept(self):
+        logged = event("lag {lag:.3f} s, {calls!r:>8}", lag=0.12345, calls='a')
+        self.predicate(logged)
+        self.assertEqual(formatEvent(logged), "lag 0.123 s,      'a'")
+
+    @defer.inlineCallbacks
+    def test_summary_after_burst(self):
+        sample = {'mag': 20.1}
+        for i in range(3):
+            self.predicate(event("reading {sample}", sample=sample))
+        sample['mag'] = 0.0
+        yield task.deferLater(reactor, 0.2, lambda: None)
+        self.assertEqual(self.summaries, ["Last message repeated 2 times: reading {'mag': 20.1}"])
+
+
+
+class FlightRecorderTestCase(unittest.TestCase):
+
+    def test_dump_events_as_logged(self):
+        recorder = FlightRecorder(2, self.mktemp())
+        sample = {'mag': 20.1}
+        for seq in range(3):
+            sample['seq'] = seq
+            recorder(event("reading {sample} in {t:.1f} s", level=LogLevel.debug, sample=sample, t=0.25))
+        sample['mag'] = 0.0
+        with open(recorder.dump()) as fd:
+            lines = fd.readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("reading {'mag': 20.1, 'seq': 1} in 0.2 s", lines[0])
+        self.assertIn("reading {'mag': 20.1, 'seq': 2} in 0.2 s", lines[1])
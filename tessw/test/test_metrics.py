@@ -0,0 +1,103 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import re
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial                   import unittest
+from twisted.web.test.requesthelper  import DummyRequest
+
+#--------------
+# local imports
+# -------------
+
+import tessw.mqttservice     # registers its metrics in REGISTRY
+import tessw.supervisor
+
+from tessw.metrics import REGISTRY, Registry, Counter, Gauge, Histogram, MetricsResource, CONTENT_TYPE
+
+# ----------------
+# Module constants
+# ----------------
+
+# name{label="value",...} value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? (\S+)$')
+
+# -------
+# Classes
+# -------
+
+class ExpositionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        counter = Counter("tessw_published_total", "Messages published", ("broker",), registry=self.registry)
+        counter.labels("mqtt").inc(3)
+        counter.labels('a "quoted"\\name').inc()
+        gauge = Gauge("tessw_queue_depth", "Queued messages", registry=self.registry)
+        gauge.setFunction(lambda: 7)
+        self.assertEqual(self.registry.exposition(), '\n'.join([
+            '# HELP tessw_published_total Messages published',
+            '# TYPE tessw_published_total counter',
+            'tessw_published_total{broker="a \\"quoted\\"\\\\name"} 1',
+            'tessw_published_total{broker="mqtt"} 3',
+            '# HELP tessw_queue_depth Queued messages',
+            '# TYPE tessw_queue_depth gauge',
+            'tessw_queue_depth 7',
+        ]) + '\n')
+
+    def test_histogram(self):
+        histogram = Histogram("tessw_latency_seconds", "Latency", buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(self.registry.exposition(), '\n'.join([
+            '# HELP tessw_latency_seconds Latency',
+            '# TYPE tessw_latency_seconds histogram',
+            'tessw_latency_seconds_bucket{le="0.1"} 1',
+            'tessw_latency_seconds_bucket{le="1.0"} 3',
+            'tessw_latency_seconds_bucket{le="+Inf"} 4',
+            'tessw_latency_seconds_sum 6.05',
+            'tessw_latency_seconds_count 4',
+        ]) + '\n')
+
+    def test_duplicate(self):
+        Counter("tessw_x_total", "X", registry=self.registry)
+        self.assertRaises(ValueError, Counter, "tessw_x_total", "X", registry=self.registry)
+
+    def test_registry_well_formed(self):
+        text = REGISTRY.exposition()
+        self.assertTrue(text.endswith('\n'))
+        typed = set()
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                name, kind = line.split()[2:]
+                self.assertIn(kind, ('counter', 'gauge', 'histogram'))
+                typed.add(name)
+            elif not line.startswith('# HELP '):
+                self.assertRegex(line, SAMPLE)
+                name = line.split('{')[0].split()[0]
+                if name not in typed:
+                    name = re.sub(r'_(bucket|sum|count)$', '', name)   # histogram samples
+                self.assertIn(name, typed)
+        self.assertEqual(typed, set(REGISTRY.metrics))
+
+    def test_resource(self):
+        Counter("tessw_x_total", "X", registry=self.registry).inc()
+        request = DummyRequest([b'metrics'])
+        body = MetricsResource(self.registry).render_GET(request)
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Content-Type'), [CONTENT_TYPE])
+        self.assertEqual(body, self.registry.exposition().encode('utf-8'))
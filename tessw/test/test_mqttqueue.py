@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from zope.interface              import implementer
+from twisted.trial               import unittest
+from twisted.internet.interfaces import IPushProducer
+
+#--------------
+# local imports
+# -------------
+
+from tessw.mqttqueue import Message, BoundedQueue, DROP_OLDEST, COALESCE, BLOCK
+
+# -------
+# Classes
+# -------
+
+@implementer(IPushProducer)
+class FakeProducer(object):
+
+    def __init__(self):
+        self.paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        pass
+
+
+
+class BoundedQueueTestCase(unittest.TestCase):
+
+    def build(self, policy, size=4):
+        queue = BoundedQueue(size, 1000000, policy)
+        producer = FakeProducer()
+        queue.registerProducer(producer)
+        return queue, producer
+
+    def test_drop_oldest_never_pauses(self):
+        queue, producer = self.build(DROP_OLDEST)
+        for i in range(10):
+            queue.put(Message("t", str(i), key='phot1'))
+        self.assertFalse(producer.paused)
+        self.assertFalse(queue.saturated)
+        self.assertEqual([message.payload for message in queue.pending], ['6', '7', '8', '9'])
+        self.assertEqual(queue.dropped, 6)
+
+    def test_coalesce_never_pauses(self):
+        queue, producer = self.build(COALESCE)
+        for i in range(4):
+            queue.put(Message("t", str(i), key='phot' + str(i)))
+        queue.put(Message("t", "new", key='phot2'))
+        self.assertFalse(producer.paused)
+        self.assertEqual([message.payload for message in queue.pending], ['0', '1', '3', 'new'])
+
+    def test_block_pauses_and_resumes(self):
+        queue, producer = self.build(BLOCK)
+        for i in range(4):
+            queue.put(Message("t", str(i)))
+        self.assertTrue(producer.paused)
+        queue.put(Message("t", "reading", key='phot9'))
+        self.assertEqual(queue.dropped, 1)
+        queue.poll()
+        self.assertTrue(producer.paused)
+        queue.poll()
+        self.assertFalse(producer.paused)
+
+    def test_block_keeps_control_messages(self):
+        queue, producer = self.build(BLOCK)
+        for i in range(4):
+            queue.put(Message("t", str(i), key='phot1'))
+        self.assertTrue(producer.paused)
+        queue.put(Message("t/register", "register"))
+        queue.put(Message("t/phot1/status", "status"))
+        self.assertEqual(queue.dropped, 0)
+        self.assertEqual([message.payload for message in queue.pending], ['0', '1', '2', '3', 'register', 'status'])
+
+    def test_ack_after_rewind(self):
+        queue, producer = self.build(DROP_OLDEST)
+        queue.put(Message("t", "0"))
+        queue.put(Message("t", "1"))
+        first = queue.poll()
+        queue.rewind()
+        queue.ack(first)
+        queue.ack(first)
+        self.assertEqual([message.payload for message in queue.pending], ['0', '1'])
+        message = queue.poll()
+        queue.ack(message)
+        queue.rewind()
+        self.assertEqual([message.payload for message in queue.pending], ['1'])
@@ -0,0 +1,172 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import sqlite3
+import configparser
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+
+#--------------
+# local imports
+# -------------
+
+from tessw             import mqttservice
+from tessw.config      import loadBrokerSection
+from tessw.mqttservice import MQTTService
+from tessw.fakebroker  import FakeBroker, MemoryEndpoint
+from tessw.metrics     import READING_LATENCY
+from tessw.trace       import Trace
+
+# ----------------
+# Module constants
+# ----------------
+
+CONFIG_EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "files", "etc", "tessw", "config.example.ini")
+
+# -------
+# Classes
+# -------
+
+class MQTTServiceStopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        parser = configparser.ConfigParser()
+        parser.read(CONFIG_EXAMPLE)
+        parser.set("mqtt", "broker", "tcp:127.0.0.1:1")
+        parser.set("mqtt", "outbox", self.mktemp())
+        parser.set("mqtt", "outbox_commit", "3600")
+        parser.set("mqtt", "batch_size", "10")
+        parser.set("mqtt", "batch_window", "3600000")
+        self.options = loadBrokerSection(parser, "mqtt")
+        self.service = MQTTService(self.options, "mqtt")
+
+    @defer.inlineCallbacks
+    def test_open_batches_saved_on_stop(self):
+        self.service.startService()
+        for seq in range(3):
+            self.service.addReading({'name': 'stars1', 'seq': seq, 'mag': 20.1})
+        self.assertEqual(len(self.service.queue), 0)
+        yield self.service.stopService()
+        connection = sqlite3.connect(self.options['outbox'])
+        topics = [row[0] for row in connection.execute("SELECT topic FROM outbox_t")]
+        connection.close()
+        self.assertEqual(topics, ["STARS4ALL/stars1/readings"])
+
+
+
+class MQTTServiceTraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        parser = configparser.ConfigParser()
+        parser.read(CONFIG_EXAMPLE)
+        parser.set("mqtt", "broker", "tcp:127.0.0.1:1")
+        parser.set("mqtt", "reading_qos", "1")
+        parser.set("mqtt", "batch_size", "2")
+        parser.set("mqtt", "batch_window", "3600000")
+        self.broker  = FakeBroker()
+        self.service = MQTTService(loadBrokerSection(parser, "mqtt"), "tracetest")
+        self.service.endpoint.endpoints = [MemoryEndpoint(self.broker)]
+        self.latency = READING_LATENCY.labels("tracetest")
+
+    @defer.inlineCallbacks
+    def test_batched_readings_traced_until_published(self):
+        self.service.startService()
+        self.service.addReading({'name': 'stars1', 'seq': 0}, Trace())
+        self.assertEqual(self.latency.count, 0)
+        self.service.addReading({'name': 'stars1', 'seq': 1}, Trace())
+        self.assertEqual(self.latency.count, 0)
+        messages = yield self.broker.waitFor(1)
+        self.assertTrue(messages[-1].topic.endswith("/stars1/readings"))
+        for i in range(50):
+            if self.latency.count:
+                break
+            yield task.deferLater(reactor, 0.01, lambda: None)   # Waits for the PUBACK
+        self.assertEqual(self.latency.count, 2)
+        yield self.service.stopService()
+        yield self.broker.stop()
+        yield task.deferLater(reactor, 0.2, lambda: None)   # The client notifies disconnections 0.1s later
+
+
+
+class MQTTServiceReconnectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        parser = configparser.ConfigParser()
+        parser.read(CONFIG_EXAMPLE)
+        parser.set("mqtt", "broker", "tcp:127.0.0.1:1")
+        parser.set("mqtt", "reading_qos", "1")
+        parser.set("mqtt", "window", "4")
+        self.patch(mqttservice, 'backoffPolicy', lambda **kwargs: lambda attempt: 0.05)
+        self.broker  = FakeBroker(dropEvery=100)
+        self.service = MQTTService(loadBrokerSection(parser, "mqtt"), "reconnecttest")
+        self.service.endpoint.endpoints = [MemoryEndpoint(self.broker)]
+
+    @defer.inlineCallbacks
+    def test_backlog_kept_while_disconnected(self):
+        self.service.startService()
+        for seq in range(500):
+            self.service.addReading({'name': 'stars1', 'seq': seq})
+        while len(set(message.payload for message in self.broker.messages)) < 500:
+            yield self.broker.waitFor(len(self.broker.messages) + 1)
+        # Only the messages in the window fail on each disconnection
+        self.assertLessEqual(self.service._nFailed.value, 5 * 4)
+        yield self.service.stopService()
+        yield self.broker.stop()
+        yield task.deferLater(reactor, 0.2, lambda: None)   # The client notifies disconnections 0.1s later
+
+
+
+class MQTTServiceSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = configparser.ConfigParser()
+        self.parser.read(CONFIG_EXAMPLE)
+        self.parser.set("mqtt", "broker", "tcp:127.0.0.1:1")
+        self.parser.set("mqtt", "reading_qos", "1")
+        self.parser.set("mqtt", "window", "4")
+        self.patch(mqttservice, 'backoffPolicy', lambda **kwargs: lambda attempt: 0.05)
+        self.broker = FakeBroker(dropEvery=7)
+
+    @defer.inlineCallbacks
+    def publishAll(self, clean_session):
+        self.parser.set("mqtt", "clean_session", clean_session)
+        service = MQTTService(loadBrokerSection(self.parser, "mqtt"), "sessiontest")
+        service.endpoint.endpoints = [MemoryEndpoint(self.broker)]
+        service.startService()
+        for seq in range(30):
+            service.addReading({'name': 'stars1', 'seq': seq})
+        while len(set(message.payload for message in self.broker.messages)) < 30:
+            yield self.broker.waitFor(len(self.broker.messages) + 1)
+        yield service.stopService()
+        yield self.broker.stop()
+        yield task.deferLater(reactor, 0.2, lambda: None)   # The client notifies disconnections 0.1s later
+        return self.broker.messages
+
+    @defer.inlineCallbacks
+    def test_persistent_session_resends_in_flight(self):
+        messages = yield self.publishAll("no")
+        # The MQTT session itself resends the unacknowledged messages,
+        # which are kept in flight instead of published again as new ones
+        self.assertTrue([message for message in messages if message.dup])
+        self.assertEqual(len([message for message in messages if not message.dup]), 30)
+
+    @defer.inlineCallbacks
+    def test_clean_session_publishes_again(self):
+        messages = yield self.publishAll("yes")
+        # The unacknowledged messages are rewound and published as new ones
+        self.assertEqual([message for message in messages if message.dup], [])
@@ -0,0 +1,122 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import sqlite3
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial    import unittest
+from twisted.internet import defer
+
+#--------------
+# local imports
+# -------------
+
+from tessw           import outbox
+from tessw.mqttqueue import Message
+from tessw.outbox    import Outbox, FETCH_SIZE
+
+# -------
+# Classes
+# -------
+
+class OutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path   = self.mktemp()
+        self.outbox = Outbox(self.path, 3, 3600)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.outbox.stop()
+
+    def rows(self):
+        connection = sqlite3.connect(self.path)
+        payloads = [row[0] for row in connection.execute("SELECT payload FROM outbox_t ORDER BY rowid")]
+        connection.close()
+        return payloads
+
+    @defer.inlineCallbacks
+    def test_group_commit(self):
+        for i in range(2):
+            self.outbox.put(Message("t", str(i)))
+        self.assertEqual(self.outbox.poll(), None)
+        yield self.outbox.flush()
+        self.assertEqual(self.rows(), ['0', '1'])
+        message = self.outbox.poll()
+        self.assertEqual(message.payload, '0')
+        self.outbox.ack(message)
+        yield self.outbox.flush()
+        self.assertEqual(self.rows(), ['1'])
+        self.assertEqual(len(self.outbox), 1)
+
+    @defer.inlineCallbacks
+    def test_trim_oldest(self):
+        for i in range(5):
+            self.outbox.put(Message("t", str(i)))
+        yield self.outbox.flush()
+        self.assertEqual(self.rows(), ['2', '3', '4'])
+        self.assertEqual(self.outbox.dropped, 2)
+        self.assertEqual(len(self.outbox), 3)
+        self.assertEqual(self.outbox.poll().payload, '2')
+
+    @defer.inlineCallbacks
+    def test_failed_commit_keeps_memory_state(self):
+        for i in range(3):
+            self.outbox.put(Message("t", str(i)))
+        yield self.outbox.flush()
+        inflight = self.outbox.poll()
+        def broken(cursor, n):
+            raise sqlite3.OperationalError("disk I/O error")
+        self.outbox._trim = broken
+        for i in range(3, 5):
+            self.outbox.put(Message("t", str(i)))
+        yield self.outbox.flush()
+        self.assertEqual(len(self.flushLoggedErrors(sqlite3.OperationalError)), 1)
+        self.assertEqual(self.rows(), ['0', '1', '2'])
+        self.assertEqual(self.outbox.dropped, 0)
+        self.assertEqual(len(self.outbox), 5)
+        self.assertEqual(self.outbox.poll().payload, '1')
+        del self.outbox._trim
+        self.outbox.ack(inflight)
+        yield self.outbox.flush()
+        self.assertEqual(self.rows(), ['2', '3', '4'])
+        self.assertEqual(self.outbox.dropped, 1)
+        self.assertEqual(len(self.outbox), 3)
+
+    @defer.inlineCallbacks
+    def test_backlog_read_while_committing(self):
+        self.outbox.size = 1000
+        for i in range(FETCH_SIZE + 50):
+            self.outbox.put(Message("t", str(i)))
+        yield self.outbox.flush()
+        for i in range(FETCH_SIZE):
+            self.outbox.poll()
+        # The commit thread has committed but the reactor has not been told yet
+        commits = []
+        def commitNow(f, *args):
+            commits.append((defer.Deferred(), f(*args)))
+            return commits[-1][0]
+        self.patch(outbox, 'deferToThread', commitNow)
+        for i in range(10):
+            self.outbox.put(Message("t", "n" + str(i)))
+        self.outbox.flush()
+        while self.outbox.poll() is not None:
+            pass
+        deferred, result = commits.pop()
+        deferred.callback(result)
+        self.assertEqual(self.outbox.poll(), None)
+        payloads = [message.payload for message in self.outbox._inflight.values()]
+        self.assertEqual(len(payloads), FETCH_SIZE + 60)
+        self.assertEqual(len(set(payloads)), FETCH_SIZE + 60)
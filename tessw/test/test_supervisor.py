@@ -0,0 +1,179 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import copy
+
+from collections import deque
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial               import unittest
+from twisted.internet            import defer
+from twisted.application.service import Service
+
+#--------------
+# local imports
+# -------------
+
+from tessw            import PHOTOMETER_SERVICE
+from tessw.config     import loadCfgFile
+from tessw.logger     import setLogLimits
+from tessw.health     import PhotometerHealth
+from tessw.supervisor import SupervisorService, POLL_DURATION
+
+# ----------------
+# Module constants
+# ----------------
+
+CONFIG_EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "files", "etc", "tessw", "config.example.ini")
+
+# -------
+# Classes
+# -------
+
+class FakeBuffer(object):
+
+    def __init__(self):
+        self.samples = deque()
+
+    def getBuffer(self):
+        return self.samples
+
+
+
+class FakePhotometer(Service):
+    '''Stands for a PhotometerService, without any serial port'''
+
+    def __init__(self, options, label):
+        self.options  = options
+        self.label    = label
+        self.info     = None
+        self.protocol = None
+        self.buffer   = FakeBuffer()
+        self.reloads  = 0
+
+    def getInfo(self):
+        return defer.succeed({'name': self.options['name']})
+
+    def handleInfo(self, sample):
+        pass
+
+    def reloadService(self, options):
+        self.reloads += 1
+
+
+
+class FakeMQTTService(object):
+
+    saturated = False
+
+    def __init__(self):
+        self.registered = []
+
+    def addRegisterRequest(self, info):
+        self.registered.append(info['name'])
+
+    def addStatus(self, status):
+        pass
+
+    def registerProducer(self, producer):
+        pass
+
+    def unregisterProducer(self, producer):
+        pass
+
+
+
+class FakeSupervisorService(SupervisorService):
+
+    def _buildPhotometer(self, label, options):
+        photometer = FakePhotometer(options, label)
+        photometer.setName(PHOTOMETER_SERVICE + ' ' + label[len('phot'):])
+        return photometer
+
+
+
+class SupervisorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.options = loadCfgFile(CONFIG_EXAMPLE)
+        self.service = FakeSupervisorService(self.options['global'])
+        self.service.mqttService    = FakeMQTTService()
+        self.service.archiveService = None
+        for i in range(1, self.options['global']['nphotom'] + 1):
+            label = 'phot' + str(i)
+            photometer = self.service._buildPhotometer(label, self.options[label])
+            photometer.setServiceParent(self.service)
+            self.service.photometers.append(photometer)
+            self.service._health[label] = PhotometerHealth(label, 3, self.service._onTransition)
+        self.service.running = 1
+
+    def tearDown(self):
+        self.service.unschedule()
+        setLogLimits(0, 0, 0)   # Stops the log summaries LoopingCall started by reloads
+
+    def test_poll_duration_both_modes(self):
+        photometer = self.service.photometers[0]
+        before = POLL_DURATION.count
+        photometer.buffer.samples.append({'name': 'stars1', 'mag': 20.1})
+        self.service.poll()
+        self.assertEqual(POLL_DURATION.count, before + 1)
+        # Aligned mode polls each photometer directly
+        photometer.buffer.samples.append({'name': 'stars1', 'mag': 20.1})
+        self.service.pollPhotometer(0)
+        self.assertEqual(POLL_DURATION.count, before + 2)
+
+
+    def reloadedOptions(self, nphotom):
+        options = copy.deepcopy(self.options)
+        options['global']['nphotom'] = nphotom
+        for i in range(2, nphotom + 1):
+            label = 'phot' + str(i)
+            options[label] = dict(options['phot1'], name='test' + str(i), mac_address='AA:BB:CC:DD:EE:0' + str(i))
+        return options
+
+    @defer.inlineCallbacks
+    def test_reload_adds_photometers(self):
+        phot1 = self.service.photometers[0]
+        yield self.service.reloadService(self.reloadedOptions(2))
+        self.assertEqual([phot.label for phot in self.service.photometers], ['phot1', 'phot2'])
+        self.assertIs(self.service.photometers[0], phot1)
+        self.assertEqual(phot1.reloads, 1)
+        self.assertEqual(self.service.photometers[1].parent, self.service)
+        self.assertIn('phot2', self.service._health)
+        self.assertEqual(self.service.mqttService.registered, ['test2'])
+
+    @defer.inlineCallbacks
+    def test_reload_restarts_changed_photometers(self):
+        yield self.service.reloadService(self.reloadedOptions(2))
+        phot1, phot2 = self.service.photometers
+        options = self.reloadedOptions(2)
+        options['phot2']['endpoint'] = 'tcp:192.168.4.2:23'
+        yield self.service.reloadService(options)
+        self.assertIs(self.service.photometers[0], phot1)
+        self.assertEqual(phot1.reloads, 2)
+        self.assertIsNot(self.service.photometers[1], phot2)
+        self.assertIsNone(phot2.parent)
+        self.assertEqual(self.service.photometers[1].options['endpoint'], 'tcp:192.168.4.2:23')
+        self.assertEqual(self.service.mqttService.registered, ['test2', 'test2'])
+
+    @defer.inlineCallbacks
+    def test_reload_removes_photometers(self):
+        yield self.service.reloadService(self.reloadedOptions(2))
+        phot2 = self.service.photometers[1]
+        yield self.service.reloadService(self.reloadedOptions(1))
+        self.assertEqual([phot.label for phot in self.service.photometers], ['phot1'])
+        self.assertIsNone(phot2.parent)
+        self.assertNotIn('phot2', self.service._health)
@@ -0,0 +1,62 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.trial import unittest
+
+#--------------
+# local imports
+# -------------
+
+from tessw.utils import mac_jitter, next_boundary
+
+# -------
+# Classes
+# -------
+
+class MacJitterTestCase(unittest.TestCase):
+
+    def test_deterministic(self):
+        self.assertEqual(mac_jitter("5C:CF:7F:76:65:0C", 10), mac_jitter("5C:CF:7F:76:65:0C", 10))
+
+    def test_separators_and_case(self):
+        offset = mac_jitter("5C:CF:7F:76:65:0C", 10)
+        self.assertEqual(mac_jitter("5c-cf-7f-76-65-0c", 10), offset)
+        self.assertEqual(mac_jitter("5CCF7F76650C", 10), offset)
+
+    def test_range(self):
+        macs = ["5C:CF:7F:76:65:{0:02X}".format(i) for i in range(256)]
+        offsets = [mac_jitter(mac, 10) for mac in macs]
+        self.assertTrue(all(0 <= offset < 10 for offset in offsets))
+        self.assertGreater(len(set(offsets)), 250)
+        self.assertEqual(mac_jitter(macs[0], 0), 0)
+
+
+
+class NextBoundaryTestCase(unittest.TestCase):
+
+    def test_next_boundary(self):
+        self.assertEqual(next_boundary(1000.5, 60), 1020)
+        self.assertEqual(next_boundary(1019.9, 60, 2.5), 1022.5)
+
+    def test_strictly_after(self):
+        self.assertEqual(next_boundary(1020, 60), 1080)
+        self.assertEqual(next_boundary(1022.5, 60, 2.5), 1082.5)
+
+    def test_rollover(self):
+        # Past this period's offset, the next boundary is in the next period
+        self.assertEqual(next_boundary(1023, 60, 2.5), 1082.5)
+        self.assertEqual(next_boundary(1079, 60, 59.5), 1079.5)
+        self.assertEqual(next_boundary(1079.6, 60, 59.5), 1139.5)
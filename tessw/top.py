@@ -0,0 +1,208 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+tessw-top: live terminal dashboard of a running tessw daemon,
+fed by its control socket (see tessw.control).
+
+    tessw-top [--socket /run/tessw/tessw.sock] [--interval 2] [--once]
+
+Rates, latencies and reactor lag are averaged over the refresh interval.
+Press q to quit.
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import sys
+import json
+import time
+import socket
+import argparse
+import datetime
+
+#--------------
+# local imports
+# -------------
+
+from tessw import CONTROL_SOCKET, TSTAMP_FORMAT
+
+# ----------------
+# Module constants
+# ----------------
+
+PHOTOMETER_HEADER = "{0:<6} {1:<12} {2:<11} {3:>8} {4:>7} {5:>6} {6:>6} {7:>7} {8:>7}".format(
+    "LABEL", "NAME", "STATE", "RATE/min", "MAG", "AGE", "AVAIL", "MISSES", "OVERWR")
+
+PHOTOMETER_ROW = "{label:<6} {name:<12.12} {state:<11} {rate:>8} {mag:>7} {age:>6} {avail:>6} {misses:>7} {overwrites:>7}"
+
+BROKER_HEADER = "{0:<10} {1:<5} {2:>7} {3:>8} {4:>8} {5:>10} {6:>7} {7:>10} {8:>8}".format(
+    "BROKER", "CONN", "QUEUE", "INFLIGHT", "DROPPED", "PUBLISHED", "FAILED", "LATENCY", "RATE/s")
+
+BROKER_ROW = "{broker:<10.10} {conn:<5} {queue:>7} {inflight:>8} {dropped:>8} {published:>10} {failed:>7} {latency:>10} {rate:>8}"
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def cmdline():
+    parser = argparse.ArgumentParser(prog='tessw-top', description="Live dashboard of a running tessw daemon")
+    parser.add_argument('--socket', type=str, default=CONTROL_SOCKET, metavar='<path>', help='daemon control socket')
+    parser.add_argument('--interval', type=float, default=2.0, metavar='<seconds>', help='refresh interval')
+    parser.add_argument('--once', action='store_true', help='print a single snapshot and exit')
+    return parser.parse_args()
+
+
+def request(path, command, timeout=5):
+    '''Synchronous request to the daemon control socket. Returns its result'''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall(command.encode('utf-8') + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise IOError("Connection closed by the daemon")
+            data += chunk
+    finally:
+        sock.close()
+    response = json.loads(data.decode('utf-8'))
+    if not response['ok']:
+        raise IOError(response['error'])
+    return response['result']
+
+
+def _delta(current, previous, key, dt):
+    '''Rate per second of a counter between two snapshots'''
+    if previous is None or not dt:
+        return None
+    return (current[key] - previous[key]) / dt
+
+
+def _average(current, previous):
+    '''Average of a histogram ({count, sum}) between two snapshots'''
+    if previous is None:
+        count, total = current['count'], current['sum']
+    else:
+        count, total = current['count'] - previous['count'], current['sum'] - previous['sum']
+    return total / count if count > 0 else None
+
+
+def _fmt(value, spec, missing='-'):
+    return missing if value is None else format(value, spec)
+
+
+def _age(tstamp, now):
+    if tstamp is None:
+        return None
+    then = datetime.datetime.strptime(tstamp, TSTAMP_FORMAT)
+    return (now - then).total_seconds()
+
+
+def render(status, previous=None, dt=None):
+    '''Dashboard text lines of a status snapshot, with rates since a previous one'''
+    now = datetime.datetime.utcnow()
+    lag = _average(status['reactor']['lag'], previous and previous['reactor']['lag'])
+    lines = [
+        "tessw {0}".format(status['version']),
+        "up {0}   {1}   reactor lag avg {2} ms, max {3} ms   {4}".format(
+            datetime.timedelta(seconds=int(status['uptime'])),
+            "PAUSED" if status['paused'] else "polling",
+            _fmt(lag and 1000*lag, '.1f'), _fmt(1000*status['reactor']['lag_max'], '.1f'),
+            now.strftime("%H:%M:%S UTC")),
+        "",
+        PHOTOMETER_HEADER,
+    ]
+    before = {phot['label']: phot for phot in previous['photometers']} if previous else {}
+    for phot in status['photometers']:
+        rate = _delta(phot, before.get(phot['label']), 'parsed', dt)
+        if rate is None and phot.get('interval'):
+            rate = 1 / phot['interval']     # polled samples, on the first snapshot
+        reading = phot.get('reading') or {}
+        lines.append(PHOTOMETER_ROW.format(
+            label      = phot['label'],
+            name       = phot.get('name') or '-',
+            state      = phot.get('state', '-'),
+            rate       = _fmt(rate and 60*rate, '.1f'),
+            mag        = _fmt(reading.get('mag'), '.2f'),
+            age        = _fmt(_age(phot.get('tstamp'), now), '.0f'),
+            avail      = _fmt(phot.get('availability') and 100*phot['availability'], '.0f'),
+            misses     = phot.get('poll_misses', '-'),
+            overwrites = phot['overwrites'],
+        ))
+    lines.extend(["", BROKER_HEADER])
+    before = {broker['broker']: broker for broker in previous['brokers']} if previous else {}
+    for broker in status['brokers']:
+        old = before.get(broker['broker'])
+        latency = _average(broker['latency'], old and old['latency'])
+        lines.append(BROKER_ROW.format(
+            broker    = broker['broker'],
+            conn      = "yes" if broker['connected'] else "NO",
+            queue     = broker['queue'],
+            inflight  = broker['inflight'],
+            dropped   = broker['dropped'],
+            published = broker['published'],
+            failed    = broker['failed'],
+            latency   = _fmt(latency and 1000*latency, '.1f') + " ms",
+            rate      = _fmt(_delta(broker, old, 'published', dt), '.2f'),
+        ))
+    return lines
+
+
+def dashboard(screen, options):
+    import curses
+    curses.curs_set(0)
+    screen.timeout(int(options.interval * 1000))
+    previous, before = None, None
+    while True:
+        try:
+            status = request(options.socket, "status")
+        except Exception as e:
+            lines = ["tessw-top: cannot query {0}: {1}".format(options.socket, e)]
+            previous = None
+        else:
+            now = time.monotonic()
+            lines = render(status, previous, before and now - before)
+            previous, before = status, now
+        screen.erase()
+        height, width = screen.getmaxyx()
+        for y, line in enumerate(lines[:height-1]):
+            screen.addnstr(y, 0, line, width - 1, curses.A_REVERSE if line in (PHOTOMETER_HEADER, BROKER_HEADER) else curses.A_NORMAL)
+        screen.addnstr(height-1, 0, "q: quit", width - 1)
+        screen.refresh()
+        if screen.getch() in (ord('q'), ord('Q')):
+            return
+
+
+def main():
+    options = cmdline()
+    if options.once:
+        try:
+            print('\n'.join(render(request(options.socket, "status"))))
+        except Exception as e:
+            sys.stderr.write("tessw-top: cannot query {0}: {1}\n".format(options.socket, e))
+            sys.exit(1)
+        return
+    import curses
+    try:
+        curses.wrapper(dashboard, options)
+    except KeyboardInterrupt:
+        pass
+
+
+__all__ = [
+    "request",
+    "render",
+]
+
+
+if __name__ == '__main__':
+    main()
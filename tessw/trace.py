@@ -0,0 +1,136 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Per-reading latency tracing.
+
+A reading gets a Trace when its line is received from the photometer,
+under the TRACE key, and a monotonic timestamp is added at each pipeline
+boundary (STAGES). The supervisor takes it out of the reading before
+curating it, so it never reaches the payload nor the archive, and hands
+it to the MQTT service, which keeps it in the queued Message until
+the publication completes.
+
+The time spent between consecutive stages is aggregated in the
+tessw_reading_stage_seconds{stage} histogram and the whole pipeline
+in tessw_reading_latency_seconds{broker}. One in every N traces can
+also be logged (see setSampling).
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger import Logger
+
+#--------------
+# local imports
+# -------------
+
+from tessw.metrics import READING_STAGE, READING_LATENCY
+
+# ----------------
+# Module constants
+# ----------------
+
+# Key under which the trace travels with the reading dictionary
+TRACE = '_trace'
+
+# Pipeline boundaries, in order
+STAGES = (
+    'received',     # line received from the photometer
+    'buffered',     # written to the photometer buffer
+    'polled',       # popped from the buffer by the supervisor
+    'curated',      # curated for MQTT
+    'queued',       # put in the MQTT queue (or batch)
+    'published',    # publication completed (acknowledged for QoS > 0)
+)
+
+# Service Logging namespace
+NAMESPACE = 'trace'
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log  = Logger(namespace=NAMESPACE)
+
+# Histogram children, by stage index
+_stages = [None] + [READING_STAGE.labels(stage) for stage in STAGES[1:]]
+
+# Log one in every _sampling finished traces (0 = never)
+_sampling = 0
+_finished = 0
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def setSampling(n):
+    '''Log one in every n finished traces, 0 to disable it'''
+    global _sampling
+    _sampling = n
+
+# -------
+# Classes
+# -------
+
+class Trace(object):
+    '''Monotonic timestamps of a reading at each stage reached so far'''
+
+    __slots__ = ('times', 'observed')
+
+    def __init__(self, start=None):
+        self.times    = [time.monotonic() if start is None else start]
+        self.observed = 1     # stages already aggregated in the histograms
+
+    def mark(self):
+        self.times.append(time.monotonic())
+
+    def branch(self):
+        '''
+        Independent copy for each broker the reading is published to.
+        Stages already observed are not observed again by the copies.
+        '''
+        trace = Trace.__new__(Trace)
+        trace.times    = list(self.times)
+        trace.observed = self.observed
+        return trace
+
+    def observe(self):
+        '''Aggregate the stages reached since the last call'''
+        times = self.times
+        for i in range(self.observed, len(times)):
+            _stages[i].observe(times[i] - times[i-1])
+        self.observed = len(times)
+
+    def finish(self, name, broker):
+        '''Last stage reached for this broker'''
+        global _finished
+        self.observe()
+        times = self.times
+        READING_LATENCY.labels(broker).observe(times[-1] - times[0])
+        _finished += 1
+        if _sampling and _finished % _sampling == 0:
+            log.info("{name} via {broker}: {stages}, total {total:.1f} ms", name=name, broker=broker,
+                stages=', '.join("{0} +{1:.1f} ms".format(STAGES[i], 1000*(times[i] - times[i-1])) for i in range(1, len(times))),
+                total=1000*(times[-1] - times[0]))
+
+
+__all__ = [
+    "TRACE",
+    "STAGES",
+    "Trace",
+    "setSampling",
+]
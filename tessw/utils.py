@@ -11,6 +11,8 @@
 from __future__ import division, absolute_import
 
 import sys
+import math
+import zlib
 import datetime
 import argparse
 import re
@@ -56,8 +58,22 @@ def chop(value, sep=None):
     return chopped
 
 
+def mac_jitter(mac, jitter):
+    '''Deterministic offset in [0, jitter) seconds derived from a MAC address.
+    Equal MACs always give the same offset, regardless of the separator used'''
+    key = mac.upper().replace(':','').replace('-','').encode('ascii')
+    return jitter * (zlib.crc32(key) & 0xffffffff) / 2**32
+
+
+def next_boundary(now, period, offset=0.0):
+    '''Next wall-clock instant k*period + offset strictly after now'''
+    return (math.floor((now - offset) / period) + 1) * period + offset
+
+
 
 __all__ = [
     "chop",
-    "merge_two_dicts"
+    "merge_two_dicts",
+    "mac_jitter",
+    "next_boundary",
 ]